@@ -1,15 +1,27 @@
+import asyncio
 import json
+import logging
+import math
+import time
+from dataclasses import dataclass, replace
 from fastapi import APIRouter, HTTPException, status
-from ..models.schema import TaleRequest, TaleResponse, LlmJsonResponse
-from ..services import rag_service, llm_service
+from fastapi.responses import StreamingResponse
+from ..models.schema import (
+    TaleRequest, TaleResponse, LlmJsonResponse, StoryAction, StorySession,
+    SessionCreateRequest, SessionCreateResponse, SessionTurnRequest
+)
+from ..services import rag_service, llm_service, llm_dispatch, llm_cassette, admission, summary_scheduler, session_store, prompt_builder, telemetry
+from ..services.speculation import speculative_turns
 from ..core.config import settings
-from typing import List, Dict, Any, Optional
+from ..core.log import log_payload
+from ..utils.json_stream import StorySegmentStreamParser
+from typing import AsyncIterator, Awaitable, Callable, List, Dict, Any, Optional
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
-MAX_HISTORY_FOR_PROMPT = 10 # Number of recent interactions to include directly
+MAX_HISTORY_FOR_PROMPT = 10 # Upper bound on recent interactions in the prompt (the token budget may use fewer)
 MAX_HISTORY_FOR_RAG_QUERY = 6 # Number of recent interactions for RAG query
-SUMMARIZE_TURN_INTERVAL = 7 # How often to summarize
 
 @router.get("/tales", response_model=List[str])
 async def get_tales_list():
@@ -19,24 +31,55 @@ async def get_tales_list():
          raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No tales found or metadata not loaded.")
     return tales
 
-@router.post("/generate-tale", response_model=TaleResponse)
-async def generate_tale_segment(request: TaleRequest):
-    """Generates the next story segment based on user action and tale context."""
-    print(f"\n--- Turn {request.currentTurnNumber} for Tale: {request.taleId} ---")
+@router.get("/rag/stats")
+async def get_rag_stats():
+    """Returns retrieval executor, embedding batcher, cache and vector index metrics."""
+    return {
+        "executor": rag_service.get_executor_stats(),
+        "embedding_batcher": rag_service.get_batcher_stats(),
+        "cache": rag_service.get_cache_stats(),
+        "vector_index": rag_service.get_vector_index_stats()
+    }
+
+@dataclass
+class PreparedTurn:
+    """Everything needed to run the story LLM call for one turn."""
+    system_prompt: str
+    user_prompt: str
+    story_model: Optional[str]
+    temperature: float
+    current_summary: str # Summary the prompt was built from (returned to the client)
+    summary_state: Optional[summary_scheduler.SummaryState] = None # Handed to the next turn
+    summary_task: Optional[asyncio.Task] = None # Background summary scheduled by this turn
+    prompt_tokens: Optional[Dict[str, Any]] = None # Token breakdown of the prompt (debug mode)
+
+    def hand_over_summary(self, request: TaleRequest, response: TaleResponse):
+        """Parks the scheduled summary (if any) for the next turn instead of waiting for it."""
+        state = self.summary_state or summary_scheduler.SummaryState(response.updatedSummary)
+        if self.summary_task is not None:
+            state = replace(state, pending=self.summary_task, pending_turn=request.currentTurnNumber)
+        summary_scheduler.hand_over_summary(
+            state, request.taleId, response.nextTurnNumber, _next_history(request, response)
+        )
+        self.summary_task = None
+
+async def prepare_turn(request: TaleRequest) -> PreparedTurn:
+    """Runs action parsing and RAG, schedules summarization and builds the story prompts."""
+    logger.info("Turn %d for tale '%s'", request.currentTurnNumber, request.taleId)
     
     # Extract debug configuration if present
     debug_config = request.debugConfig
     if debug_config:
-        print(f"Debug config received: {debug_config}")
+        log_payload(logger, "Debug config", debug_config)
 
     # --- 1. Determine User Action ---
     last_user_action_text = ""
     if request.action.choice:
         last_user_action_text = f"My choice: {request.action.choice}"
-        print(f"Action: Choice = '{request.action.choice}'")
+        logger.debug("Action: Choice = '%s'", request.action.choice)
     elif request.action.customInput:
         last_user_action_text = f"My custom action: {request.action.customInput}"
-        print(f"Action: Custom = '{request.action.customInput}'")
+        logger.debug("Action: Custom = '%s'", request.action.customInput)
     else:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No valid action (choice or customInput) provided.")
 
@@ -44,10 +87,21 @@ async def generate_tale_segment(request: TaleRequest):
     current_turn_history = request.storyHistory + [f"> {last_user_action_text}"] # Add prefix for clarity if needed
 
     # --- 2. Summarization ---
-    print("Summarization triggered.")
-    # Find history segments since last assumed summary point
-    start_index = max(0, len(request.storyHistory) - SUMMARIZE_TURN_INTERVAL * 2) # Look back interval*2 turns roughly
-    recent_developments = request.storyHistory[start_index:] + [f"> {last_user_action_text}"] # Include current action
+    # Only on the configured interval or when unsummarized history overflows the
+    # token budget. It runs in the background; this turn's prompt and response
+    # use the current summary and the new one is picked up by the next turn.
+    with telemetry.stage("summary_wait", _request_model_key(request)):
+        summary_state = await summary_scheduler.take_summary(
+            request.taleId, request.currentTurnNumber, request.currentSummary, request.storyHistory
+        )
+    current_summary = summary_state.summary
+    recent_developments = summary_scheduler.recent_developments(
+        request.storyHistory, request.currentTurnNumber, f"> {last_user_action_text}", summary_state.covered_turn
+    )
+    summary_trigger = summary_scheduler.summary_trigger(
+        request.currentTurnNumber, recent_developments, MAX_HISTORY_FOR_PROMPT,
+        summary_state.covered_turn, pending=summary_state.pending is not None
+    )
     
     # Get summary model and temperature from debug config if available
     summary_model = None
@@ -61,33 +115,37 @@ async def generate_tale_segment(request: TaleRequest):
         temperature = debug_config.temperature if hasattr(debug_config, 'temperature') else temperature
         
         if summary_model:
-            print(f"Using custom summary model: {summary_model}")
+            logger.debug("Using custom summary model: %s", summary_model)
         if summary_system_prompt:
-            print(f"Using custom summary system prompt")
-        print(f"Using temperature: {temperature}")
+            logger.debug("Using custom summary system prompt")
+        logger.debug("Using temperature: %s", temperature)
             
         # Replace placeholders if they exist in the custom summary prompt
         if summary_system_prompt:
             summary_system_prompt = summary_system_prompt.replace("{tale_title}", request.taleId)
-            summary_system_prompt = summary_system_prompt.replace("{existing_summary}", request.currentSummary)
+            summary_system_prompt = summary_system_prompt.replace("{existing_summary}", current_summary)
     
-    current_summary = await llm_service.summarize_story(
-        request.currentSummary, 
-        recent_developments, 
-        request.taleId,
-        model=summary_model,
-        custom_system_prompt=summary_system_prompt,
-        temperature=temperature
-    )
+    summary_task = None
+    if summary_trigger:
+        logger.info("Summarization scheduled (%s).", summary_trigger)
+        summary_task = summary_scheduler.schedule_summary(
+            current_summary,
+            recent_developments, 
+            request.taleId,
+            model=summary_model,
+            custom_system_prompt=summary_system_prompt,
+            temperature=temperature
+        )
 
     # --- 3. RAG Context Retrieval ---
     # Create query from most recent interactions
     rag_query_history = current_turn_history[-MAX_HISTORY_FOR_RAG_QUERY:]
     rag_query_text = "\n".join(rag_query_history)
-    original_tale_context = rag_service.retrieve_relevant_chunks(
-        request.taleId, rag_query_text, k=7 # Retrieve top 7 chunks
+    rag_start = time.perf_counter()
+    rag_chunks = await rag_service.aretrieve_relevant_docs(
+        request.taleId, rag_query_text, k=7 # Retrieve up to 7 chunks, the prompt budget decides how many are used
     )
-    print(f"RAG Context: {original_tale_context[:200]}...")
+    rag_seconds = time.perf_counter() - rag_start
 
     # --- 4. Construct LLM Prompt ---
     # Use custom system prompt if provided in debug config
@@ -98,86 +156,384 @@ async def generate_tale_segment(request: TaleRequest):
         custom_system_prompt = debug_config.systemPrompt if hasattr(debug_config, 'systemPrompt') else None
         story_model = debug_config.storyModel if hasattr(debug_config, 'storyModel') else None
         if custom_system_prompt:
-            print(f"Using custom system prompt")
+            logger.debug("Using custom system prompt")
         if story_model:
-            print(f"Using custom story model: {story_model}")
-    
-    if custom_system_prompt:
-        # Use the custom system prompt (frontend is responsible for proper formatting)
-        system_prompt = custom_system_prompt
-        
-        # Replace placeholders if they exist in the custom prompt
-        system_prompt = system_prompt.replace("{request.taleId}", request.taleId)
-        system_prompt = system_prompt.replace("{current_summary}", current_summary)
-        system_prompt = system_prompt.replace("{original_tale_context}", original_tale_context)
-    else:
-        # Default system prompt
-        system_prompt = f"""
-Du bist ein klassischer Erzähler im Stil deutscher Volksmärchen. Deine Sprache ist kindgerecht, bildhaft und leicht verständlich geeignet für Kinder zwischen 6 und 10 Jahren. 
-Du schreibst ausschließlich in: der dritten Person Singular, der Vergangenheitsform (Präteritum), einem märchentypischen Ton: ruhig, geheimnisvoll, poetisch, aber klar. Beispiel: „Der Mond schien silbern auf den moosigen Pfad, als Rotkäppchen ihren ersten Schritt ins Dunkel wagte.
-Vermeide vollständig: moderne Begriffe, Konzepte oder Objekte (z.B. Handy, Firma, Polizei, Auto), Gewalt ohne moralischen Kontext, Ironie, Sarkasmus oder Meta-Kommentare, Fremdwörter, Anglizismen oder komplizierte Satzstrukturen. Negativ-Beispiel: „Plötzlich kam ein Polizeiwagen angerast."
-Stilmittel, die bevorzugt verwendet werden sollen: stimmungsvolle Bilder, sanfte Wiederholungen und rhythmische Satzführung, archetypische Märchenfiguren und -orte
-Aktuelles Märchen: "{request.taleId}"
-Hier ist die bisherige Handlung: {current_summary}
-{original_tale_context} 
-Die Handlung soll sich besonders an den letzten Nutzerentscheidungen und history entries orientieren.
-Verfasse eine neue kurze Szene mit 6 bis 10 Sätzen. Strukturiere jede Szene nach folgendem Muster:
-1. Einstieg in die Situation oder Umgebung  
-2. Ein zentrales Ereignis oder eine neue Wendung  
-3. Abschluss mit offenem Ende, das eine neue Entscheidung oder Entwicklung vorbereitet
-Diese Szene soll: logisch und kohärent auf den bisherigen Verlauf aufbauen, innerhalb des etablierten Märchenrahmens bleiben, eine originelle Wendung darstellen, offen genug enden, um eine weitere Entscheidung zu ermöglichen
-
-Bevor du antwortest, prüfe: Ist die Szene stilistisch und thematisch einwandfrei im Märchengenre verankert? Ist sie altersgerecht, logisch und frei von modernen oder stilfremden Elementen?
-Priorisiere in deiner Geschichte immer die letzte Auswahl "My Choice:". Falls du bei einer Frage unsicher bist: Überarbeite die Szene vollständig.
-Gib ausschließlich den Märchentext aus. Verzicht auf Einleitungen, Erklärungen oder Meta-Kommentare. Liefere den Text als kohärente Erzählpassage " keine Aufzählung. Beginne direkt mit der ersten Zeile der Geschichte.
-HANDLUNGSOPTIONEN
-Erzeuge die Handlungsoptionen unmittelbar nach der Szene, ohne Zwischenkommentar oder Einleitung, gib drei Entscheidungsoptionen für die Nutzer aus, damit sie die Geschichte aktiv mitgestalten kann:
-1. **Option A – Storynahe Fortsetzung**  
-   Eine Handlung, die erwartbar und logisch auf die Szene folgt und den traditionellen Märchenverlauf weiterführt.
-2. **Option B – Alternative Wendung**  
-   Eine kreative, aber genre- und stilgerechte Abweichung vom bekannten Verlauf. Diese Option darf überraschend sein, aber muss in der Märchenwelt glaubwürdig bleiben. Stelle sicher, dass sich Option A und B in Handlung, Ton oder Risiko deutlich unterscheiden, um eine echte Wahlmöglichkeit zu bieten.
-Jede Option soll sprachlich einfach, stimmungsvoll und kindgerecht formuliert sein. Die Vorschläge müssen **zur erzählten Szene passen**, dürfen aber **nicht deren Inhalt wiederholen**.
-Format your entire response content ONLY as a valid JSON object string, DONT use markdown and keep the output format cause its very important: {{"storySegment": "...", "choices": ["...", "..."]}}"""
+            logger.debug("Using custom story model: %s", story_model)
     
-    # User prompt part contains recent history
-    prompt_history = current_turn_history[-MAX_HISTORY_FOR_PROMPT:]
-    user_prompt = f"""Recent Interaction History:
-{'[Start of History]' if len(current_turn_history) <= MAX_HISTORY_FOR_PROMPT else '[... earlier history summarized ...]'}
-{chr(10).join(prompt_history)}
+    model_key = llm_service.provider_key(story_model)
+    telemetry.observe_stage("rag", model_key, rag_seconds)
 
-(The user's most recent action is the last message in the history above)
-
-Your JSON Response:"""
+    # Default: static per-tale system prompt (cacheable prefix), per-turn summary
+    # and RAG context at the start of the user message. A custom system prompt
+    # (frontend is responsible for proper formatting) gets them via placeholders.
+    with telemetry.stage("prompt", model_key):
+        prompt = prompt_builder.assemble_story_prompt(
+            request.taleId,
+            current_summary,
+            rag_chunks,
+            request.storyHistory,
+            f"> {last_user_action_text}",
+            model=story_model,
+            custom_system_prompt=custom_system_prompt or None,
+            max_history_entries=MAX_HISTORY_FOR_PROMPT
+        )
+    tokens = prompt.breakdown
+    logger.info(
+        "Prompt tokens: %d/%d (summary %d, RAG %d/%d chunks, history %d/%d entries)",
+        tokens['total'], tokens['budget'], tokens['summary'], tokens['ragChunksUsed'], tokens['ragChunksAvailable'],
+        tokens['historyEntriesUsed'], tokens['historyEntriesAvailable']
+    )
+    log_payload(logger, "Story system prompt", prompt.system_prompt)
+    log_payload(logger, "Story user prompt", prompt.user_prompt)
     
-    print(f"System prompt length: {len(system_prompt)}")
-    print(f"User prompt length: {len(user_prompt)}")
+    return PreparedTurn(
+        system_prompt=prompt.system_prompt,
+        user_prompt=prompt.user_prompt,
+        story_model=story_model,
+        temperature=temperature,
+        current_summary=current_summary,
+        summary_state=summary_state,
+        summary_task=summary_task,
+        prompt_tokens=prompt.breakdown
+    )
+
+async def run_turn(request: TaleRequest) -> TaleResponse:
+    """Runs one full (non-streaming) turn and returns the response."""
+    debug_config = request.debugConfig
+    turn = await prepare_turn(request)
+    model_key = llm_service.provider_key(turn.story_model)
     
     # --- 5. Generate LLM Response ---
-    llm_json_response, raw_llm_response = await llm_service.generate_llm_response(
-        system_prompt, 
-        user_prompt,
-        model=story_model,
-        temperature=temperature
-    )
+    try:
+        with telemetry.stage("llm", model_key):
+            llm_json_response, raw_llm_response = await llm_service.generate_llm_response(
+                turn.system_prompt, 
+                turn.user_prompt,
+                model=turn.story_model,
+                temperature=turn.temperature
+            )
+    except (asyncio.CancelledError, llm_dispatch.ProviderSaturated):
+        # e.g. a discarded speculative turn, or every provider at its concurrency limit
+        summary_scheduler.cancel_summary(turn.summary_task)
+        raise
 
     if not llm_json_response:
-         print("Error: Failed to get valid response from LLM.")
+         logger.error("Failed to get valid response from LLM.")
+         summary_scheduler.cancel_summary(turn.summary_task)
          raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="LLM service failed to generate a valid response.")
 
-    print(f"Response generated with {len(llm_json_response['storySegment'])} chars in story segment")
-    print(f"Number of choices: {len(llm_json_response['choices'])}")
+    logger.info("Response generated: %d chars in story segment, %d choices",
+                len(llm_json_response['storySegment']), len(llm_json_response['choices']))
     
     # --- 6. Prepare Response ---
     try:
         response_data = TaleResponse(
             storySegment=llm_json_response['storySegment'],
             choices=llm_json_response['choices'],
-            updatedSummary=current_summary,
+            updatedSummary=turn.current_summary,
             nextTurnNumber=request.currentTurnNumber + 1,
-            rawResponse=raw_llm_response if debug_config else None  # Only include raw response in debug mode
+            rawResponse=raw_llm_response if debug_config else None,  # Only include raw response in debug mode
+            promptTokens=turn.prompt_tokens if debug_config else None
         )
-        print(f"--- Turn End ---")
-        return response_data
     except Exception as e:
-         print(f"Error creating final response: {e}")
-         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to construct final response.")
\ No newline at end of file
+         logger.error("Error creating final response: %s", e)
+         summary_scheduler.cancel_summary(turn.summary_task)
+         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Failed to construct final response.")
+    turn.hand_over_summary(request, response_data)
+    logger.debug("Turn end")
+    return response_data
+
+def _action_history_entry(action: StoryAction) -> str:
+    """History entry for an action, in the same form the frontend records it."""
+    if action.choice:
+        return f"> {action.choice}"
+    return f"> (Custom) {action.customInput}"
+
+def _require_action(action: StoryAction):
+    if not action.choice and not action.customInput:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No valid action (choice or customInput) provided.")
+
+def _next_history(request: TaleRequest, response: TaleResponse) -> List[str]:
+    return request.storyHistory + [_action_history_entry(request.action), response.storySegment]
+
+def _schedule_speculation(request: TaleRequest, response: TaleResponse):
+    """Pre-generates the follow-up turn for each offered choice (if enabled)."""
+    speculative_turns.schedule(request, response, _next_history(request, response), run_turn)
+
+async def run_turn_speculative(request: TaleRequest) -> TaleResponse:
+    """Serves a pre-generated turn if one matches, otherwise runs it; then speculates ahead."""
+    response = await speculative_turns.take(request)
+    if response is not None:
+        logger.info("Speculation hit for turn %d of '%s'.", request.currentTurnNumber, request.taleId)
+    else:
+        response = await run_turn(request)
+    _schedule_speculation(request, response)
+    return response
+
+def _request_model_key(request: TaleRequest) -> str:
+    debug_config = request.debugConfig
+    return llm_service.provider_key(debug_config.storyModel if debug_config else None)
+
+async def run_turn_timed(endpoint: str, request: TaleRequest) -> TaleResponse:
+    """run_turn_speculative, recorded as the turn's total latency and outcome."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        response = await run_turn_speculative(request)
+        outcome = "ok"
+        return response
+    except llm_dispatch.ProviderSaturated:
+        outcome = "saturated"
+        raise
+    finally:
+        telemetry.observe_stage("total", _request_model_key(request), time.perf_counter() - start)
+        telemetry.TURNS_TOTAL.inc(endpoint=endpoint, outcome=outcome)
+
+@router.post("/generate-tale", response_model=TaleResponse)
+async def generate_tale_segment(request: TaleRequest):
+    """Generates the next story segment based on user action and tale context."""
+    return await run_turn_timed("generate", request)
+
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+async def stream_turn_events(
+    request: TaleRequest,
+    turn: PreparedTurn,
+    on_complete: Optional[Callable[[TaleResponse], Awaitable[None]]] = None
+) -> AsyncIterator[str]:
+    """
+    Streams one prepared turn as server-sent events.
+
+    Emits `segment` events with storySegment text as the LLM produces it, then
+    `choices`, `summary` and a final `done` event carrying the full TaleResponse.
+    An `error` event is sent instead if generation fails mid-stream.
+    """
+    debug_config = request.debugConfig
+    parser = StorySegmentStreamParser()
+    try:
+        try:
+            async for delta in llm_service.stream_llm_response(
+                turn.system_prompt,
+                turn.user_prompt,
+                model=turn.story_model,
+                temperature=turn.temperature
+            ):
+                text = parser.feed(delta)
+                if text:
+                    yield _sse_event("segment", {"text": text})
+        except Exception as e:
+            logger.error("LLM Stream Error: %s", e)
+            error = {"detail": "LLM service failed while streaming the response."}
+            retry_after = getattr(e, "retry_after", None)
+            if retry_after is not None:
+                error = {"detail": "All LLM providers are busy.", "retryAfter": math.ceil(retry_after)}
+            yield _sse_event("error", error)
+            return
+
+        llm_json_response = llm_service.parse_llm_json(parser.raw)
+        if not llm_json_response:
+            logger.error("Failed to parse streamed LLM response.")
+            yield _sse_event("error", {"detail": "LLM service failed to generate a valid response."})
+            return
+
+        yield _sse_event("choices", {"choices": llm_json_response['choices']})
+
+        try:
+            response_data = TaleResponse(
+                storySegment=llm_json_response['storySegment'],
+                choices=llm_json_response['choices'],
+                updatedSummary=turn.current_summary,
+                nextTurnNumber=request.currentTurnNumber + 1,
+                rawResponse=parser.raw if debug_config else None,
+                promptTokens=turn.prompt_tokens if debug_config else None
+            )
+        except Exception as e:
+            logger.error("Error creating final response: %s", e)
+            yield _sse_event("error", {"detail": "Failed to construct final response."})
+            return
+
+        turn.hand_over_summary(request, response_data)
+        if on_complete is not None:
+            await on_complete(response_data)
+        yield _sse_event("summary", {"updatedSummary": response_data.updatedSummary})
+        yield _sse_event("done", response_data.model_dump())
+        logger.debug("Turn end (streamed)")
+    finally:
+        # Client disconnects and failures must not leave the summary running (a handed-over one is kept)
+        summary_scheduler.cancel_summary(turn.summary_task)
+
+async def timed_turn_events(endpoint: str, request: TaleRequest, events: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Relays turn events, recording time to the first segment, total latency and outcome."""
+    model_key = _request_model_key(request)
+    start = time.perf_counter()
+    outcome = "disconnected" # Until a done or error event went out
+    first_segment = True
+    try:
+        async for event in events:
+            if first_segment and event.startswith("event: segment"):
+                first_segment = False
+                telemetry.observe_stage("first_segment", model_key, time.perf_counter() - start)
+            elif event.startswith("event: done"):
+                outcome = "ok"
+            elif event.startswith("event: error"):
+                outcome = "error"
+            yield event
+    finally:
+        telemetry.observe_stage("total", model_key, time.perf_counter() - start)
+        telemetry.TURNS_TOTAL.inc(endpoint=endpoint, outcome=outcome)
+
+async def response_events(response: TaleResponse) -> AsyncIterator[str]:
+    """Replays a finished TaleResponse with the same events as stream_turn_events."""
+    yield _sse_event("segment", {"text": response.storySegment})
+    yield _sse_event("choices", {"choices": response.choices})
+    yield _sse_event("summary", {"updatedSummary": response.updatedSummary})
+    yield _sse_event("done", response.model_dump())
+
+async def speculative_turn_events(
+    request: TaleRequest,
+    on_complete: Optional[Callable[[TaleResponse], Awaitable[None]]] = None
+) -> AsyncIterator[str]:
+    """Streams a turn, serving a pre-generated response when speculation hit."""
+    async def complete(response: TaleResponse):
+        if on_complete is not None:
+            await on_complete(response)
+        _schedule_speculation(request, response)
+
+    response = await speculative_turns.take(request)
+    if response is not None:
+        logger.info("Speculation hit for turn %d of '%s'.", request.currentTurnNumber, request.taleId)
+        await complete(response)
+        async for event in response_events(response):
+            yield event
+        return
+
+    try:
+        turn = await prepare_turn(request)
+    except HTTPException as e:
+        yield _sse_event("error", {"detail": e.detail})
+        return
+    async for event in stream_turn_events(request, turn, on_complete=complete):
+        yield event
+
+@router.post("/generate-tale/stream")
+async def generate_tale_segment_stream(request: TaleRequest):
+    """Streaming variant of /generate-tale as server-sent events (see stream_turn_events)."""
+    _require_action(request.action)
+    return StreamingResponse(
+        timed_turn_events("generate_stream", request, speculative_turn_events(request)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# --- Server-Side Sessions ---
+# Clients create a session once and then post only their action; history,
+# summary and turn count stay on the server so request size is constant.
+
+def _session_tale_request(session: StorySession, body: SessionTurnRequest) -> TaleRequest:
+    return TaleRequest(
+        taleId=session.taleId,
+        storyHistory=session.storyHistory,
+        currentSummary=session.currentSummary,
+        currentTurnNumber=session.currentTurnNumber,
+        action=body.action,
+        debugConfig=body.debugConfig or session.debugConfig
+    )
+
+async def _save_session_turn(session: StorySession, action: StoryAction, response: TaleResponse):
+    history = session.storyHistory + [_action_history_entry(action), response.storySegment]
+    session.storyHistory = history[-settings.session_history_limit:]
+    session.currentSummary = response.updatedSummary
+    session.currentTurnNumber = response.nextTurnNumber
+    await session_store.get_session_store().save(session)
+
+async def _load_session(session_id: str) -> StorySession:
+    session = await session_store.get_session_store().get(session_id)
+    if session is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session not found or expired.")
+    return session
+
+@router.post("/sessions", response_model=SessionCreateResponse)
+async def create_session(request: SessionCreateRequest):
+    """Starts a server-side story session for a tale."""
+    tales = rag_service.get_available_tales()
+    if tales and request.taleId not in tales:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Unknown tale '{request.taleId}'.")
+    session = StorySession(
+        sessionId=session_store.new_session_id(),
+        taleId=request.taleId,
+        currentSummary=request.initialSummary or f'The story of "{request.taleId}" begins...',
+        debugConfig=request.debugConfig
+    )
+    await session_store.get_session_store().save(session)
+    return SessionCreateResponse(
+        sessionId=session.sessionId,
+        taleId=session.taleId,
+        currentTurnNumber=session.currentTurnNumber
+    )
+
+@router.get("/llm/stats")
+async def get_llm_stats():
+    """Returns token usage (including cached prompt tokens), circuit breaker/latency state, admission queues and cassette counts."""
+    return {
+        "usage": llm_service.get_usage_stats(),
+        "providers": llm_dispatch.get_provider_stats(),
+        "admission": admission.get_admission_stats(),
+        "cassette": llm_cassette.get_cassette().stats() if settings.llm_cassette_mode != "off" else None
+    }
+
+@router.get("/speculation/stats")
+async def get_speculation_stats():
+    """Returns speculative pre-generation hit rates and token usage."""
+    return speculative_turns.stats()
+
+@router.get("/sessions/stats")
+async def get_session_stats():
+    """Returns session store metrics."""
+    return await session_store.get_session_store().stats()
+
+@router.get("/sessions/{session_id}", response_model=StorySession)
+async def get_session(session_id: str):
+    """Returns the stored state of a session."""
+    return await _load_session(session_id)
+
+@router.delete("/sessions/{session_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_session(session_id: str):
+    await session_store.get_session_store().delete(session_id)
+
+@router.post("/sessions/{session_id}/turn", response_model=TaleResponse)
+async def session_turn(session_id: str, body: SessionTurnRequest):
+    """Generates the next segment for a session from just the user's action."""
+    _require_action(body.action)
+    async with session_store.session_lock(session_id):
+        session = await _load_session(session_id)
+        response = await run_turn_timed("session", _session_tale_request(session, body))
+        await _save_session_turn(session, body.action, response)
+        return response
+
+@router.post("/sessions/{session_id}/turn/stream")
+async def session_turn_stream(session_id: str, body: SessionTurnRequest):
+    """Streaming variant of the session turn endpoint (same events as /generate-tale/stream)."""
+    _require_action(body.action)
+    await _load_session(session_id) # 404 before the stream starts
+
+    async def event_stream() -> AsyncIterator[str]:
+        async with session_store.session_lock(session_id):
+            session = await session_store.get_session_store().get(session_id)
+            if session is None:
+                yield _sse_event("error", {"detail": "Session not found or expired."})
+                return
+            tale_request = _session_tale_request(session, body)
+
+            async def on_complete(response: TaleResponse):
+                await _save_session_turn(session, body.action, response)
+
+            events = speculative_turn_events(tale_request, on_complete=on_complete)
+            async for event in timed_turn_events("session_stream", tale_request, events):
+                yield event
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
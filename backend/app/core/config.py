@@ -1,6 +1,12 @@
 
 import os
 
+from dotenv import load_dotenv
+
+# Provider API keys come from the environment or .env. Of the settings below, only
+# LLM_FALLBACK_MODELS, LOG_LEVEL, LOG_FORMAT and LOG_PAYLOAD_SAMPLE_RATE are read from there too.
+load_dotenv()
+
 class Settings():
     llm_api_url: str = "http://localhost:11434/api/generate" # Default Ollama generate URL
     llm_model_name: str = "google_gemma-3-12b-it" #"bartowski/RekaAI_reka-flash-3-GGUF" # "mradermacher/gemma-2-Ifable-9B-GGUF" #"gemma-3-4b-it" #"gemma-2-ifable-9b" # "r1-deepseek-distill-llama-8b" #"lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF" # 
@@ -11,8 +17,84 @@ class Settings():
     chroma_db_path: str = "./chroma_db"
     chroma_collection_name: str = "german_tales"
     tale_metadata_path: str = "./app/services/tale_metadata.json"
+    rag_backend: str = "chroma" # or "numpy" (in-memory per-tale index, Chroma for large tales)
+    rag_numpy_max_chunks: int = 5000 # Tales with more chunks stay on Chroma
+    rag_executor_workers: int = 2 # Threads for embedding + Chroma queries
+    embedding_batch_max_size: int = 32 # Query embeddings encoded together
+    embedding_batch_max_wait_ms: float = 5.0 # How long the first query waits for others
+    embedding_backend: str = "torch" # or "onnx" / "onnx-int8" (export with scripts/export_embedding_model.py, needs onnxruntime)
+    embedding_onnx_path: str = "./models/embedding_onnx" # Directory of the ONNX export
+    embedding_threads: int = 0 # ONNX Runtime threads per encode, 0 lets it decide
+    rag_cache_max_entries: int = 2048 # Per cache (query embeddings, retrieval results)
+    rag_cache_ttl_s: float = 3600.0 # 0 disables expiry
     openrouter_model: str =  "google/gemini-2.0-flash-exp:free" #"google/gemini-2.0-flash-exp:free" #"google/gemini-2.5-pro-exp-03-25:free" #"deepseek/deepseek-r1:free" # "deepseek/deepseek-chat-v3-0324:free"
 
+    session_store: str = "memory" # or "sqlite"
+    session_sqlite_path: str = "./sessions.db"
+    session_max_entries: int = 10000 # In-memory store LRU size
+    session_ttl_s: float = 86400.0 # Idle sessions expire after a day, 0 keeps them
+    session_history_limit: int = 40 # History entries kept per session
+
+    speculation_enabled: bool = False # Pre-generate the next scene for each offered choice
+    speculation_max_concurrency: int = 4 # Speculative turns running at once
+    speculation_max_choices: int = 3 # Choices speculated per turn
+    speculation_max_tokens_per_minute: int = 20000 # Estimated token cap for speculative work
+    speculation_ttl_s: float = 300.0 # Unused speculations are discarded after this
+
+    prompt_context_tokens: int = 8192 # Context window of the default model (MODEL_PROVIDERS entries may set "context_tokens")
+    prompt_output_reserve_tokens: int = 1200 # Kept free for the response
+    prompt_max_tokens: int = 6000 # Story prompt cap even on long-context models (latency)
+    summary_pickup_wait_s: float = 2.0 # How long a turn waits for the summary the previous turn scheduled
+
+    llm_structured_output: bool = True # Send the response JSON schema to the provider (False: plain JSON mode)
+
+    # MODEL_PROVIDERS ids tried in order after the requested/default model; none by default.
+    # Enable a chain in .env, e.g. LLM_FALLBACK_MODELS=deepseek/deepseek-chat-v3-0324:free,meta-llama/llama-3.3-70b-instruct:free
+    llm_fallback_models: list = [model.strip() for model in os.getenv("LLM_FALLBACK_MODELS", "").split(",") if model.strip()]
+    llm_max_retries: int = 2 # Retries per provider for 429/5xx/connection errors
+    llm_backoff_base_s: float = 0.5 # Doubles per retry (with jitter)
+    llm_backoff_max_s: float = 8.0 # Longer Retry-After waits fail over instead
+    llm_breaker_failure_threshold: int = 5 # Consecutive failures that open a provider's circuit
+    llm_breaker_cooldown_s: float = 30.0 # How long an open provider is skipped
+    llm_hedge_enabled: bool = False # Start the next provider when the first is slower than its p95
+    llm_hedge_default_delay_s: float = 8.0 # Hedge deadline until enough latency samples exist
+    llm_hedge_min_samples: int = 20
+
+    llm_concurrency_limits: dict = { # In-flight requests per "<llm_type>/<model>" or per llm_type
+        "ollama": 2,
+        "openai_compatible": 2,
+        "openrouter": 8,
+        "deepseek_api": 8,
+        "anthropic": 16,
+    }
+    llm_default_concurrency: int = 8
+    llm_queue_max: int = 32 # Requests waiting per provider/model before fast rejection
+    llm_queue_max_wait_s: float = 20.0 # Longer waits are rejected with a Retry-After hint
+
+    llm_cassette_mode: str = "off" # "record" saves provider responses, "replay" serves them without calling providers
+    llm_cassette_path: str = "./cassettes/llm.jsonl"
+    llm_cassette_realtime: bool = False # Replay with the recorded latencies instead of instantly
+
+    mock_llm_latency_ms: float = 300.0 # Time to first token of the "mock" provider
+    mock_llm_tokens_per_s: float = 60.0
+    mock_llm_chunk_tokens: int = 4 # Tokens per streamed delta
+    mock_llm_error_rate: float = 0.0 # Share of calls answered with a 429
+    mock_llm_malformed_rate: float = 0.0 # Share of responses with broken JSON
+    mock_llm_truncate_rate: float = 0.0 # Share of responses cut off mid-way
+    mock_llm_responses_path: str = "" # JSON list of {"storySegment", "choices"}; "{action}" is replaced by the player's action
+    mock_llm_seed: int = 7
+
+    log_level: str = os.getenv("LOG_LEVEL", "INFO") # DEBUG also logs sampled payloads (prompts, raw LLM output)
+    log_format: str = os.getenv("LOG_FORMAT", "text") # or "json" (one object per line)
+    log_payload_sample_rate: float = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.05")) # Share of requests whose payloads are logged at DEBUG
+    log_payload_max_chars: int = 2000 # Payloads are truncated to this
+    log_queue_size: int = 10000 # Records buffered for the writer thread; more are dropped
+
+    llm_http_max_connections: int = 100 # Per provider base URL
+    llm_http_max_keepalive_connections: int = 20
+    llm_http_keepalive_expiry: float = 30.0 # Seconds an idle connection is kept open
+    llm_http2: bool = False # Requires the 'h2' package (pip install httpx[http2])
+
     class Config:
         env_file = '.env'
         env_file_encoding = 'utf-8'
@@ -0,0 +1,144 @@
+"""
+Structured, leveled logging for the backend.
+
+Records go through a QueueHandler, so callers on the event loop only enqueue
+them. A QueueListener thread formats them and writes to stderr. Every record
+carries the request ID of the turn it belongs to. Verbose payloads such as raw
+LLM output, prompts and RAG context are only logged at DEBUG, for a sampled
+fraction of requests and truncated. They can be turned on when needed without
+slowing down normal traffic.
+"""
+import json
+import logging
+import logging.handlers
+import queue
+import random
+import sys
+import time
+import uuid
+from contextvars import ContextVar
+from typing import Optional
+
+from .config import settings
+
+request_id_var: ContextVar[str] = ContextVar("request_id", default="-")
+_payload_sampled: ContextVar[Optional[bool]] = ContextVar("payload_sampled", default=None)
+
+_listener: Optional[logging.handlers.QueueListener] = None
+_PACKAGE = __name__.rsplit(".core.", 1)[0] # "app" (or "backend.app" when run from the repo root)
+
+# Attributes every LogRecord has; anything else was passed via `extra=` and is structured data
+_RECORD_ATTRS = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime", "request_id"}
+
+
+class RequestIdFilter(logging.Filter):
+    """Stamps records with the current request ID (read on the calling task, before queueing)."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, request ID, message and extra fields."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created)) + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        for key, value in record.__dict__.items():
+            if key not in _RECORD_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human-readable lines with extra fields appended as key=value."""
+
+    def __init__(self):
+        super().__init__("%(asctime)s %(levelname)-7s %(name)s [%(request_id)s] %(message)s")
+
+    def format(self, record: logging.LogRecord) -> str:
+        if not hasattr(record, "request_id"):
+            record.request_id = "-"
+        line = super().format(record)
+        extras = [f"{key}={value}" for key, value in record.__dict__.items()
+                  if key not in _RECORD_ATTRS and not key.startswith("_")]
+        return f"{line} {' '.join(extras)}" if extras else line
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler that drops records instead of blocking when the writer falls behind."""
+
+    dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            _DroppingQueueHandler.dropped += 1
+
+
+def setup_logging():
+    """Routes the package's loggers through a queue to a background writer thread (idempotent)."""
+    global _listener
+    if _listener is not None:
+        return
+    stream_handler = logging.StreamHandler(sys.stderr)
+    stream_handler.setFormatter(JsonFormatter() if settings.log_format == "json" else TextFormatter())
+    log_queue: "queue.Queue[logging.LogRecord]" = queue.Queue(maxsize=settings.log_queue_size)
+    queue_handler = _DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RequestIdFilter())
+
+    root = logging.getLogger(_PACKAGE)
+    root.setLevel(settings.log_level.upper())
+    root.handlers = [queue_handler]
+    root.propagate = False
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+
+def shutdown_logging():
+    """Flushes queued records and stops the writer thread."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def new_request_id(incoming: Optional[str] = None) -> str:
+    """Uses the client's X-Request-ID if it looks sane, else a fresh short ID."""
+    if incoming and len(incoming) <= 64 and incoming.isprintable():
+        return incoming
+    return uuid.uuid4().hex[:12]
+
+def bind_request(request_id: str):
+    """Sets the request ID for the current task (and tasks it creates)."""
+    request_id_var.set(request_id)
+    # Sampled once per request so a sampled turn has all of its payloads
+    _payload_sampled.set(random.random() < settings.log_payload_sample_rate)
+
+def payloads_enabled(logger: logging.Logger) -> bool:
+    """Whether verbose payloads are logged for the current request (DEBUG on and sampled in)."""
+    if not logger.isEnabledFor(logging.DEBUG):
+        return False
+    sampled = _payload_sampled.get()
+    if sampled is None: # Outside a request, e.g. startup
+        return random.random() < settings.log_payload_sample_rate
+    return sampled
+
+def log_payload(logger: logging.Logger, label: str, payload, **fields):
+    """Logs a verbose payload at DEBUG if this request is sampled, truncated to log_payload_max_chars."""
+    if not payloads_enabled(logger):
+        return
+    text = payload if isinstance(payload, str) else str(payload)
+    limit = settings.log_payload_max_chars
+    if len(text) > limit:
+        fields["truncated_from"] = len(text)
+        text = text[:limit]
+    logger.debug("%s: %s", label, text, extra=fields)
@@ -1,16 +1,35 @@
-from fastapi import FastAPI
+import math
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 from .api import routes
 from .core.config import settings # Ensure settings are loaded
+from .core import log
+
+log.setup_logging()
 
 # Initialize services (loads models/clients on startup)
-from .services import rag_service, llm_service
+from .services import rag_service, llm_service, llm_dispatch, session_store, telemetry
 rag_service.get_embedding_model()
 rag_service.get_chroma_client()
 rag_service.load_tale_metadata()
-# Add LLM client initialization if needed (e.g., pre-connecting Ollama)
+if settings.rag_backend == "numpy":
+    rag_service.load_vector_index()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Long-lived, pooled HTTP clients for the LLM providers
+    await llm_service.init_http_clients()
+    rag_service.get_rag_executor()
+    session_store.get_session_store()
+    yield
+    await llm_service.close_http_clients()
+    await session_store.get_session_store().close()
+    rag_service.shutdown_rag_executor()
+    log.shutdown_logging()
 
-app = FastAPI(title="Interactive Storyteller API")
+app = FastAPI(title="Interactive Storyteller API", lifespan=lifespan)
 
 # CORS Middleware (Adjust origins as needed for security)
 app.add_middleware(
@@ -23,6 +42,29 @@ app.add_middleware(
 
 app.include_router(routes.router, prefix="/api") # Add '/api' prefix
 
+@app.middleware("http")
+async def request_id_middleware(request: Request, call_next):
+    # Tags every log record of the request (and the tasks it starts) with its ID
+    request_id = log.new_request_id(request.headers.get("x-request-id"))
+    log.bind_request(request_id)
+    response = await call_next(request)
+    response.headers["X-Request-ID"] = request_id
+    return response
+
+@app.exception_handler(llm_dispatch.ProviderSaturated)
+async def provider_saturated_handler(request: Request, exc: llm_dispatch.ProviderSaturated):
+    # Every LLM provider is at its concurrency limit: tell the client when to come back
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "All LLM providers are busy, please retry shortly."},
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus scrape endpoint: per-stage latency histograms, parse outcomes and queue gauges."""
+    return PlainTextResponse(telemetry.render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
 @app.get("/")
 async def root():
-    return {"message": "Welcome to the Interactive Storyteller API"}
\ No newline at end of file
+    return {"message": "Welcome to the Interactive Storyteller API"}
@@ -34,4 +34,31 @@ class TaleResponse(BaseModel):
     choices: List[str]
     updatedSummary: str
     nextTurnNumber: int
-    rawResponse: Optional[Union[str, Dict[str, Any]]] = None
\ No newline at end of file
+    rawResponse: Optional[Union[str, Dict[str, Any]]] = None
+    promptTokens: Optional[Dict[str, Any]] = None # Prompt token breakdown (debug mode only)
+
+class StorySession(BaseModel):
+    """Server-side state of one playthrough, kept by the session store."""
+    sessionId: str
+    taleId: str
+    storyHistory: List[str] = []
+    currentSummary: str = ""
+    currentTurnNumber: int = 0
+    debugConfig: Optional[DebugConfig] = None
+
+class SessionCreateRequest(BaseModel):
+    """Request structure for starting a server-side story session."""
+    taleId: str
+    initialSummary: Optional[str] = None
+    debugConfig: Optional[DebugConfig] = None
+
+class SessionCreateResponse(BaseModel):
+    """Response structure for a newly created session."""
+    sessionId: str
+    taleId: str
+    currentTurnNumber: int
+
+class SessionTurnRequest(BaseModel):
+    """Request structure for a turn in a server-side session: only the action."""
+    action: StoryAction
+    debugConfig: Optional[DebugConfig] = None
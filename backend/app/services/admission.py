@@ -0,0 +1,144 @@
+import asyncio
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, TypeVar
+
+from ..core.config import settings
+from .llm_dispatch import LatencyWindow, ProviderSaturated
+
+T = TypeVar("T")
+
+# --- Admission Control ---
+# Bounds in-flight LLM requests per provider/model. Requests beyond the limit
+# wait in a FIFO queue; when the queue is full or the wait exceeds
+# llm_queue_max_wait_s they are rejected right away with a Retry-After hint
+# instead of piling onto an upstream that is already saturated.
+
+
+class ProviderLimiter:
+    """FIFO concurrency limiter with a bounded queue for one provider/model."""
+
+    def __init__(self, key: str, max_in_flight: int, max_queue: int, max_wait_s: float):
+        self.key = key
+        self.max_in_flight = max(1, max_in_flight)
+        self.max_queue = max(0, max_queue)
+        self.max_wait_s = max_wait_s
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._hold_s = 5.0 # Moving average of how long a request holds its slot
+        self._waits = LatencyWindow()
+        self.admitted = 0
+        self.queued = 0
+        self.rejected_full = 0
+        self.rejected_timeout = 0
+
+    def retry_after(self) -> float:
+        """Rough seconds until a new request could be admitted."""
+        ahead = len(self._waiters) + 1
+        return min(60.0, max(1.0, self._hold_s * ahead / self.max_in_flight))
+
+    async def acquire(self):
+        if self._in_flight < self.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            self.admitted += 1
+            self._waits.observe(0.0)
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected_full += 1
+            raise ProviderSaturated(self.key, self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self.queued += 1
+        start = time.monotonic()
+        try:
+            await asyncio.wait_for(waiter, timeout=self.max_wait_s)
+        except asyncio.TimeoutError:
+            self._remove(waiter)
+            self.rejected_timeout += 1
+            raise ProviderSaturated(self.key, self.retry_after())
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release() # The slot was handed over just as we were cancelled
+            else:
+                self._remove(waiter)
+            raise
+        self.admitted += 1
+        self._waits.observe(time.monotonic() - start)
+
+    def release(self):
+        # Hand the slot directly to the longest waiter so nobody can overtake the queue
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _remove(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self._hold_s = 0.8 * self._hold_s + 0.2 * (time.monotonic() - start)
+            self.release()
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self._in_flight,
+            "max_in_flight": self.max_in_flight,
+            "queue_depth": len(self._waiters),
+            "max_queue": self.max_queue,
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "rejected_full": self.rejected_full,
+            "rejected_timeout": self.rejected_timeout,
+            "wait_p50_s": self._waits.percentile(0.5),
+            "wait_p95_s": self._waits.percentile(0.95),
+            "avg_hold_s": self._hold_s,
+        }
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+
+def _limit_for(key: str) -> int:
+    """Limit for "<llm_type>/<model>": an exact entry, else the llm_type entry, else the default."""
+    limits = settings.llm_concurrency_limits
+    if key in limits:
+        return limits[key]
+    return limits.get(key.split("/", 1)[0], settings.llm_default_concurrency)
+
+def get_limiter(key: str) -> ProviderLimiter:
+    limiter = _limiters.get(key)
+    if limiter is None:
+        limiter = _limiters[key] = ProviderLimiter(
+            key, _limit_for(key), settings.llm_queue_max, settings.llm_queue_max_wait_s
+        )
+    return limiter
+
+async def run_limited(key: str, func: Callable[..., Awaitable[T]], *args) -> T:
+    """Awaits `func(*args)` while holding a slot of the provider's limiter."""
+    async with get_limiter(key).slot():
+        return await func(*args)
+
+async def stream_limited(key: str, open_stream: Callable[[], AsyncIterator[T]]) -> AsyncIterator[T]:
+    """Relays a stream while holding a slot; the slot is released when the stream is closed."""
+    async with get_limiter(key).slot():
+        stream = open_stream()
+        try:
+            async for item in stream:
+                yield item
+        finally:
+            await stream.aclose()
+
+def get_admission_stats() -> Dict[str, dict]:
+    return {key: limiter.stats() for key, limiter in _limiters.items()}
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from functools import lru_cache
+from typing import AsyncIterator, Awaitable, Callable, Dict, List
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Record/Replay Cassettes ---
+# With llm_cassette_mode "record", every provider response (full, streamed or
+# summary) is appended to a JSONL cassette keyed by a hash of the request. In
+# "replay" mode responses come from the cassette and no provider is contacted,
+# so benchmarks and tests run deterministically offline. Identical requests
+# replay their recordings in order, starting over when all were used.
+
+
+class CassetteMiss(Exception):
+    """Replay mode, but the cassette has no recording for this request."""
+
+
+def request_key(kind: str, llm_type: str, model_name: str, system_prompt: str, user_prompt: str,
+                temperature: float) -> str:
+    material = json.dumps([kind, llm_type, model_name, system_prompt, user_prompt, round(temperature, 3)],
+                          ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+class Cassette:
+    def __init__(self, path: str, mode: str):
+        self.path = path
+        self.mode = mode
+        self._entries: Dict[str, List[dict]] = {}
+        self._replayed: Dict[str, int] = {}
+        self._lock = threading.Lock()
+        self.recorded = 0
+        self.replayed = 0
+        self.misses = 0
+        if mode == "replay":
+            self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            logger.warning("LLM cassette %s does not exist, every request will miss.", self.path)
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._entries.setdefault(entry["key"], []).append(entry)
+        logger.info("LLM cassette: loaded %d recording(s) from %s", sum(map(len, self._entries.values())), self.path)
+
+    def _append(self, entry: dict):
+        """Blocking write of one recording (called in a worker thread)."""
+        with self._lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self.recorded += 1
+
+    def _next(self, key: str, kind: str) -> dict:
+        recordings = self._entries.get(key)
+        if not recordings:
+            self.misses += 1
+            raise CassetteMiss(f"No {kind} recording in {self.path} for request {key[:12]}")
+        index = self._replayed.get(key, 0)
+        self._replayed[key] = index + 1
+        self.replayed += 1
+        return recordings[index % len(recordings)]
+
+    async def complete(self, key: str, kind: str, call: Callable[[], Awaitable[str]]) -> str:
+        """Replays or records one full (non-streamed) response."""
+        if self.mode == "replay":
+            entry = self._next(key, kind)
+            if settings.llm_cassette_realtime:
+                await asyncio.sleep(entry.get("elapsed_s", 0.0))
+            return entry["response"]
+        start = time.monotonic()
+        response = await call()
+        if response is not None:
+            entry = {"key": key, "kind": kind, "response": response, "elapsed_s": time.monotonic() - start}
+            await asyncio.to_thread(self._append, entry)
+        return response
+
+    async def stream(self, key: str, open_stream: Callable[[], AsyncIterator[str]]) -> AsyncIterator[str]:
+        """Replays or records a stream; partial streams (errors, disconnects) are not recorded."""
+        if self.mode == "replay":
+            entry = self._next(key, "stream")
+            start = time.monotonic()
+            for delta, offset in zip(entry["deltas"], entry["offsets"]):
+                if settings.llm_cassette_realtime:
+                    await asyncio.sleep(max(0.0, offset - (time.monotonic() - start)))
+                yield delta
+            return
+        deltas: List[str] = []
+        offsets: List[float] = []
+        start = time.monotonic()
+        stream = open_stream()
+        try:
+            async for delta in stream:
+                deltas.append(delta)
+                offsets.append(time.monotonic() - start)
+                yield delta
+        finally:
+            await stream.aclose()
+        await asyncio.to_thread(self._append, {"key": key, "kind": "stream", "deltas": deltas, "offsets": offsets})
+
+    def stats(self) -> dict:
+        return {"mode": self.mode, "path": self.path, "recorded": self.recorded,
+                "replayed": self.replayed, "misses": self.misses}
+
+
+@lru_cache(maxsize=1)
+def get_cassette() -> Cassette:
+    return Cassette(settings.llm_cassette_path, settings.llm_cassette_mode)
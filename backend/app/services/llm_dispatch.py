@@ -0,0 +1,377 @@
+import asyncio
+import logging
+import random
+import time
+from collections import deque
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from typing import Any, AsyncIterator, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+import httpx
+
+from ..core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# --- Resilient LLM Dispatch ---
+# A call walks an ordered fallback chain of MODEL_PROVIDERS ids. Each provider
+# gets retries with exponential backoff (honoring Retry-After) behind its own
+# circuit breaker; optionally a second provider is hedged in when the first one
+# is slower than its recent p95.
+RETRIABLE_STATUS = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+
+
+class AllProvidersFailed(Exception):
+    """Every provider in the fallback chain failed."""
+
+    def __init__(self, errors: List[Tuple[str, BaseException]]):
+        self.errors = errors
+        super().__init__("; ".join(f"{key}: {describe_error(e)}" for key, e in errors) or "No providers available")
+
+    @property
+    def retry_after(self) -> Optional[float]:
+        """Seconds to suggest to the client if every provider was merely saturated, else None."""
+        if not self.errors or not all(isinstance(e, ProviderSaturated) for _, e in self.errors):
+            return None
+        return min(e.retry_after for _, e in self.errors)
+
+    @property
+    def raw(self) -> Optional[str]:
+        """Raw output or error text of the last failure (for debug responses)."""
+        if not self.errors:
+            return None
+        return error_raw(self.errors[-1][1])
+
+
+class EmptyStreamError(Exception):
+    """The provider closed the stream without producing any output."""
+
+
+class ProviderSaturated(Exception):
+    """A provider's admission queue is full or the wait for a slot timed out."""
+
+    def __init__(self, key: str, retry_after: float):
+        super().__init__(f"{key} is saturated, retry after {retry_after:.0f}s")
+        self.key = key
+        self.retry_after = retry_after
+
+
+class CircuitOpen(Exception):
+    """A provider's circuit breaker is open (or its half-open probe is still running)."""
+
+    def __init__(self, key: str):
+        super().__init__(f"{key} circuit breaker is open")
+        self.key = key
+
+
+def describe_error(error: BaseException) -> str:
+    if isinstance(error, httpx.HTTPStatusError):
+        return f"Status {error.response.status_code} from {error.request.url!r}. Response: {error.response.text[:200]}"
+    if isinstance(error, httpx.RequestError):
+        return f"Could not connect to {error.request.url!r}. {error}"
+    return f"{type(error).__name__}: {error}"
+
+def error_raw(error: BaseException) -> str:
+    raw = getattr(error, "raw", None)
+    if raw is not None:
+        return raw
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.text
+    return str(error)
+
+def is_retriable(error: BaseException) -> bool:
+    """Transient errors worth retrying on the same provider."""
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code in RETRIABLE_STATUS
+    return isinstance(error, (httpx.TransportError, EmptyStreamError))
+
+def retry_after_seconds(error: BaseException) -> Optional[float]:
+    """Delay requested by a Retry-After header (seconds or HTTP date), if any."""
+    if not isinstance(error, httpx.HTTPStatusError):
+        return None
+    value = error.response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+def backoff_delay(attempt: int, error: BaseException) -> Optional[float]:
+    """Seconds to wait before retry `attempt + 1`, or None if the wait is too long to be worth it."""
+    retry_after = retry_after_seconds(error)
+    if retry_after is not None:
+        return retry_after if retry_after <= settings.llm_backoff_max_s else None
+    delay = min(settings.llm_backoff_max_s, settings.llm_backoff_base_s * (2 ** attempt))
+    return delay * random.uniform(0.5, 1.0) # Jitter so concurrent turns don't retry in lockstep
+
+
+class CircuitBreaker:
+    """
+    Opens after `failure_threshold` consecutive failures and skips the provider
+    for `cooldown_s`. Afterwards it is half-open: a single trial call is let
+    through, and others still see it open until that call's result closes or
+    re-opens it.
+    """
+
+    def __init__(self, failure_threshold: int, cooldown_s: float):
+        self.failure_threshold = max(1, failure_threshold)
+        self.cooldown_s = cooldown_s
+        self.consecutive_failures = 0
+        self.opened_at: Optional[float] = None
+        self.probing = False # The half-open trial call is in flight
+        self.times_opened = 0
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if not self.probing and time.monotonic() - self.opened_at >= self.cooldown_s:
+            return "half_open"
+        return "open"
+
+    def available(self) -> bool:
+        return self.state != "open"
+
+    def acquire(self) -> Optional[str]:
+        """Admits one call: returns the state it runs in ("closed" or "half_open"), or None if open."""
+        state = self.state
+        if state == "half_open":
+            self.probing = True
+        return state if state != "open" else None
+
+    def release(self):
+        """Frees the trial slot of a probe that ended without a result (cancelled or not sent)."""
+        self.probing = False
+
+    def record_success(self):
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.consecutive_failures += 1
+        if self.probing or self.consecutive_failures >= self.failure_threshold:
+            if self.opened_at is None:
+                self.times_opened += 1
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+
+class LatencyWindow:
+    """Recent latencies of one provider, for the hedging deadline."""
+
+    def __init__(self, size: int = 200):
+        self._samples: Deque[float] = deque(maxlen=size)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if not self._samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+class ProviderHealth:
+    def __init__(self):
+        self.breaker = CircuitBreaker(settings.llm_breaker_failure_threshold, settings.llm_breaker_cooldown_s)
+        self.latency: Dict[str, LatencyWindow] = {} # "response" or "first_token"
+        self.calls = 0
+        self.failures = 0
+        self.retries = 0
+        self.hedges = 0 # Times this provider was hedged in
+        self.hedges_won = 0
+
+    def window(self, kind: str) -> LatencyWindow:
+        return self.latency.setdefault(kind, LatencyWindow())
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.consecutive_failures,
+            "times_opened": self.breaker.times_opened,
+            "calls": self.calls,
+            "failures": self.failures,
+            "retries": self.retries,
+            "hedges": self.hedges,
+            "hedges_won": self.hedges_won,
+            "latency_p95_s": {kind: window.percentile(0.95) for kind, window in self.latency.items()},
+        }
+
+
+_health: Dict[str, ProviderHealth] = {}
+
+def provider_health(key: str) -> ProviderHealth:
+    health = _health.get(key)
+    if health is None:
+        health = _health[key] = ProviderHealth()
+    return health
+
+def get_provider_stats() -> Dict[str, dict]:
+    return {key: health.stats() for key, health in _health.items()}
+
+
+@dataclass
+class Candidate:
+    key: str # Provider identity for breaker/latency tracking, e.g. "openrouter/<model>"
+    call: Callable[[], Awaitable[Any]]
+
+
+def fallback_chain(model: Optional[str]) -> List[Optional[str]]:
+    """The requested model (None = configured default) followed by the configured fallbacks."""
+    chain: List[Optional[str]] = [model]
+    for fallback in settings.llm_fallback_models:
+        if fallback not in chain:
+            chain.append(fallback)
+    return chain
+
+def hedge_delay(key: str, kind: str) -> Optional[float]:
+    """How long to wait on `key` before hedging in the next provider (None: no hedging)."""
+    if not settings.llm_hedge_enabled:
+        return None
+    window = provider_health(key).window(kind)
+    if len(window) < settings.llm_hedge_min_samples:
+        return settings.llm_hedge_default_delay_s
+    return window.percentile(0.95)
+
+async def call_with_retries(candidate: Candidate, kind: str, forced: bool = False) -> Any:
+    """
+    Calls one provider, retrying transient errors with backoff while its breaker allows.
+
+    A `forced` call (every breaker in the chain is open) goes through anyway.
+    """
+    health = provider_health(candidate.key)
+    attempt = 0
+    while True:
+        admitted = health.breaker.acquire()
+        if admitted is None and not forced:
+            raise CircuitOpen(candidate.key)
+        health.calls += 1
+        start = time.monotonic()
+        try:
+            result = await candidate.call()
+        except asyncio.CancelledError:
+            if admitted == "half_open":
+                health.breaker.release()
+            raise
+        except ProviderSaturated as e:
+            # Local back-pressure, not an upstream fault: fail over without touching the breaker
+            if admitted == "half_open":
+                health.breaker.release()
+            logger.warning("LLM: %s, failing over.", e)
+            raise
+        except Exception as e:
+            health.failures += 1
+            health.breaker.record_failure()
+            logger.warning("LLM Error (%s, attempt %d): %s", candidate.key, attempt + 1, describe_error(e))
+            if attempt >= settings.llm_max_retries or not is_retriable(e) or not health.breaker.available():
+                raise
+            delay = backoff_delay(attempt, e)
+            if delay is None:
+                logger.warning("LLM: Retry-After from %s exceeds %ss, failing over.", candidate.key, settings.llm_backoff_max_s)
+                raise
+            health.retries += 1
+            attempt += 1
+            await asyncio.sleep(delay)
+            continue
+        health.breaker.record_success()
+        health.window(kind).observe(time.monotonic() - start)
+        return result
+
+async def dispatch(candidates: List[Candidate], kind: str = "response") -> Any:
+    """
+    Returns the first successful result along the fallback chain.
+
+    Providers with an open breaker are skipped (unless all are open), and a
+    half-open one only takes a single trial call at a time. With hedging
+    enabled, the next provider is started when the running one exceeds its
+    hedge deadline, and whichever succeeds first wins.
+    """
+    queue = [c for c in candidates if provider_health(c.key).breaker.available()]
+    forced = not queue
+    queue = queue or candidates[:1]
+    skipped = len(candidates) - len(queue)
+    if skipped:
+        logger.warning("LLM: Skipping %d provider(s) with an open circuit breaker.", skipped)
+    errors: List[Tuple[str, BaseException]] = []
+    running: Dict[asyncio.Task, Candidate] = {}
+    hedged: List[Candidate] = []
+
+    def start_next(hedge: bool = False):
+        candidate = queue.pop(0)
+        if hedge:
+            hedged.append(candidate)
+            provider_health(candidate.key).hedges += 1
+            logger.info("LLM: Hedging with %s.", candidate.key)
+        running[asyncio.create_task(call_with_retries(candidate, kind, forced))] = candidate
+
+    start_next()
+    try:
+        while running:
+            # Only the oldest running provider's deadline triggers a hedge
+            timeout = hedge_delay(next(iter(running.values())).key, kind) if queue and len(running) == 1 else None
+            done, _ = await asyncio.wait(running, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+            if not done:
+                start_next(hedge=True)
+                continue
+            for task in done:
+                candidate = running.pop(task)
+                if task.exception() is None:
+                    if hedged or errors:
+                        logger.info("LLM: Served by %s.", candidate.key)
+                    if candidate in hedged:
+                        provider_health(candidate.key).hedges_won += 1
+                    return task.result()
+                errors.append((candidate.key, task.exception()))
+            if not running and queue:
+                start_next()
+        raise AllProvidersFailed(errors)
+    finally:
+        for task in running:
+            task.cancel()
+        if running:
+            results = await asyncio.gather(*running, return_exceptions=True)
+            for result in results:
+                # A hedged stream that also got its first token must be closed
+                if isinstance(result, tuple) and hasattr(result[0], "aclose"):
+                    await result[0].aclose()
+
+async def dispatch_stream(
+    candidates: List[Tuple[str, Callable[[], AsyncIterator[str]]]]
+) -> AsyncIterator[str]:
+    """
+    Streaming variant of dispatch: failover, retries and hedging apply until the
+    first delta arrives; after that the winning stream is relayed as is.
+    """
+    def first_delta(open_stream: Callable[[], AsyncIterator[str]]):
+        async def call():
+            stream = open_stream()
+            try:
+                first = await stream.__anext__()
+            except StopAsyncIteration:
+                raise EmptyStreamError("Stream ended without output")
+            except BaseException:
+                await stream.aclose()
+                raise
+            return stream, first
+        return call
+
+    stream, first = await dispatch(
+        [Candidate(key, first_delta(open_stream)) for key, open_stream in candidates],
+        kind="first_token"
+    )
+    try:
+        yield first
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
@@ -1,16 +1,27 @@
+import asyncio
+import functools
+import logging
 import os
 import httpx
-from ollama import Client as OllamaClient
+from ollama import AsyncClient as OllamaAsyncClient
 
-from ..utils.json_clean import robust_json_load
+from ..utils.json_extract import extract_story_json_with_outcome
 from ..core.config import settings
+from ..core.log import log_payload
 from ..models.schema import LlmJsonResponse
+from . import admission, llm_cassette, llm_dispatch, mock_llm, telemetry
+import time
 import json
-import re
-from typing import List, Optional, Tuple
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
 from dotenv import load_dotenv
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+ANTHROPIC_API_URL = "https://api.anthropic.com/v1/messages"
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1/chat/completions"
+
 # Map of model IDs to provider configurations
 MODEL_PROVIDERS = {
   "google/gemini-2.5-pro-exp-03-25:free": {
@@ -48,273 +59,648 @@ MODEL_PROVIDERS = {
   "meta-llama/llama-3.2-3b-instruct:free": {
     "provider": "openrouter",
     "model_name": "meta-llama/llama-3.2-3b-instruct:free"
+  },
+  "mock": { # Local canned responses (see mock_llm), for benchmarks and offline runs
+    "provider": "mock",
+    "model_name": "mock-story"
   }
 }
 
-# --- Sanitizer Function (Python version) ---
-def sanitize_llm_json_response(raw_json_string: Optional[str]) -> Optional[dict]:
-    if not raw_json_string or not isinstance(raw_json_string, str):
-        print("Sanitize Error: Input is not a valid string.")
-        return None
+# --- Shared HTTP Clients ---
+# One long-lived AsyncClient per provider base URL so keep-alive connections
+# (and their TLS sessions) are reused across turns instead of re-handshaking.
+_http_clients: Dict[str, httpx.AsyncClient] = {}
 
-    trimmed_input = raw_json_string.strip()
+def _base_url(url: str) -> str:
+    parts = urlsplit(url)
+    return f"{parts.scheme}://{parts.netloc}"
 
-    # --- Early Exit Check ---
+def _http2_available() -> bool:
     try:
-        parsed_quick = json.loads(trimmed_input)
-        if (isinstance(parsed_quick, dict) and
-            isinstance(parsed_quick.get('storySegment'), str) and
-            isinstance(parsed_quick.get('choices'), list) and
-            len(parsed_quick['choices']) >= 2 and  # Allow for at least 2 choices
-            all(isinstance(c, str) for c in parsed_quick['choices'])):
-            return parsed_quick
-        else:
-            print("Sanitize Warning: Input parsed but structure mismatch.")
-    except json.JSONDecodeError:
-        pass # Proceed to full sanitization
+        import h2  # noqa: F401
+        return True
+    except ImportError:
+        return False
 
-    print("Sanitize Info: Running full sanitization.")
-    
-    # Try to find and extract JSON from common patterns
-    json_pattern = r'```(?:json)?\s*([\s\S]*?)\s*```'
-    json_match = re.search(json_pattern, trimmed_input)
-    
-    if json_match:
-        trimmed_input = json_match.group(1).strip()
-    
-    # Ensure we have a valid JSON object
-    first_brace = trimmed_input.find('{')
-    last_brace = trimmed_input.rfind('}')
+def get_http_client(url: str) -> httpx.AsyncClient:
+    """Returns the pooled client for the base URL of `url`, creating it on first use."""
+    base_url = _base_url(url)
+    client = _http_clients.get(base_url)
+    if client is None or client.is_closed:
+        use_http2 = settings.llm_http2
+        if use_http2 and not _http2_available():
+            logger.warning("LLM HTTP: http2 requested but 'h2' is not installed, falling back to HTTP/1.1.")
+            use_http2 = False
+        client = httpx.AsyncClient(
+            http2=use_http2,
+            limits=httpx.Limits(
+                max_connections=settings.llm_http_max_connections,
+                max_keepalive_connections=settings.llm_http_max_keepalive_connections,
+                keepalive_expiry=settings.llm_http_keepalive_expiry,
+            ),
+        )
+        _http_clients[base_url] = client
+    return client
 
-    if first_brace == -1:
-        print("Sanitize Error (Full): No opening '{'.")
-        return None
+# A single native async Ollama client, so local generations run concurrently
+# on the event loop instead of blocking it (parallelism is then bounded by the
+# Ollama server's OLLAMA_NUM_PARALLEL rather than by this process).
+_ollama_client: Optional[OllamaAsyncClient] = None
 
-    if last_brace == -1 or last_brace < first_brace:
-        if trimmed_input.endswith('"') or trimmed_input.endswith(']'):
-            trimmed_input += '}'
-            print("Sanitize Warning (Full): Appended missing '}'.")
+def get_ollama_client() -> OllamaAsyncClient:
+    """Returns the shared async Ollama client, creating it on first use."""
+    global _ollama_client
+    if _ollama_client is None:
+        _ollama_client = OllamaAsyncClient(
+            host=settings.llm_api_url.replace("/api/generate",""),
+            limits=httpx.Limits(
+                max_connections=settings.llm_http_max_connections,
+                max_keepalive_connections=settings.llm_http_max_keepalive_connections,
+                keepalive_expiry=settings.llm_http_keepalive_expiry,
+            ),
+        )
+    return _ollama_client
+
+async def init_http_clients():
+    """Creates the pooled clients for all known provider URLs (called on startup)."""
+    for url in (settings.openai_api_url, ANTHROPIC_API_URL, OPENROUTER_API_URL):
+        get_http_client(url)
+    get_ollama_client()
+    logger.info("LLM HTTP: Initialized %d pooled client(s) and the Ollama client.", len(_http_clients))
+
+async def close_http_clients():
+    """Closes all pooled clients (called on shutdown)."""
+    global _ollama_client
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+    if _ollama_client is not None:
+        # Older ollama releases have no close(); fall back to the wrapped httpx client
+        close = getattr(_ollama_client, "close", None)
+        if close is not None:
+            await close()
         else:
-             print("Sanitize Warning (Full): Closing '}' seems missing.")
-    else:
-        trimmed_input = trimmed_input[first_brace : last_brace + 1]
-
-    # Fix quotes in choices using regex
-    choices_match = re.search(r'"choices"\s*:\s*\[([^\]]*)\]', trimmed_input)
-    if choices_match:
-        original_choices_block = choices_match.group(0)
-        choices_content = choices_match.group(1).strip()
-        if choices_content.endswith(','):
-            choices_content = choices_content[:-1].strip()
-            print("Sanitize Warning (Full): Removed trailing comma in choices.")
-
-        items = [item.strip() for item in choices_content.split(',') if item.strip()]
-        fixed_items = []
-        for item in items:
-            if item.startswith('"') and item.endswith('"'):
-                fixed_items.append(item)
-            elif item.startswith("'") and item.endswith("'"):
-                 inner = item[1:-1].replace('"', '\\"')
-                 fixed_items.append(f'"{inner}"')
-            elif item.replace('.', '', 1).isdigit() or (item.startswith('-') and item[1:].replace('.', '', 1).isdigit()): # Handle numbers
-                 fixed_items.append(item) # Keep numbers as is
-            else:
-                escaped = item.replace('"', '\\"')
-                fixed_items.append(f'"{escaped}"')
+            await _ollama_client._client.aclose()
+        _ollama_client = None
 
-        fixed_choices_content = ', '.join(fixed_items)
-        fixed_choices_block = f'"choices": [{fixed_choices_content}]'
-        trimmed_input = trimmed_input.replace(original_choices_block, fixed_choices_block)
+# --- Structured Output ---
+# The LlmJsonResponse schema is sent through each provider's strongest
+# mechanism (Ollama `format` schema, OpenAI-style `json_schema`, Anthropic forced
+# tool use), so responses normally parse with a single json.loads.
+STORY_TOOL_NAME = "story_turn"
 
-    # --- Final Parse ---
-    try:
-        final_parsed = json.loads(trimmed_input)
-         # Final validation
-        if not (isinstance(final_parsed, dict) and
-                isinstance(final_parsed.get('storySegment'), str) and
-                isinstance(final_parsed.get('choices'), list) and
-                len(final_parsed['choices']) >= 2 and
-                all(isinstance(c, str) for c in final_parsed['choices'])):
-             print("Sanitize Warning (Full): Parsed object structure invalid AFTER sanitization.")
-             return None # Be strict after sanitizing
-        return final_parsed
-    except json.JSONDecodeError as e:
-        print(f"Sanitize Error (Full): Final parse failed. {e}")
-        print(f"Final sanitized string was: {trimmed_input}")
+def _story_json_schema() -> dict:
+    schema = LlmJsonResponse.model_json_schema()
+    # Strict structured outputs require every property and no extras
+    schema["required"] = list(schema["properties"].keys())
+    schema["additionalProperties"] = False
+    return schema
+
+STORY_JSON_SCHEMA = _story_json_schema()
+
+def _ollama_format():
+    return STORY_JSON_SCHEMA if settings.llm_structured_output else 'json'
+
+def _openai_response_format() -> dict:
+    if not settings.llm_structured_output:
+        return {"type": "json_object"}
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": STORY_TOOL_NAME, "strict": True, "schema": STORY_JSON_SCHEMA}
+    }
+
+def _anthropic_tool_params() -> dict:
+    if not settings.llm_structured_output:
+        return {}
+    return {
+        "tools": [{
+            "name": STORY_TOOL_NAME,
+            "description": "Returns the next story scene and the choices offered to the reader.",
+            "input_schema": STORY_JSON_SCHEMA
+        }],
+        "tool_choice": {"type": "tool", "name": STORY_TOOL_NAME}
+    }
+
+def _anthropic_content_text(content: list) -> Optional[str]:
+    """Raw JSON of the story tool call, or the first text block."""
+    for block in content:
+        if block.get('type') == 'tool_use' and block.get('name') == STORY_TOOL_NAME:
+            return json.dumps(block.get('input'), ensure_ascii=False)
+    for block in content:
+        if block.get('type') == 'text':
+            return block.get('text')
+    return None
+
+# --- Prompt Caching & Usage ---
+# Story prompts put the static per-tale instructions first (see prompt_builder),
+# so providers with prefix caching can reuse them. Anthropic needs the prefix
+# marked explicitly; OpenAI-style providers cache automatically and report it.
+_usage_stats: Dict[str, dict] = {}
+
+def _anthropic_system(system_prompt: str) -> list:
+    return [{"type": "text", "text": system_prompt, "cache_control": {"type": "ephemeral"}}]
+
+def _chat_messages(model_name: str, system_prompt: str, user_prompt: str) -> list:
+    """Chat messages; Anthropic models routed through OpenRouter get cache_control too."""
+    system_content = system_prompt
+    if model_name.startswith("anthropic/"):
+        system_content = _anthropic_system(system_prompt)
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": user_prompt}
+    ]
+
+def _normalize_usage(llm_type: str, usage: Optional[dict]) -> Optional[dict]:
+    if not usage:
         return None
-# --- End Sanitizer ---
+    if llm_type == "anthropic":
+        cache_read = usage.get('cache_read_input_tokens') or 0
+        cache_write = usage.get('cache_creation_input_tokens') or 0
+        return {
+            "prompt_tokens": (usage.get('input_tokens') or 0) + cache_read + cache_write,
+            "cached_tokens": cache_read,
+            "cache_write_tokens": cache_write,
+            "completion_tokens": usage.get('output_tokens') or 0,
+        }
+    if llm_type == "ollama":
+        # Ollama doesn't report KV cache reuse separately
+        return {
+            "prompt_tokens": usage.get('prompt_eval_count') or 0,
+            "cached_tokens": 0,
+            "cache_write_tokens": 0,
+            "completion_tokens": usage.get('eval_count') or 0,
+        }
+    details = usage.get('prompt_tokens_details') or {}
+    return {
+        "prompt_tokens": usage.get('prompt_tokens') or 0,
+        # OpenAI/OpenRouter report cached_tokens, DeepSeek prompt_cache_hit_tokens
+        "cached_tokens": details.get('cached_tokens') or usage.get('prompt_cache_hit_tokens') or 0,
+        "cache_write_tokens": 0,
+        "completion_tokens": usage.get('completion_tokens') or 0,
+    }
+
+def record_usage(llm_type: str, model_name: str, usage: Optional[dict]) -> Optional[dict]:
+    """Accumulates token usage (including cached prompt tokens) per provider/model."""
+    normalized = _normalize_usage(llm_type, usage)
+    if normalized is None:
+        return None
+    stats = _usage_stats.setdefault(f"{llm_type}/{model_name}", {
+        "requests": 0, "prompt_tokens": 0, "cached_tokens": 0,
+        "cache_write_tokens": 0, "completion_tokens": 0,
+    })
+    stats["requests"] += 1
+    for key, value in normalized.items():
+        stats[key] += value
+    logger.debug("LLM usage", extra=normalized)
+    return normalized
+
+def get_usage_stats() -> Dict[str, dict]:
+    result = {}
+    for key, stats in _usage_stats.items():
+        prompt_tokens = stats["prompt_tokens"]
+        result[key] = {**stats, "cached_ratio": (stats["cached_tokens"] / prompt_tokens) if prompt_tokens else 0.0}
+    return result
 
 # --- LLM Interaction Logic ---
+def resolve_provider(model: Optional[str] = None) -> Tuple[str, str]:
+    """Returns (llm_type, model_name) for a MODEL_PROVIDERS id, or the configured defaults."""
+    llm_type = settings.llm_type
+    model_name = settings.llm_model_name
+    
+    # Override with custom model if provided
+    if model and model in MODEL_PROVIDERS:
+        provider_config = MODEL_PROVIDERS[model]
+        llm_type = provider_config["provider"]
+        model_name = provider_config["model_name"]
+        logger.debug("Using custom model: %s (%s/%s)", model, llm_type, model_name)
+    return llm_type, model_name
+
+def _log_invalid_structure(api_name: str, data):
+    logger.error("LLM Error: Invalid response structure from %s", api_name)
+    log_payload(logger, f"{api_name} response", data)
+
+def parse_llm_json(raw_response_content: Optional[str]) -> Optional[dict]:
+    """Extracts the storySegment/choices object from a raw story response in one pass."""
+    if not raw_response_content:
+        return None
+    story, outcome = extract_story_json_with_outcome(raw_response_content)
+    telemetry.LLM_PARSE_TOTAL.inc(outcome=outcome)
+    if not story:
+        logger.warning("LLM Error: No valid storySegment/choices object in response.")
+    return story
+
+class LLMInvalidResponseError(Exception):
+    """The provider answered, but without a usable story object."""
+
+    def __init__(self, message: str, raw: Optional[str] = None):
+        super().__init__(message)
+        self.raw = raw
+
+def provider_key(model: Optional[str] = None) -> str:
+    """Identity of the provider serving `model`, for circuit breakers and latency tracking."""
+    if model and model in MODEL_PROVIDERS:
+        return f"{MODEL_PROVIDERS[model]['provider']}/{MODEL_PROVIDERS[model]['model_name']}"
+    if settings.llm_type == "deepseek_api":
+        return f"deepseek_api/{settings.openrouter_model}"
+    return f"{settings.llm_type}/{settings.llm_model_name}"
+
 async def generate_llm_response(
     system_prompt: str, 
     user_prompt: str, 
     model: Optional[str] = None,
     temperature: float = 0.7
 ) -> Tuple[Optional[dict], Optional[str]]:
-    """Calls the configured LLM and returns the sanitized JSON response and raw response."""
-    raw_response_content = None
-    
+    """
+    Calls the LLM for `model` (falling back along settings.llm_fallback_models, with
+    retries, circuit breakers and optional hedging) and returns the sanitized JSON
+    response and raw response. Returns (None, error text) if every provider failed,
+    and raises llm_dispatch.ProviderSaturated if they were all at their concurrency limit.
+    """
     # Ensure temperature is within valid range
     temperature = max(0.0, min(1.0, temperature))
+    logger.debug("Using temperature: %s", temperature)
+
+    candidates = []
+    for candidate in llm_dispatch.fallback_chain(model):
+        key = provider_key(candidate)
+        candidates.append(llm_dispatch.Candidate(key, functools.partial(
+            admission.run_limited, key, _generate_timed, system_prompt, user_prompt, candidate, temperature
+        )))
+    try:
+        return await llm_dispatch.dispatch(candidates, kind="response")
+    except llm_dispatch.AllProvidersFailed as e:
+        if e.retry_after is not None:
+            # Every provider is at its concurrency limit: reject fast instead of failing slowly
+            raise llm_dispatch.ProviderSaturated("all providers", e.retry_after)
+        logger.error("LLM Error: All providers failed.")
+        return None, e.raw
+
+async def _generate_timed(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str],
+    temperature: float
+) -> Tuple[dict, str]:
+    """_generate_once, recorded in the upstream call histogram."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        result = await _generate_once(system_prompt, user_prompt, model, temperature)
+        outcome = "ok"
+        return result
+    except LLMInvalidResponseError:
+        outcome = "invalid"
+        raise
+    except asyncio.CancelledError:
+        outcome = "cancelled"
+        raise
+    finally:
+        telemetry.observe_llm_call(provider_key(model), "response", outcome, time.perf_counter() - start)
+
+async def _generate_once(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str],
+    temperature: float
+) -> Tuple[dict, str]:
+    """One call to the provider serving `model`; raises on transport, API or parse errors."""
+    llm_type, model_name = resolve_provider(model)
+    raw_response_content = await _fetch_recorded(
+        "response", llm_type, model_name, system_prompt, user_prompt, temperature,
+        functools.partial(_request_completion, system_prompt, user_prompt, llm_type, model_name, temperature)
+    )
+
+    log_payload(logger, "LLM raw response", raw_response_content, model=model_name)
+    with telemetry.stage("parse", provider_key(model)):
+        sanitized_data = parse_llm_json(raw_response_content)
+    if not sanitized_data:
+        raise LLMInvalidResponseError("No valid storySegment/choices object in response", raw=raw_response_content)
     
-    # Determine which model and provider to use
-    llm_type = settings.llm_type
-    model_name = settings.llm_model_name
-    
-    # Override with custom model if provided
-    if model and model in MODEL_PROVIDERS:
-        provider_config = MODEL_PROVIDERS[model]
-        llm_type = provider_config["provider"]
-        model_name = provider_config["model_name"]
-        print(f"Using custom model: {model} ({llm_type}/{model_name})")
+    return sanitized_data, raw_response_content
+
+async def _fetch_recorded(
+    kind: str,
+    llm_type: str,
+    model_name: str,
+    system_prompt: str,
+    user_prompt: str,
+    temperature: float,
+    call
+) -> Optional[str]:
+    """Awaits `call()`, or records/replays it when an LLM cassette is active."""
+    if settings.llm_cassette_mode == "off":
+        return await call()
+    key = llm_cassette.request_key(kind, llm_type, model_name, system_prompt, user_prompt, temperature)
+    return await llm_cassette.get_cassette().complete(key, kind, call)
+
+async def _request_completion(
+    system_prompt: str,
+    user_prompt: str,
+    llm_type: str,
+    model_name: str,
+    temperature: float
+) -> Optional[str]:
+    """Requests a full story response from one provider and returns its raw text."""
+    raw_response_content = None
+
+    if llm_type == "mock":
+        mock = mock_llm.get_mock_llm()
+        raw_response_content = await mock.complete(system_prompt, user_prompt)
+        record_usage(llm_type, model_name, mock.usage(system_prompt, user_prompt, raw_response_content))
+
+    elif llm_type == "ollama":
+        logger.debug("LLM: Calling Ollama with model %s", model_name)
+        client = get_ollama_client()
+        response = await client.generate(
+            model=model_name,
+            system=system_prompt,
+            prompt=user_prompt,
+            format=_ollama_format(),
+            options={'temperature': temperature}
+        )
+        raw_response_content = response.get('response')
+        record_usage(llm_type, model_name, {
+            'prompt_eval_count': response.get('prompt_eval_count'),
+            'eval_count': response.get('eval_count')
+        })
+
+    elif llm_type == "openai_compatible":
+        logger.debug("LLM: Calling OpenAI compatible API with model %s", model_name)
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        payload = {
+            "model": model_name,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 450,
+            "response_format": _openai_response_format()
+        }
+        client = get_http_client(settings.openai_api_url)
+        response = await client.post(settings.openai_api_url, json=payload, timeout=900.0)
+        response.raise_for_status()
+        data = response.json()
+        record_usage(llm_type, model_name, data.get('usage'))
+        if data.get('choices') and data['choices'][0].get('message'):
+            raw_response_content = data['choices'][0]['message'].get('content')
+        else:
+             _log_invalid_structure("OpenAI API", data)
     
-    print(f"Using temperature: {temperature}")
+    elif llm_type == "anthropic":
+        logger.debug("LLM: Calling Anthropic API with model %s", model_name)
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": os.getenv('ANTHROPIC_API_KEY'),
+            "anthropic-version": "2023-06-01"
+        }
+        payload = {
+            "model": model_name,
+            "system": _anthropic_system(system_prompt), # Cacheable static prefix
+            "messages": [{"role": "user", "content": user_prompt}],
+            "temperature": temperature,
+            "max_tokens": 1000,
+            **_anthropic_tool_params()
+        }
+        
+        client = get_http_client(ANTHROPIC_API_URL)
+        response = await client.post(
+            ANTHROPIC_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=120.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        record_usage(llm_type, model_name, data.get('usage'))
+        if data.get('content') and len(data['content']) > 0:
+            raw_response_content = _anthropic_content_text(data['content'])
+        else:
+            _log_invalid_structure("Anthropic API", data)
     
-    try:
-        if llm_type == "ollama":
-            print(f"LLM: Calling Ollama with model {model_name}...")
-            client = OllamaClient(host=settings.llm_api_url.replace("/api/generate",""))
-            response = client.generate(
-                model=model_name,
-                system=system_prompt,
-                prompt=user_prompt,
-                format='json',
-                options={'temperature': temperature}
-            )
-            raw_response_content = response.get('response')
-
-        elif llm_type == "openai_compatible":
-            print(f"LLM: Calling OpenAI compatible API with model {model_name}...")
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            payload = {
+    elif llm_type == "openrouter":
+        logger.debug("LLM: Calling Openrouter with model %s", model_name)
+        messages = _chat_messages(model_name, system_prompt, user_prompt)
+        client = get_http_client(OPENROUTER_API_URL)
+        response = await client.post(
+            url=OPENROUTER_API_URL,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+            },
+            json={
                 "model": model_name,
                 "messages": messages,
                 "temperature": temperature,
-                "max_tokens": 450,
-                "response_format": {"type": "json_object"}
-            }
-            async with httpx.AsyncClient() as client:
-                response = await client.post(settings.openai_api_url, json=payload, timeout=900.0)
-                response.raise_for_status()
-                data = response.json()
-                if data.get('choices') and data['choices'][0].get('message'):
-                    raw_response_content = data['choices'][0]['message'].get('content')
-                else:
-                     print("LLM Error: Invalid response structure from OpenAI API", data)
-        
-        elif llm_type == "anthropic":
-            print(f"LLM: Calling Anthropic API with model {model_name}...")
-            headers = {
+                "max_tokens": 2420,
+                "response_format": _openai_response_format(),
+                "usage": {"include": True}
+            },
+            timeout=120.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        record_usage(llm_type, model_name, data.get('usage'))
+        if data.get('choices') and data['choices'][0].get('message'):
+            raw_response_content = data['choices'][0]['message'].get('content')
+        else:
+            _log_invalid_structure("OpenRouter API", data)
+
+    elif llm_type == "deepseek_api":
+        logger.debug("LLM: Calling Deepseek API with model %s", settings.openrouter_model)
+        messages = _chat_messages(settings.openrouter_model, system_prompt, user_prompt)
+        client = get_http_client(OPENROUTER_API_URL)
+        response = await client.post(
+            url=OPENROUTER_API_URL,
+            headers={
                 "Content-Type": "application/json",
-                "x-api-key": os.getenv('ANTHROPIC_API_KEY'),
-                "anthropic-version": "2023-06-01"
-            }
-            payload = {
-                "model": model_name,
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": user_prompt}],
+                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+            },
+            json={
+                "model": settings.openrouter_model,
+                "messages": messages,
                 "temperature": temperature,
-                "max_tokens": 1000
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers=headers,
-                    json=payload,
-                    timeout=120.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                if data.get('content') and len(data['content']) > 0:
-                    raw_response_content = data['content'][0].get('text')
-                else:
-                    print("LLM Error: Invalid response structure from Anthropic API", data)
-        
-        elif llm_type == "openrouter":
-            print(f"LLM: Calling Openrouter with model {model_name}...")
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                    },
-                    json={
-                        "model": model_name,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": 2420,
-                        "response_format": {"type": "json_object"}
-                    },
-                    timeout=120.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                if data.get('choices') and data['choices'][0].get('message'):
-                    raw_response_content = data['choices'][0]['message'].get('content')
-                else:
-                    print("LLM Error: Invalid response structure from OpenRouter API", data)
-
-        elif llm_type == "deepseek_api":
-            print(f"LLM: Calling Deepseek API with model {settings.openrouter_model}...")
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                    },
-                    json={
-                        "model": settings.openrouter_model,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": 2420,
-                    },
-                    timeout=120.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                if data.get('choices') and data['choices'][0].get('message'):
-                    raw_response_content = data['choices'][0]['message'].get('content')
-                else:
-                    print("LLM Error: Invalid response structure from Deepseek API", data)
+                "max_tokens": 2420,
+                "response_format": _openai_response_format(),
+                "usage": {"include": True}
+            },
+            timeout=120.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        record_usage(llm_type, settings.openrouter_model, data.get('usage'))
+        if data.get('choices') and data['choices'][0].get('message'):
+            raw_response_content = data['choices'][0]['message'].get('content')
         else:
-            print(f"LLM Error: Unsupported llm_type '{llm_type}'")
-            return None, None
+            _log_invalid_structure("Deepseek API", data)
+    else:
+        raise ValueError(f"Unsupported llm_type '{llm_type}'")
+
+    return raw_response_content
 
-        print(f"LLM Raw Response (first 200 chars): {str(raw_response_content)[:200]}...")
-        sanitized_data = robust_json_load(raw_response_content)
-        
-        if not sanitized_data:
-            # Fall back to custom sanitizer if robust_json_load fails
-            sanitized_data = sanitize_llm_json_response(raw_response_content)
-            if not sanitized_data:
-                print("LLM Error: Failed to sanitize/validate response after multiple attempts.")
-                return None, raw_response_content
-        
-        return sanitized_data, raw_response_content
-
-    except httpx.RequestError as e:
-        print(f"LLM Connection Error: Could not connect to {e.request.url!r}. {e}")
-        return None, str(e)
-    except httpx.HTTPStatusError as e:
-        print(f"LLM API Error: Status {e.response.status_code} from {e.request.url!r}. Response: {e.response.text[:200]}")
-        return None, e.response.text
-    except Exception as e:
-        print(f"LLM Interaction Error: An unexpected error occurred: {e}")
-        return None, str(e)
+
+async def _iter_sse_json(response: httpx.Response) -> AsyncIterator[dict]:
+    """Yields the JSON payloads of a server-sent events response."""
+    async for line in response.aiter_lines():
+        if not line.startswith("data:"):
+            continue
+        data = line[5:].strip()
+        if data == "[DONE]":
+            break
+        try:
+            yield json.loads(data)
+        except json.JSONDecodeError:
+            continue
+
+async def stream_llm_response(
+    system_prompt: str, 
+    user_prompt: str, 
+    model: Optional[str] = None,
+    temperature: float = 0.7
+) -> AsyncIterator[str]:
+    """
+    Streams the raw text deltas of the LLM for `model` as they arrive.
+
+    Fallbacks, retries and hedging apply until the first delta; errors after that
+    (and llm_dispatch.AllProvidersFailed) are raised to the caller, unlike
+    generate_llm_response.
+    """
+    temperature = max(0.0, min(1.0, temperature))
+    candidates = []
+    for candidate in llm_dispatch.fallback_chain(model):
+        key = provider_key(candidate)
+        open_stream = functools.partial(_stream_once, system_prompt, user_prompt, candidate, temperature)
+        candidates.append((key, functools.partial(admission.stream_limited, key, open_stream)))
+    async for delta in llm_dispatch.dispatch_stream(candidates):
+        yield delta
+
+async def _stream_once(
+    system_prompt: str,
+    user_prompt: str,
+    model: Optional[str],
+    temperature: float
+) -> AsyncIterator[str]:
+    """Streams one call to the provider serving `model`."""
+    llm_type, model_name = resolve_provider(model)
+    open_stream = functools.partial(_stream_provider, system_prompt, user_prompt, llm_type, model_name, temperature)
+    if settings.llm_cassette_mode == "off":
+        stream = open_stream()
+    else:
+        key = llm_cassette.request_key("stream", llm_type, model_name, system_prompt, user_prompt, temperature)
+        stream = llm_cassette.get_cassette().stream(key, open_stream)
+    try:
+        async for delta in stream:
+            yield delta
+    finally:
+        await stream.aclose()
+
+async def _stream_provider(
+    system_prompt: str,
+    user_prompt: str,
+    llm_type: str,
+    model_name: str,
+    temperature: float
+) -> AsyncIterator[str]:
+    """Streams the raw text deltas of one provider."""
+    if llm_type == "mock":
+        mock = mock_llm.get_mock_llm()
+        parts = []
+        async for delta in mock.stream(system_prompt, user_prompt):
+            parts.append(delta)
+            yield delta
+        record_usage(llm_type, model_name, mock.usage(system_prompt, user_prompt, "".join(parts)))
+
+    elif llm_type == "ollama":
+        logger.debug("LLM Stream: Calling Ollama with model %s", model_name)
+        client = get_ollama_client()
+        async for chunk in await client.generate(
+            model=model_name,
+            system=system_prompt,
+            prompt=user_prompt,
+            format=_ollama_format(),
+            options={'temperature': temperature},
+            stream=True
+        ):
+            delta = chunk.get('response')
+            if delta:
+                yield delta
+            if chunk.get('done'):
+                record_usage(llm_type, model_name, {
+                    'prompt_eval_count': chunk.get('prompt_eval_count'),
+                    'eval_count': chunk.get('eval_count')
+                })
+
+    elif llm_type == "anthropic":
+        logger.debug("LLM Stream: Calling Anthropic API with model %s", model_name)
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": os.getenv('ANTHROPIC_API_KEY'),
+            "anthropic-version": "2023-06-01"
+        }
+        payload = {
+            "model": model_name,
+            "system": _anthropic_system(system_prompt),
+            "messages": [{"role": "user", "content": user_prompt}],
+            "temperature": temperature,
+            "max_tokens": 1000,
+            "stream": True,
+            **_anthropic_tool_params()
+        }
+        client = get_http_client(ANTHROPIC_API_URL)
+        async with client.stream("POST", ANTHROPIC_API_URL, headers=headers, json=payload, timeout=120.0) as response:
+            response.raise_for_status()
+            usage = {}
+            async for event in _iter_sse_json(response):
+                if event.get('type') == 'content_block_delta':
+                    # text_delta, or input_json_delta for the forced story tool call
+                    delta = event.get('delta', {})
+                    text = delta.get('text') or delta.get('partial_json')
+                    if text:
+                        yield text
+                elif event.get('type') == 'message_start':
+                    usage.update(event.get('message', {}).get('usage') or {})
+                elif event.get('type') == 'message_delta':
+                    usage.update(event.get('usage') or {})
+            record_usage(llm_type, model_name, usage)
+
+    elif llm_type in ("openai_compatible", "openrouter", "deepseek_api"):
+        payload = {
+            "temperature": temperature,
+            "stream": True
+        }
+        headers = {"Content-Type": "application/json"}
+        if llm_type == "openai_compatible":
+            url = settings.openai_api_url
+            timeout = 900.0
+            payload.update({"model": model_name, "max_tokens": 450})
+        else:
+            url = OPENROUTER_API_URL
+            timeout = 120.0
+            headers["Authorization"] = f"Bearer {os.getenv('OPENROUTER_API_KEY')}"
+            payload["usage"] = {"include": True}
+            if llm_type == "openrouter":
+                payload.update({"model": model_name, "max_tokens": 2420})
+            else:
+                payload.update({"model": settings.openrouter_model, "max_tokens": 2420})
+        payload["response_format"] = _openai_response_format()
+        payload["messages"] = _chat_messages(payload["model"], system_prompt, user_prompt)
+        logger.debug("LLM Stream: Calling %s with model %s", llm_type, payload['model'])
+        client = get_http_client(url)
+        async with client.stream("POST", url, headers=headers, json=payload, timeout=timeout) as response:
+            response.raise_for_status()
+            usage = None
+            async for event in _iter_sse_json(response):
+                choices = event.get('choices') or []
+                if choices:
+                    delta = (choices[0].get('delta') or {}).get('content')
+                    if delta:
+                        yield delta
+                if event.get('usage'):
+                    usage = event['usage']
+            record_usage(llm_type, payload["model"], usage)
+
+    else:
+        raise ValueError(f"Unsupported llm_type '{llm_type}'")
 
 
 async def summarize_story(
@@ -325,7 +711,26 @@ async def summarize_story(
     custom_system_prompt: Optional[str] = None,
     temperature: float = 0.7
 ) -> str:
-    """Uses the LLM to summarize the story progress."""
+    """Uses the LLM to summarize the story progress (within the provider's concurrency limit)."""
+    key = provider_key(model)
+    try:
+        with telemetry.stage("summary", key):
+            return await admission.run_limited(
+                key, _summarize_story,
+                existing_summary, recent_developments, tale_title, model, custom_system_prompt, temperature
+            )
+    except llm_dispatch.ProviderSaturated as e:
+        logger.warning("Summarization skipped: %s", e)
+        return existing_summary
+
+async def _summarize_story(
+    existing_summary: str, 
+    recent_developments: List[str], 
+    tale_title: str,
+    model: Optional[str] = None,
+    custom_system_prompt: Optional[str] = None,
+    temperature: float = 0.7
+) -> str:
     if not recent_developments:
         return existing_summary # No changes to summarize
 
@@ -347,7 +752,7 @@ async def summarize_story(
 
                     Updated Summary:"""
     
-    print(f"LLM Summarizer: Calling LLM with temperature {temperature}...")
+    logger.debug("LLM Summarizer: Calling LLM with temperature %s", temperature)
     
     try:
         # Determine which model and provider to use for summary
@@ -359,98 +764,117 @@ async def summarize_story(
             provider_config = MODEL_PROVIDERS[model]
             llm_type = provider_config["provider"]
             model_name = provider_config["model_name"]
-            print(f"Using custom summary model: {model} ({llm_type}/{model_name})")
-        
-        summary_text = "Summary failed."  # Default
-        
-        if llm_type == "openai_compatible":
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            payload = {
-                "model": model_name,
-                "messages": messages,
-                "temperature": temperature,
-                "max_tokens": 450,
-            }
-            async with httpx.AsyncClient(timeout=60.0) as client:
-                response = await client.post(settings.openai_api_url, json=payload)
-                response.raise_for_status()
-                data = response.json()
-                if data.get('choices') and data['choices'][0].get('message'):
-                    summary_text = data['choices'][0]['message'].get('content', '').strip()
-        
-        elif llm_type == "anthropic":
-            headers = {
-                "Content-Type": "application/json",
-                "x-api-key": os.getenv('ANTHROPIC_API_KEY'),
-                "anthropic-version": "2023-06-01"
-            }
-            payload = {
-                "model": model_name,
-                "system": system_prompt,
-                "messages": [{"role": "user", "content": user_prompt}],
-                "temperature": temperature,
-                "max_tokens": 450
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.anthropic.com/v1/messages",
-                    headers=headers,
-                    json=payload,
-                    timeout=60.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                if data.get('content') and len(data['content']) > 0:
-                    summary_text = data['content'][0].get('text', '').strip()
-        
-        elif llm_type == "openrouter" or llm_type == "deepseek_api":
-            messages = [
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": user_prompt}
-            ]
-            model_to_use = model_name if llm_type == "openrouter" else settings.openrouter_model
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    url="https://openrouter.ai/api/v1/chat/completions",
-                    headers={
-                        "Content-Type": "application/json",
-                        "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
-                    },
-                    json={
-                        "model": model_to_use,
-                        "messages": messages,
-                        "temperature": temperature,
-                        "max_tokens": 450,
-                    },
-                    timeout=60.0
-                )
-                response.raise_for_status()
-                data = response.json()
-                if data.get('choices') and data['choices'][0].get('message'):
-                    summary_text = data['choices'][0]['message'].get('content', '').strip()
+            logger.debug("Using custom summary model: %s (%s/%s)", model, llm_type, model_name)
         
-        elif llm_type == "ollama":
-            client = OllamaClient(host=settings.llm_api_url.replace("/api/generate",""))
-            response = client.generate(
-                model=model_name,
-                system=system_prompt,
-                prompt=user_prompt,
-                options={'temperature': temperature}
-            )
-            summary_text = response.get('response', '').strip()
+        summary_text = await _fetch_recorded(
+            "summary", llm_type, model_name, system_prompt, user_prompt, temperature,
+            functools.partial(_request_summary, system_prompt, user_prompt, llm_type, model_name, temperature)
+        )
 
         if not summary_text or len(summary_text) < 10:
-            print("LLM Summarizer: Got empty or too short summary, reverting.")
+            logger.warning("LLM Summarizer: Got empty or too short summary, reverting.")
             return existing_summary # Revert if summary looks bad
 
-        print(f"LLM Summarizer: New summary generated: {summary_text[:100]}...")
+        logger.info("LLM Summarizer: New summary generated (%d chars).", len(summary_text))
+        log_payload(logger, "LLM summary", summary_text)
         return summary_text
 
     except Exception as e:
-        print(f"LLM Summarizer Error: {e}")
-        return existing_summary # Return old summary on error
\ No newline at end of file
+        logger.error("LLM Summarizer Error: %s", e)
+        return existing_summary # Return old summary on error
+
+async def _request_summary(
+    system_prompt: str,
+    user_prompt: str,
+    llm_type: str,
+    model_name: str,
+    temperature: float
+) -> str:
+    """Requests a summary from one provider and returns its text."""
+    summary_text = "Summary failed."  # Default
+    
+    if llm_type == "mock":
+        summary_text = await mock_llm.get_mock_llm().summarize(user_prompt)
+
+    elif llm_type == "openai_compatible":
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        payload = {
+            "model": model_name,
+            "messages": messages,
+            "temperature": temperature,
+            "max_tokens": 450,
+        }
+        client = get_http_client(settings.openai_api_url)
+        response = await client.post(settings.openai_api_url, json=payload, timeout=60.0)
+        response.raise_for_status()
+        data = response.json()
+        if data.get('choices') and data['choices'][0].get('message'):
+            summary_text = data['choices'][0]['message'].get('content', '').strip()
+    
+    elif llm_type == "anthropic":
+        headers = {
+            "Content-Type": "application/json",
+            "x-api-key": os.getenv('ANTHROPIC_API_KEY'),
+            "anthropic-version": "2023-06-01"
+        }
+        payload = {
+            "model": model_name,
+            "system": _anthropic_system(system_prompt),
+            "messages": [{"role": "user", "content": user_prompt}],
+            "temperature": temperature,
+            "max_tokens": 450
+        }
+        
+        client = get_http_client(ANTHROPIC_API_URL)
+        response = await client.post(
+            ANTHROPIC_API_URL,
+            headers=headers,
+            json=payload,
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data.get('content') and len(data['content']) > 0:
+            summary_text = data['content'][0].get('text', '').strip()
+    
+    elif llm_type == "openrouter" or llm_type == "deepseek_api":
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": user_prompt}
+        ]
+        model_to_use = model_name if llm_type == "openrouter" else settings.openrouter_model
+        
+        client = get_http_client(OPENROUTER_API_URL)
+        response = await client.post(
+            url=OPENROUTER_API_URL,
+            headers={
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {os.getenv('OPENROUTER_API_KEY')}",
+            },
+            json={
+                "model": model_to_use,
+                "messages": messages,
+                "temperature": temperature,
+                "max_tokens": 450,
+            },
+            timeout=60.0
+        )
+        response.raise_for_status()
+        data = response.json()
+        if data.get('choices') and data['choices'][0].get('message'):
+            summary_text = data['choices'][0]['message'].get('content', '').strip()
+    
+    elif llm_type == "ollama":
+        client = get_ollama_client()
+        response = await client.generate(
+            model=model_name,
+            system=system_prompt,
+            prompt=user_prompt,
+            options={'temperature': temperature}
+        )
+        summary_text = response.get('response', '').strip()
+
+    return summary_text
@@ -0,0 +1,153 @@
+import asyncio
+import json
+import random
+import re
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional
+
+import httpx
+
+from ..core.config import settings
+
+# --- Mock Provider ---
+# llm_type "mock" (or a MODEL_PROVIDERS entry with provider "mock") answers
+# locally with canned or templated story turns. Latency, token rate and
+# injected failures (429s, malformed JSON, truncation) are configurable, so the
+# dispatch, parsing and streaming paths can be exercised without a real model.
+
+DEFAULT_RESPONSES = [
+    {
+        "storySegment": "Du entscheidest dich: {action} Der Nebel hebt sich langsam über den Wipfeln, und zwischen "
+                        "den Wurzeln einer alten Eiche glimmt ein schwaches, bläuliches Licht. Ein Rabe krächzt, "
+                        "als wolle er dich warnen, doch irgendwo hinter den Bäumen ruft eine leise Stimme deinen Namen.",
+        "choices": ["Dem Licht zwischen den Wurzeln folgen.", "Dem Raben nachgehen.", "Nach der Stimme rufen."],
+    },
+    {
+        "storySegment": "Du entscheidest dich: {action} Hinter einer Biegung steht plötzlich eine kleine Hütte. "
+                        "Aus dem Schornstein steigt Rauch, und es riecht nach frisch gebackenem Brot. Die Tür ist "
+                        "nur angelehnt, und auf der Schwelle liegt ein Korb mit roten Äpfeln.",
+        "choices": ["An die Tür klopfen.", "Einen Apfel aus dem Korb nehmen.", "Die Hütte umrunden."],
+    },
+    {
+        "storySegment": "Du entscheidest dich: {action} Der Pfad wird schmaler, und das Rauschen eines Baches "
+                        "kommt näher. Am Ufer sitzt ein Wolf und blickt dich aus gelben Augen an, ohne sich zu "
+                        "rühren. Auf der anderen Seite des Wassers schimmert das Dach von Großmutters Haus.",
+        "choices": ["Den Wolf ansprechen.", "Leise am Wolf vorbeischleichen.", "Über die Steine im Bach springen."],
+    },
+]
+SUMMARY_TEMPLATE = "Bisher: {action}"
+_ACTION_LINE = re.compile(r"^> (?:My (?:custom action|choice): )?(.*)$", re.MULTILINE)
+
+
+class MockLLMError(Exception):
+    pass
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _last_action(user_prompt: str) -> str:
+    """The player's latest action from the prompt's history (for templating)."""
+    actions = _ACTION_LINE.findall(user_prompt or "")
+    return actions[-1].strip() if actions else "Die Geschichte beginnt."
+
+def _load_responses(path: Optional[str]) -> List[dict]:
+    if not path:
+        return DEFAULT_RESPONSES
+    with open(path, "r", encoding="utf-8") as f:
+        responses = json.load(f)
+    if not isinstance(responses, list) or not responses:
+        raise MockLLMError(f"{path} must contain a non-empty JSON list of story turns")
+    return responses
+
+def render_turn(template: dict, user_prompt: str) -> dict:
+    """A canned story turn with {action} replaced by the player's latest action."""
+    action = _last_action(user_prompt)
+    return {
+        "storySegment": template["storySegment"].replace("{action}", action),
+        "choices": [choice.replace("{action}", action) for choice in template["choices"]],
+    }
+
+def render_summary(user_prompt: str) -> str:
+    return SUMMARY_TEMPLATE.replace("{action}", _last_action(user_prompt))
+
+
+class MockLLM:
+    def __init__(self):
+        self.rng = random.Random(settings.mock_llm_seed)
+        self.responses = _load_responses(settings.mock_llm_responses_path)
+        self.calls = 0
+
+    def _jittered(self, value: float) -> float:
+        return value * self.rng.uniform(0.8, 1.2)
+
+    def _first_token_delay(self) -> float:
+        return self._jittered(settings.mock_llm_latency_ms) / 1000
+
+    def _token_delay(self, tokens: int) -> float:
+        return tokens / max(self._jittered(settings.mock_llm_tokens_per_s), 1e-6)
+
+    def _maybe_rate_limit(self):
+        if self.rng.random() < settings.mock_llm_error_rate:
+            request = httpx.Request("POST", "http://mock-llm.local/v1/chat/completions")
+            response = httpx.Response(
+                429, request=request, headers={"retry-after": "1"},
+                text='{"error": {"message": "Mock rate limit"}}'
+            )
+            raise httpx.HTTPStatusError("Mock rate limit", request=request, response=response)
+
+    def _story_text(self, user_prompt: str) -> str:
+        template = self.responses[self.calls % len(self.responses)]
+        self.calls += 1
+        text = json.dumps(render_turn(template, user_prompt), ensure_ascii=False)
+        if self.rng.random() < settings.mock_llm_malformed_rate:
+            text = self._malform(text)
+        if self.rng.random() < settings.mock_llm_truncate_rate:
+            text = text[:self.rng.randrange(1, len(text))]
+        return text
+
+    def _malform(self, text: str) -> str:
+        """Breaks the JSON the way models do: stray tags, fences, trailing commas, lost quotes."""
+        damage = self.rng.randrange(4)
+        if damage == 0:
+            return "```json\n" + text + "\n```<|eot_id|>"
+        if damage == 1:
+            return text.replace('", "', '",, "', 1).replace("]}", "],}")
+        if damage == 2:
+            return text.replace('"choices"', 'choices', 1)
+        return "Hier ist die Antwort: " + text.replace('"}', '', 1)
+
+    def usage(self, system_prompt: str, user_prompt: str, completion: str) -> dict:
+        return {
+            "prompt_tokens": _estimate_tokens(system_prompt) + _estimate_tokens(user_prompt),
+            "completion_tokens": _estimate_tokens(completion),
+        }
+
+    async def complete(self, system_prompt: str, user_prompt: str) -> str:
+        """Full story response after the configured latency."""
+        self._maybe_rate_limit()
+        text = self._story_text(user_prompt)
+        await asyncio.sleep(self._first_token_delay() + self._token_delay(_estimate_tokens(text)))
+        return text
+
+    async def summarize(self, user_prompt: str) -> str:
+        self._maybe_rate_limit()
+        text = render_summary(user_prompt)
+        await asyncio.sleep(self._first_token_delay() + self._token_delay(_estimate_tokens(text)))
+        return text
+
+    async def stream(self, system_prompt: str, user_prompt: str) -> AsyncIterator[str]:
+        """Story response in deltas of mock_llm_chunk_tokens at the configured token rate."""
+        self._maybe_rate_limit()
+        text = self._story_text(user_prompt)
+        await asyncio.sleep(self._first_token_delay())
+        step = max(1, settings.mock_llm_chunk_tokens) * 4 # ~4 characters per token
+        for i in range(0, len(text), step):
+            if i:
+                await asyncio.sleep(self._token_delay(settings.mock_llm_chunk_tokens))
+            yield text[i:i + step]
+
+
+@lru_cache(maxsize=1)
+def get_mock_llm() -> MockLLM:
+    return MockLLM()
@@ -0,0 +1,175 @@
+# Prompt layout for provider-side prefix caching (OpenAI/OpenRouter/DeepSeek
+# automatic prompt caching, Anthropic cache_control, llama.cpp/Ollama KV reuse):
+# everything that is the same for every turn comes first, and everything that
+# changes per turn (summary, RAG context, history) comes last.
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from ..core.config import settings
+from ..utils.token_counter import TokenCounter, get_token_counter
+from .llm_service import MODEL_PROVIDERS
+from .rag_service import format_context
+
+# Static style guide shared by every tale and turn
+STORY_STYLE_GUIDE = """
+Du bist ein klassischer Erzähler im Stil deutscher Volksmärchen. Deine Sprache ist kindgerecht, bildhaft und leicht verständlich geeignet für Kinder zwischen 6 und 10 Jahren. 
+Du schreibst ausschließlich in: der dritten Person Singular, der Vergangenheitsform (Präteritum), einem märchentypischen Ton: ruhig, geheimnisvoll, poetisch, aber klar. Beispiel: „Der Mond schien silbern auf den moosigen Pfad, als Rotkäppchen ihren ersten Schritt ins Dunkel wagte.
+Vermeide vollständig: moderne Begriffe, Konzepte oder Objekte (z.B. Handy, Firma, Polizei, Auto), Gewalt ohne moralischen Kontext, Ironie, Sarkasmus oder Meta-Kommentare, Fremdwörter, Anglizismen oder komplizierte Satzstrukturen. Negativ-Beispiel: „Plötzlich kam ein Polizeiwagen angerast."
+Stilmittel, die bevorzugt verwendet werden sollen: stimmungsvolle Bilder, sanfte Wiederholungen und rhythmische Satzführung, archetypische Märchenfiguren und -orte
+Die Handlung soll sich besonders an den letzten Nutzerentscheidungen und history entries orientieren.
+Verfasse eine neue kurze Szene mit 6 bis 10 Sätzen. Strukturiere jede Szene nach folgendem Muster:
+1. Einstieg in die Situation oder Umgebung  
+2. Ein zentrales Ereignis oder eine neue Wendung  
+3. Abschluss mit offenem Ende, das eine neue Entscheidung oder Entwicklung vorbereitet
+Diese Szene soll: logisch und kohärent auf den bisherigen Verlauf aufbauen, innerhalb des etablierten Märchenrahmens bleiben, eine originelle Wendung darstellen, offen genug enden, um eine weitere Entscheidung zu ermöglichen
+
+Bevor du antwortest, prüfe: Ist die Szene stilistisch und thematisch einwandfrei im Märchengenre verankert? Ist sie altersgerecht, logisch und frei von modernen oder stilfremden Elementen?
+Priorisiere in deiner Geschichte immer die letzte Auswahl "My Choice:". Falls du bei einer Frage unsicher bist: Überarbeite die Szene vollständig.
+Gib ausschließlich den Märchentext aus. Verzicht auf Einleitungen, Erklärungen oder Meta-Kommentare. Liefere den Text als kohärente Erzählpassage " keine Aufzählung. Beginne direkt mit der ersten Zeile der Geschichte.
+HANDLUNGSOPTIONEN
+Erzeuge die Handlungsoptionen unmittelbar nach der Szene, ohne Zwischenkommentar oder Einleitung, gib drei Entscheidungsoptionen für die Nutzer aus, damit sie die Geschichte aktiv mitgestalten kann:
+1. **Option A – Storynahe Fortsetzung**  
+   Eine Handlung, die erwartbar und logisch auf die Szene folgt und den traditionellen Märchenverlauf weiterführt.
+2. **Option B – Alternative Wendung**  
+   Eine kreative, aber genre- und stilgerechte Abweichung vom bekannten Verlauf. Diese Option darf überraschend sein, aber muss in der Märchenwelt glaubwürdig bleiben. Stelle sicher, dass sich Option A und B in Handlung, Ton oder Risiko deutlich unterscheiden, um eine echte Wahlmöglichkeit zu bieten.
+Jede Option soll sprachlich einfach, stimmungsvoll und kindgerecht formuliert sein. Die Vorschläge müssen **zur erzählten Szene passen**, dürfen aber **nicht deren Inhalt wiederholen**.
+Format your entire response content ONLY as a valid JSON object string, DONT use markdown and keep the output format cause its very important: {"storySegment": "...", "choices": ["...", "..."]}"""
+
+def build_story_system_prompt(tale_id: str) -> str:
+    """Per-tale static system prompt: the shared style guide, then the tale title."""
+    return f'{STORY_STYLE_GUIDE}\nAktuelles Märchen: "{tale_id}"'
+
+def build_story_context_block(current_summary: str, original_tale_context: str) -> str:
+    """Volatile per-turn context, placed at the start of the user message."""
+    return f"""Hier ist die bisherige Handlung: {current_summary}
+{original_tale_context}"""
+
+
+# --- Token Budget ---
+# The story prompt is filled by priority within a per-model token budget:
+# system prompt, summary, latest action, RAG chunks (best first), then older
+# history (newest first). The latest action is always kept.
+RAG_CONTEXT_PREFIX = "Relevant context from the original tale: "
+
+@dataclass
+class AssembledPrompt:
+    system_prompt: str
+    user_prompt: str
+    breakdown: Dict[str, Any] # Token counts per part, returned in debug mode
+
+def prompt_token_budget(model: Optional[str] = None) -> int:
+    """Input tokens available for a story prompt on `model` (a MODEL_PROVIDERS id or the default)."""
+    provider_config = MODEL_PROVIDERS.get(model, {}) if model else {}
+    context_tokens = provider_config.get("context_tokens", settings.prompt_context_tokens)
+    return max(0, min(context_tokens - settings.prompt_output_reserve_tokens, settings.prompt_max_tokens))
+
+def story_token_counter(model: Optional[str] = None) -> TokenCounter:
+    provider_config = MODEL_PROVIDERS.get(model) if model else None
+    return get_token_counter(provider_config["model_name"] if provider_config else settings.llm_model_name)
+
+def build_story_user_prompt(context_block: str, prompt_history: List[str], history_truncated: bool) -> str:
+    return f"""{context_block}Recent Interaction History:
+{'[... earlier history summarized ...]' if history_truncated else '[Start of History]'}
+{chr(10).join(prompt_history)}
+
+(The user's most recent action is the last message in the history above)
+
+Your JSON Response:"""
+
+def assemble_story_prompt(
+    tale_id: str,
+    summary: str,
+    rag_chunks: Optional[List[str]],
+    story_history: List[str],
+    action_entry: str,
+    model: Optional[str] = None,
+    custom_system_prompt: Optional[str] = None,
+    max_history_entries: int = 10
+) -> AssembledPrompt:
+    """
+    Builds the story prompts within the token budget of `model`.
+
+    `rag_chunks` are the retrieved chunks best first (None if retrieval failed),
+    `story_history` the history before this turn's action. A custom system prompt
+    only receives the summary/context through its placeholders, as before.
+    """
+    counter = story_token_counter(model)
+    budget = prompt_token_budget(model)
+    use_summary = custom_system_prompt is None or "{current_summary}" in custom_system_prompt
+    use_context = custom_system_prompt is None or "{original_tale_context}" in custom_system_prompt
+
+    def render(summary_text: str, context_text: str, older_history: List[str]):
+        prompt_history = older_history + [action_entry]
+        truncated = len(older_history) < len(story_history)
+        if custom_system_prompt is not None:
+            system_prompt = custom_system_prompt.replace("{request.taleId}", tale_id)
+            system_prompt = system_prompt.replace("{current_summary}", summary_text)
+            system_prompt = system_prompt.replace("{original_tale_context}", context_text)
+            return system_prompt, build_story_user_prompt("", prompt_history, truncated)
+        context_block = build_story_context_block(summary_text, context_text) + "\n\n"
+        return build_story_system_prompt(tale_id), build_story_user_prompt(context_block, prompt_history, truncated)
+
+    # Fixed cost: system prompt, scaffolding and the latest action
+    empty_system, empty_user = render("", "", [])
+    system_tokens = counter.count(empty_system)
+    action_tokens = counter.count(action_entry)
+    remaining = budget - system_tokens - counter.count(empty_user)
+
+    summary_text = ""
+    summary_truncated = False
+    if use_summary and summary:
+        # Keep the end of the summary, where the most recent developments are
+        summary_text = counter.truncate(summary, remaining, keep_end=True)
+        summary_truncated = summary_text != summary
+        remaining -= counter.count(summary_text)
+
+    context_text = ""
+    chunks_used = 0
+    if use_context:
+        if not rag_chunks:
+            context_text = format_context(rag_chunks)
+            remaining -= counter.count(context_text)
+        else:
+            remaining -= counter.count(RAG_CONTEXT_PREFIX)
+            selected = []
+            for chunk in rag_chunks:
+                cost = counter.count(chunk) + 1
+                if cost <= remaining:
+                    selected.append(chunk)
+                    remaining -= cost
+            chunks_used = len(selected)
+            context_text = format_context(selected) if selected else ""
+
+    older_history: List[str] = []
+    for entry in reversed(story_history[-(max_history_entries - 1):] if max_history_entries > 1 else []):
+        cost = counter.count(entry) + 1
+        if cost > remaining:
+            break
+        older_history.insert(0, entry)
+        remaining -= cost
+
+    system_prompt, user_prompt = render(summary_text, context_text, older_history)
+    system_total = counter.count(system_prompt)
+    user_total = counter.count(user_prompt)
+    summary_tokens = counter.count(summary_text)
+    context_tokens = counter.count(context_text)
+    history_tokens = sum(counter.count(entry) for entry in older_history)
+    total = system_total + user_total
+    breakdown = {
+        "tokenizer": counter.backend,
+        "budget": budget,
+        "total": total,
+        "system": system_tokens,
+        "summary": summary_tokens,
+        "action": action_tokens,
+        "ragContext": context_tokens,
+        "history": history_tokens,
+        "template": total - system_tokens - summary_tokens - action_tokens - context_tokens - history_tokens,
+        "summaryTruncated": summary_truncated,
+        "ragChunksUsed": chunks_used,
+        "ragChunksAvailable": len(rag_chunks or []),
+        "historyEntriesUsed": len(older_history),
+        "historyEntriesAvailable": len(story_history),
+        "overBudget": total > budget,
+    }
+    return AssembledPrompt(system_prompt=system_prompt, user_prompt=user_prompt, breakdown=breakdown)
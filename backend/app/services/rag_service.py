@@ -1,77 +1,403 @@
-from typing import List
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 import chromadb
-from sentence_transformers import SentenceTransformer
 from ..core.config import settings
+from ..core.log import log_payload
+from ..utils.ttl_cache import LRUCache
+from .embedding_backend import get_embedder
+from .vector_index import NumpyTaleIndex
+from . import telemetry
 import json
 from functools import lru_cache # Cache model and client
 
-@lru_cache(maxsize=1)
+logger = logging.getLogger(__name__)
+
 def get_embedding_model():
-    print(f"Loading embedding model: {settings.embedding_model_name}")
-    return SentenceTransformer(settings.embedding_model_name)
+    """The configured embedding backend (see embedding_backend), loaded once."""
+    return get_embedder()
 
 @lru_cache(maxsize=1)
 def get_chroma_client():
-    print(f"Connecting to Chroma DB at: {settings.chroma_db_path}")
+    logger.info("Connecting to Chroma DB at: %s", settings.chroma_db_path)
     return chromadb.PersistentClient(path=settings.chroma_db_path)
 
 @lru_cache(maxsize=1)
 def load_tale_metadata():
-     print(f"Loading tale metadata from: {settings.tale_metadata_path}")
+     logger.info("Loading tale metadata from: %s", settings.tale_metadata_path)
      try:
          with open(settings.tale_metadata_path, 'r', encoding='utf-8') as f:
              return json.load(f)
      except FileNotFoundError:
-         print(f"Error: Tale metadata file not found at {settings.tale_metadata_path}")
+         logger.error("Tale metadata file not found at %s", settings.tale_metadata_path)
          return {}
      except json.JSONDecodeError:
-          print(f"Error: Could not decode JSON from {settings.tale_metadata_path}")
+          logger.error("Could not decode JSON from %s", settings.tale_metadata_path)
           return {}
 
+# --- In-Memory Vector Index ---
+# Optional Chroma-free fast path (settings.rag_backend = "numpy"): each tale's
+# chunk embeddings live in one float32 matrix and top-k is a single dot product.
+vector_index = NumpyTaleIndex(max_chunks=settings.rag_numpy_max_chunks)
+_vector_index_state = {"stale": True}
+_vector_index_lock = threading.Lock()
+
+def load_vector_index() -> int:
+    """Builds the NumPy index from the persisted Chroma collection."""
+    with _vector_index_lock:
+        try:
+            collection = get_chroma_client().get_collection(name=get_collection_name())
+            count = vector_index.load(collection)
+        except Exception as e:
+            logger.error("Error loading in-memory vector index, falling back to Chroma: %s", e)
+            count = 0
+        _vector_index_state["stale"] = False
+    logger.info("RAG: In-memory vector index holds %d tale(s).", count)
+    return count
+
+def get_vector_index() -> NumpyTaleIndex:
+    if _vector_index_state["stale"]:
+        load_vector_index()
+    return vector_index
+
 def get_original_summary(tale_id: str) -> str:
     metadata = load_tale_metadata()
     return metadata.get(tale_id, {}).get("original_summary", f"The original tale of {tale_id}.")
 
 
-def retrieve_relevant_chunks(tale_id: str, query_text: str, k: int = 3) -> str:
+def embed_queries(query_texts: List[str]) -> List[List[float]]:
+    """Encodes a batch of query texts with the embedding model."""
     model = get_embedding_model()
-    client = get_chroma_client()
+    with telemetry.RAG_SECONDS.time(stage="embed", backend=model.name):
+        return model.encode(query_texts).tolist()
+
+# --- Retrieval Caches ---
+# Many players pick the same fixed choices, so identical queries repeat often.
+# Embeddings only depend on the model; query results also depend on the index,
+# so they are dropped whenever scripts/preprocess_tales.py rebuilds it.
+INDEX_VERSION_FILE = "index_version" # Written into chroma_db_path by preprocess_tales.py
+INDEX_VERSION_CHECK_INTERVAL_S = 1.0
+ACTIVE_COLLECTION_FILE = "active_collection" # Collection swapped in by `preprocess_tales.py --rebuild`
 
+embedding_cache = LRUCache(settings.rag_cache_max_entries, settings.rag_cache_ttl_s)
+result_cache = LRUCache(settings.rag_cache_max_entries, settings.rag_cache_ttl_s)
+_index_version = {"value": None, "checked_at": 0.0, "collection": None}
+
+def normalize_query(query_text: str) -> str:
+    return " ".join(query_text.split())
+
+def _embedding_key(query_text: str) -> tuple:
+    return (settings.embedding_model_name, normalize_query(query_text))
+
+def _result_key(tale_id: str, query_text: str, k: int) -> tuple:
+    return (settings.embedding_model_name, tale_id, normalize_query(query_text), k)
+
+def _read_index_version() -> Optional[float]:
     try:
-        collection = client.get_collection(name=settings.chroma_collection_name)
-    except Exception as e:
-        print(f"Error getting Chroma collection: {e}")
-        return "Error: Could not access original tale context."
+        return os.stat(os.path.join(settings.chroma_db_path, INDEX_VERSION_FILE)).st_mtime
+    except OSError:
+        return None
 
-    if not query_text:
-        return "No query provided for context retrieval."
+def _read_active_collection() -> str:
+    try:
+        with open(os.path.join(settings.chroma_db_path, ACTIVE_COLLECTION_FILE), 'r', encoding='utf-8') as f:
+            return f.read().strip() or settings.chroma_collection_name
+    except OSError:
+        return settings.chroma_collection_name
 
-    print(f"RAG: Generating query embedding for: '{query_text[:100]}...'")
-    query_embedding = model.encode([query_text])[0].tolist()
+def get_collection_name() -> str:
+    """Name of the live Chroma collection (re-read whenever the index version changes)."""
+    if _index_version["collection"] is None:
+        _index_version["collection"] = _read_active_collection()
+    return _index_version["collection"]
+
+def check_index_version():
+    """Clears cached query results if the index was rebuilt (checked at most once a second)."""
+    now = time.monotonic()
+    if now - _index_version["checked_at"] < INDEX_VERSION_CHECK_INTERVAL_S:
+        return
+    _index_version["checked_at"] = now
+    version = _read_index_version()
+    if version != _index_version["value"]:
+        if _index_version["value"] is not None or len(result_cache):
+            logger.info("RAG: Index was rebuilt, clearing cached retrieval results.")
+        result_cache.clear()
+        _index_version["value"] = version
+        _index_version["collection"] = None
+        _vector_index_state["stale"] = True
+
+def invalidate_caches():
+    """Drops all cached embeddings and retrieval results."""
+    embedding_cache.clear()
+    result_cache.clear()
+
+def get_vector_index_stats() -> dict:
+    return {"backend": settings.rag_backend, **vector_index.stats()}
+
+def get_cache_stats() -> dict:
+    return {"embeddings": embedding_cache.stats(), "results": result_cache.stats()}
+
+def query_tale_documents(tale_id: str, query_embedding: List[float], k: int = 3) -> Optional[List[str]]:
+    """Runs the vector query for one tale; returns None if Chroma failed."""
+    if settings.rag_backend == "numpy":
+        index = get_vector_index()
+        if index.has(tale_id):
+            with telemetry.RAG_SECONDS.time(stage="query", backend="numpy"):
+                return index.query(tale_id, query_embedding, k)
+        # Tales too large for (or missing from) the in-memory index use Chroma
+
+    client = get_chroma_client()
 
-    print(f"RAG: Querying collection for tale '{tale_id}'...")
     try:
-        results = collection.query(
-            query_embeddings=[query_embedding],
-            n_results=k,
-            where={"tale_title": tale_id}, # Filter by the specific tale
-            include=['documents'] # We only need the text content
-        )
+        collection = client.get_collection(name=get_collection_name())
     except Exception as e:
-         print(f"Error querying Chroma DB: {e}")
-         return "Error retrieving context from original tale."
+        logger.error("Error getting Chroma collection: %s", e)
+        return None
+
+    logger.debug("RAG: Querying collection for tale '%s'", tale_id)
+    try:
+        with telemetry.RAG_SECONDS.time(stage="query", backend="chroma"):
+            results = collection.query(
+                query_embeddings=[query_embedding],
+                n_results=k,
+                where={"tale_title": tale_id}, # Filter by the specific tale
+                include=['documents'] # We only need the text content
+            )
+    except Exception as e:
+         logger.error("Error querying Chroma DB: %s", e)
+         return None
 
     # Ensure results structure is as expected
     if not results or not results.get('documents') or not results['documents'][0]:
-         print("RAG: No relevant documents found.")
+         return []
+    return results['documents'][0]
+
+def format_context(retrieved_docs: Optional[List[str]]) -> str:
+    if retrieved_docs is None:
+        return "Error retrieving context from original tale."
+    if not retrieved_docs:
+         logger.debug("RAG: No relevant documents found.")
          return "No specific context found in the original tale for this situation."
 
-    retrieved_docs = results['documents'][0]
     context = " ".join(retrieved_docs)
-    print(f"RAG: Retrieved {len(retrieved_docs)} chunks.")
+    logger.debug("RAG: Retrieved %d chunks.", len(retrieved_docs))
+    log_payload(logger, "RAG context", context)
 
     return f"Relevant context from the original tale: {context}"
 
+def retrieve_relevant_chunks(tale_id: str, query_text: str, k: int = 3) -> str:
+    if not query_text:
+        return "No query provided for context retrieval."
+
+    check_index_version()
+    result_key = _result_key(tale_id, query_text, k)
+    retrieved_docs = result_cache.get(result_key)
+    if retrieved_docs is None:
+        embedding_key = _embedding_key(query_text)
+        query_embedding = embedding_cache.get(embedding_key)
+        if query_embedding is None:
+            log_payload(logger, "RAG query embedding", query_text)
+            query_embedding = embed_queries([query_text])[0]
+            embedding_cache.set(embedding_key, query_embedding)
+        retrieved_docs = query_tale_documents(tale_id, query_embedding, k)
+        if retrieved_docs is not None:
+            result_cache.set(result_key, retrieved_docs)
+    return format_context(retrieved_docs)
+
+# --- Async Retrieval ---
+# Embedding and the Chroma query are CPU-bound; they run on a small dedicated
+# pool so retrieval never blocks the event loop (torch and Chroma release the GIL).
+class ExecutorStats:
+    """Thread-safe queue/latency counters for the retrieval executor."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.active = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queued = 0
+        self.total_wait_s = 0.0
+        self.total_run_s = 0.0
+
+    def submitted(self):
+        with self._lock:
+            self.queued += 1
+            self.max_queued = max(self.max_queued, self.queued)
+
+    def started(self, wait_s: float):
+        with self._lock:
+            self.queued -= 1
+            self.active += 1
+            self.total_wait_s += wait_s
+
+    def finished(self, run_s: float, ok: bool):
+        with self._lock:
+            self.active -= 1
+            self.total_run_s += run_s
+            if ok:
+                self.completed += 1
+            else:
+                self.failed += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                "workers": settings.rag_executor_workers,
+                "queued": self.queued,
+                "active": self.active,
+                "completed": self.completed,
+                "failed": self.failed,
+                "max_queued": self.max_queued,
+                "avg_wait_ms": (self.total_wait_s / done * 1000) if done else 0.0,
+                "avg_run_ms": (self.total_run_s / done * 1000) if done else 0.0,
+            }
+
+executor_stats = ExecutorStats()
+
+@lru_cache(maxsize=1)
+def get_rag_executor() -> ThreadPoolExecutor:
+    logger.info("Starting RAG executor with %d worker(s)", settings.rag_executor_workers)
+    return ThreadPoolExecutor(
+        max_workers=settings.rag_executor_workers,
+        thread_name_prefix="rag"
+    )
+
+def shutdown_rag_executor():
+    if get_rag_executor.cache_info().currsize:
+        get_rag_executor().shutdown(wait=False, cancel_futures=True)
+        get_rag_executor.cache_clear()
+
+async def run_in_rag_executor(func, *args):
+    """Runs a blocking retrieval function on the RAG pool and records queue metrics."""
+    submitted_at = time.perf_counter()
+    executor_stats.submitted()
+
+    def _run():
+        started_at = time.perf_counter()
+        executor_stats.started(started_at - submitted_at)
+        ok = False
+        try:
+            result = func(*args)
+            ok = True
+            return result
+        finally:
+            executor_stats.finished(time.perf_counter() - started_at, ok)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_rag_executor(), _run)
+
+# --- Query Embedding Micro-Batching ---
+class EmbeddingBatcher:
+    """
+    Collects query texts that arrive within `max_wait_ms` of each other and
+    encodes them in one batch, then hands each caller its own vector.
+    """
+
+    def __init__(self, max_batch_size: int, max_wait_ms: float):
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_s = max_wait_ms / 1000
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks = set() # Keeps in-flight encode tasks referenced
+        self.batches = 0
+        self.items = 0
+        self.max_batch = 0
+        self.batch_sizes: Dict[int, int] = {}
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait_s, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if not batch:
+            return
+        size = len(batch)
+        self.batches += 1
+        self.items += size
+        self.max_batch = max(self.max_batch, size)
+        self.batch_sizes[size] = self.batch_sizes.get(size, 0) + 1
+        task = asyncio.ensure_future(self._encode(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _encode(self, batch: List[Tuple[str, asyncio.Future]]):
+        try:
+            vectors = await run_in_rag_executor(embed_queries, [text for text, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), vector in zip(batch, vectors):
+            if not future.done(): # Caller may have been cancelled
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_s * 1000,
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": (self.items / self.batches) if self.batches else 0.0,
+            "max_batch": self.max_batch,
+            "batch_sizes": dict(sorted(self.batch_sizes.items())),
+        }
+
+@lru_cache(maxsize=1)
+def get_embedding_batcher() -> EmbeddingBatcher:
+    return EmbeddingBatcher(
+        max_batch_size=settings.embedding_batch_max_size,
+        max_wait_ms=settings.embedding_batch_max_wait_ms
+    )
+
+async def aretrieve_relevant_docs(tale_id: str, query_text: str, k: int = 3) -> Optional[List[str]]:
+    """Top-k chunks for a query (best first): batched embedding, query on the RAG executor."""
+    check_index_version()
+    result_key = _result_key(tale_id, query_text, k)
+    retrieved_docs = result_cache.get(result_key)
+    if retrieved_docs is not None:
+        return retrieved_docs
+
+    embedding_key = _embedding_key(query_text)
+    query_embedding = embedding_cache.get(embedding_key)
+    if query_embedding is None:
+        log_payload(logger, "RAG query embedding", query_text)
+        query_embedding = await get_embedding_batcher().embed(query_text)
+        embedding_cache.set(embedding_key, query_embedding)
+
+    retrieved_docs = await run_in_rag_executor(query_tale_documents, tale_id, query_embedding, k)
+    if retrieved_docs is not None:
+        result_cache.set(result_key, retrieved_docs)
+    return retrieved_docs
+
+async def aretrieve_relevant_chunks(tale_id: str, query_text: str, k: int = 3) -> str:
+    """Async variant of retrieve_relevant_chunks."""
+    if not query_text:
+        return "No query provided for context retrieval."
+    return format_context(await aretrieve_relevant_docs(tale_id, query_text, k))
+
+def get_executor_stats() -> dict:
+    return executor_stats.snapshot()
+
+def get_batcher_stats() -> dict:
+    return get_embedding_batcher().stats()
+
 def get_available_tales() -> List[str]:
     metadata = load_tale_metadata()
     return list(metadata.keys())
\ No newline at end of file
@@ -0,0 +1,168 @@
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Optional
+
+from ..core.config import settings
+from ..models.schema import StorySession
+from ..utils.ttl_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+
+class SessionStore(ABC):
+    """Interface for server-side story session storage."""
+
+    @abstractmethod
+    async def get(self, session_id: str) -> Optional[StorySession]:
+        ...
+
+    @abstractmethod
+    async def save(self, session: StorySession):
+        ...
+
+    @abstractmethod
+    async def delete(self, session_id: str):
+        ...
+
+    @abstractmethod
+    async def stats(self) -> dict:
+        ...
+
+    async def close(self):
+        pass
+
+
+class InMemorySessionStore(SessionStore):
+    """Per-process LRU store; sessions are lost on restart."""
+
+    def __init__(self, max_entries: int, ttl_s: Optional[float] = None):
+        self._cache = LRUCache(max_entries, ttl_s)
+
+    async def get(self, session_id: str) -> Optional[StorySession]:
+        session = self._cache.get(session_id)
+        # Hand out copies so an in-flight turn never mutates the stored state
+        return session.model_copy(deep=True) if session else None
+
+    async def save(self, session: StorySession):
+        self._cache.set(session.sessionId, session.model_copy(deep=True))
+
+    async def delete(self, session_id: str):
+        self._cache.pop(session_id)
+
+    async def stats(self) -> dict:
+        return {"type": "memory", **self._cache.stats()}
+
+
+class SQLiteSessionStore(SessionStore):
+    """Durable store shared by all workers on one host; queries run off the event loop."""
+
+    PURGE_INTERVAL_S = 300.0
+
+    def __init__(self, path: str, ttl_s: Optional[float] = None):
+        self.path = path
+        self.ttl_s = ttl_s or None
+        self._local = threading.local()
+        self._connections = [] # Every thread's connection, closed together by close()
+        self._connections_lock = threading.Lock()
+        self._last_purge = 0.0
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS sessions ("
+                "session_id TEXT PRIMARY KEY, data TEXT NOT NULL, updated_at REAL NOT NULL)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Used only by its own thread; check_same_thread=False lets close() run elsewhere
+            conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._connections_lock:
+                self._connections.append(conn)
+        return conn
+
+    def _get(self, session_id: str) -> Optional[StorySession]:
+        row = self._connect().execute(
+            "SELECT data, updated_at FROM sessions WHERE session_id = ?", (session_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        data, updated_at = row
+        if self.ttl_s and updated_at + self.ttl_s <= time.time():
+            return None
+        return StorySession.model_validate_json(data)
+
+    def _save(self, session: StorySession):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, data, updated_at) VALUES (?, ?, ?)",
+                (session.sessionId, session.model_dump_json(), now)
+            )
+            if self.ttl_s and now - self._last_purge > self.PURGE_INTERVAL_S:
+                self._last_purge = now
+                conn.execute("DELETE FROM sessions WHERE updated_at < ?", (now - self.ttl_s,))
+
+    def _delete(self, session_id: str):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    async def get(self, session_id: str) -> Optional[StorySession]:
+        return await asyncio.to_thread(self._get, session_id)
+
+    async def save(self, session: StorySession):
+        await asyncio.to_thread(self._save, session)
+
+    async def delete(self, session_id: str):
+        await asyncio.to_thread(self._delete, session_id)
+
+    def _count(self) -> int:
+        return self._connect().execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+
+    def _close(self):
+        with self._connections_lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+        self._local = threading.local()
+
+    async def close(self):
+        await asyncio.to_thread(self._close)
+
+    async def stats(self) -> dict:
+        count = await asyncio.to_thread(self._count)
+        return {"type": "sqlite", "path": self.path, "entries": count, "ttl_s": self.ttl_s}
+
+
+@lru_cache(maxsize=1)
+def get_session_store() -> SessionStore:
+    logger.info("Using '%s' session store", settings.session_store)
+    if settings.session_store == "sqlite":
+        return SQLiteSessionStore(settings.session_sqlite_path, settings.session_ttl_s)
+    if settings.session_store != "memory":
+        logger.warning("Unknown session store '%s', using in-memory store", settings.session_store)
+    return InMemorySessionStore(settings.session_max_entries, settings.session_ttl_s)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+# Turns on the same session are serialized so history updates never interleave
+_session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+
+def session_lock(session_id: str) -> asyncio.Lock:
+    lock = _session_locks.get(session_id)
+    if lock is None:
+        lock = asyncio.Lock()
+        _session_locks[session_id] = lock
+    return lock
@@ -0,0 +1,192 @@
+import asyncio
+import hashlib
+import logging
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import Awaitable, Callable, Deque, Dict, List, Optional, Set
+
+from ..core.config import settings
+from ..models.schema import StoryAction, TaleRequest, TaleResponse
+from .summary_scheduler import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+PROMPT_HISTORY_ESTIMATE = 10 # History entries assumed to be in a speculative prompt
+
+@dataclass
+class _Speculation:
+    task: asyncio.Task
+    parent_key: tuple
+    created_at: float
+    cost_estimate: int = 0 # Reserved estimate, replaced by the actual cost when the turn finishes
+    reservation: Optional[list] = None # [reserved_at, tokens] entry in the rate cap window
+    started: bool = False # Past the semaphore, so the provider may already be spending tokens
+
+
+def _request_cost(request: TaleRequest) -> int:
+    """Rough input-token cost of a turn (summary plus the recent history in the prompt)."""
+    return estimate_tokens(request.currentSummary + "\n".join(request.storyHistory[-PROMPT_HISTORY_ESTIMATE:]))
+
+def _response_cost(response: TaleResponse) -> int:
+    return estimate_tokens(response.storySegment + "".join(response.choices))
+
+
+class SpeculativeTurnCache:
+    """
+    Opt-in pre-generation of the next scene for each offered choice.
+
+    While the reader decides, the follow-up turn for every choice runs in the
+    background (bounded by a semaphore and a tokens-per-minute cap). If the
+    next request picks one of them, its result is served right away and the
+    sibling speculations are cancelled or discarded.
+    """
+
+    def __init__(self):
+        self._entries: Dict[tuple, _Speculation] = {}
+        self._children: Dict[tuple, Set[tuple]] = {}
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # [reserved_at, tokens] per speculation for the rate cap; reserved when scheduled, reconciled when done
+        self._spent: Deque[list] = deque()
+        self.scheduled = 0
+        self.skipped_budget = 0
+        self.hits = 0
+        self.misses = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.wasted_tokens = 0
+        self.used_tokens = 0
+
+    @staticmethod
+    def parent_key(request: TaleRequest) -> tuple:
+        """Identifies the story state a request continues from (independent of the action)."""
+        last_entry = request.storyHistory[-1] if request.storyHistory else ""
+        config = request.debugConfig.model_dump_json() if request.debugConfig else ""
+        digest = hashlib.sha1(f"{last_entry}\x00{request.currentSummary}\x00{config}".encode("utf-8")).hexdigest()
+        return (request.taleId, request.currentTurnNumber, digest)
+
+    def _spent_last_minute(self) -> int:
+        cutoff = time.monotonic() - 60.0
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        return sum(tokens for _, tokens in self._spent)
+
+    def _prune(self):
+        """Drops speculations nobody picked up within the TTL."""
+        cutoff = time.monotonic() - settings.speculation_ttl_s
+        for parent in [p for p, keys in self._children.items()
+                       if any(self._entries[k].created_at < cutoff for k in keys)]:
+            self._discard(parent)
+
+    def _discard(self, parent: tuple, keep: Optional[tuple] = None):
+        for key in self._children.pop(parent, set()):
+            if key == keep:
+                continue
+            entry = self._entries.pop(key)
+            if entry.task.done():
+                if not entry.task.cancelled() and entry.task.exception() is None:
+                    self.wasted_tokens += entry.cost_estimate
+            else:
+                entry.task.cancel()
+                self.cancelled += 1
+                if entry.started:
+                    # The provider already works on it: the reservation stays spent
+                    self.wasted_tokens += entry.cost_estimate
+                else:
+                    entry.reservation[1] = 0
+
+    async def take(self, request: TaleRequest) -> Optional[TaleResponse]:
+        """Returns the pre-generated response for this request, waiting if it is still running."""
+        self._prune()
+        parent = self.parent_key(request)
+        if parent not in self._children:
+            return None
+        key = parent + (request.action.choice,) if request.action.choice else None
+        entry = self._entries.pop(key, None) if key else None
+        self._discard(parent, keep=key)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry.task.cancelled():
+            self.failed += 1
+            return None
+        try:
+            response = await entry.task
+        except Exception:
+            logger.exception("Speculative turn failed")
+            self.failed += 1
+            return None
+        self.hits += 1
+        return response
+
+    def schedule(
+        self,
+        request: TaleRequest,
+        response: TaleResponse,
+        next_history: List[str],
+        run_turn: Callable[[TaleRequest], Awaitable[TaleResponse]]
+    ):
+        """Starts background turns for the choices offered in `response`."""
+        if not settings.speculation_enabled or not response.choices:
+            return
+        self._prune()
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(settings.speculation_max_concurrency)
+
+        for choice in response.choices[:settings.speculation_max_choices]:
+            next_request = TaleRequest(
+                taleId=request.taleId,
+                storyHistory=next_history,
+                currentSummary=response.updatedSummary,
+                currentTurnNumber=response.nextTurnNumber,
+                action=StoryAction(choice=choice),
+                debugConfig=request.debugConfig
+            )
+            parent = self.parent_key(next_request)
+            key = parent + (choice,)
+            if key in self._entries:
+                continue
+            # Reserve the expected cost up front (the last scene's size stands in for the output),
+            # so a burst of turns cannot start more work than the cap allows
+            estimate = _request_cost(next_request) + _response_cost(response)
+            if self._spent_last_minute() + estimate > settings.speculation_max_tokens_per_minute:
+                self.skipped_budget += 1
+                continue
+            now = time.monotonic()
+            entry = _Speculation(task=None, parent_key=parent, created_at=now, cost_estimate=estimate,
+                                 reservation=[now, estimate])
+            self._spent.append(entry.reservation)
+            entry.task = asyncio.create_task(self._run(next_request, entry, run_turn))
+            self._entries[key] = entry
+            self._children.setdefault(parent, set()).add(key)
+            self.scheduled += 1
+
+    async def _run(self, request: TaleRequest, entry: _Speculation, run_turn) -> TaleResponse:
+        async with self._semaphore:
+            entry.started = True
+            response = await run_turn(request)
+        entry.cost_estimate = _request_cost(request) + _response_cost(response)
+        entry.reservation[1] = entry.cost_estimate
+        self.used_tokens += entry.cost_estimate
+        return response
+
+    def stats(self) -> dict:
+        resolved = self.hits + self.misses
+        return {
+            "enabled": settings.speculation_enabled,
+            "pending": sum(1 for e in self._entries.values() if not e.task.done()),
+            "stored": len(self._entries),
+            "scheduled": self.scheduled,
+            "skipped_budget": self.skipped_budget,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits / resolved) if resolved else 0.0,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "used_tokens_estimate": self.used_tokens,
+            "wasted_tokens_estimate": self.wasted_tokens,
+            "tokens_last_minute": self._spent_last_minute(),
+        }
+
+
+speculative_turns = SpeculativeTurnCache()
@@ -0,0 +1,140 @@
+import asyncio
+import hashlib
+import logging
+from dataclasses import dataclass
+from typing import List, Optional
+
+from . import llm_service
+from ..core.config import settings
+from ..utils.ttl_cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+SUMMARIZE_TURN_INTERVAL = 7 # How often to summarize
+SUMMARIZE_TOKEN_BUDGET = 400 # Unsummarized tokens outside the prompt window that force an early summary
+HISTORY_ENTRIES_PER_TURN = 2 # Each turn adds the user's action and the story segment
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) for scheduling decisions."""
+    return (len(text) + 3) // 4
+
+@dataclass(frozen=True)
+class SummaryState:
+    """A story's summary, the turn it was made at, and a summary still running for the story."""
+    summary: str
+    covered_turn: Optional[int] = None # None: unknown, summaries are assumed on the interval boundaries
+    pending: Optional[asyncio.Task] = None
+    pending_turn: Optional[int] = None # Turn the pending summary was scheduled at
+
+def recent_developments(story_history: List[str], turn_number: int, action_entry: str,
+                        covered_turn: Optional[int] = None) -> List[str]:
+    """History entries since the last summary (made at `covered_turn`), plus the current action."""
+    if covered_turn is None:
+        turns_since = turn_number % SUMMARIZE_TURN_INTERVAL or SUMMARIZE_TURN_INTERVAL
+        start_index = len(story_history) - turns_since * HISTORY_ENTRIES_PER_TURN
+    else:
+        # That summary already includes the action of its turn, so start at the story segment after it
+        start_index = len(story_history) - max(0, turn_number - covered_turn) * HISTORY_ENTRIES_PER_TURN + 1
+    return story_history[max(0, min(start_index, len(story_history))):] + [action_entry]
+
+def summary_trigger(turn_number: int, developments: List[str], prompt_window: int,
+                    covered_turn: Optional[int] = None, pending: bool = False) -> Optional[str]:
+    """
+    Returns why a summary is due this turn ("interval" or "token_budget"), or None.
+
+    The interval counts from the last summary, so an early token_budget summary
+    moves the next interval instead of adding one. Between intervals, only
+    history that has already fallen out of the prompt window is at risk of being
+    lost, so only that part counts against the budget. Nothing is due while a
+    summary for the story is still running.
+    """
+    if pending:
+        return None
+    if covered_turn is None:
+        due = turn_number > 0 and turn_number % SUMMARIZE_TURN_INTERVAL == 0
+    else:
+        due = turn_number - covered_turn >= SUMMARIZE_TURN_INTERVAL
+    if due:
+        return "interval"
+    dropped = developments[:-prompt_window] if prompt_window > 0 else developments
+    if dropped and estimate_tokens("\n".join(dropped)) > SUMMARIZE_TOKEN_BUDGET:
+        return "token_budget"
+    return None
+
+def schedule_summary(
+    existing_summary: str,
+    developments: List[str],
+    tale_title: str,
+    model: Optional[str] = None,
+    custom_system_prompt: Optional[str] = None,
+    temperature: float = 0.7
+) -> asyncio.Task:
+    """Starts summarize_story in the background so it overlaps with the story call."""
+    return asyncio.create_task(llm_service.summarize_story(
+        existing_summary,
+        developments,
+        tale_title,
+        model=model,
+        custom_system_prompt=custom_system_prompt,
+        temperature=temperature
+    ))
+
+# --- Summary Handover ---
+# The turn that schedules a summary does not wait for it: its response carries
+# the summary its prompt used, and the running task is parked under the state
+# the next turn arrives with (tale, turn number, summary, last history entries).
+# The next turn picks it up, so the user-facing path only waits on the story call.
+# Every turn parks its SummaryState, so the turn of the last summary and a
+# summary that is still running carry over to the following turns.
+PENDING_SUMMARY_MAX_ENTRIES = 10000
+PENDING_SUMMARY_TTL_S = 3600.0
+_pending_summaries = LRUCache(PENDING_SUMMARY_MAX_ENTRIES, PENDING_SUMMARY_TTL_S)
+
+def _state_key(tale_id: str, turn_number: int, summary: str, history: List[str]) -> str:
+    # Only the newest entries: server-side sessions trim older history
+    material = "\x00".join([tale_id, str(turn_number), summary, *history[-HISTORY_ENTRIES_PER_TURN:]])
+    return hashlib.sha1(material.encode("utf-8")).hexdigest()
+
+def hand_over_summary(state: SummaryState, tale_id: str, next_turn_number: int, next_history: List[str]):
+    """Parks this turn's summary state (and a scheduled summary) for the turn that follows this response."""
+    if state.pending is not None and state.pending.cancelled():
+        state = SummaryState(state.summary, state.covered_turn)
+    _pending_summaries.set(_state_key(tale_id, next_turn_number, state.summary, next_history), state)
+
+async def take_summary(tale_id: str, turn_number: int, summary: str, history: List[str]) -> SummaryState:
+    """
+    The summary state handed over by the previous turn, or just `summary` if there is none.
+
+    An unfinished summary is waited for at most summary_pickup_wait_s; after
+    that it stays pending and is handed on. Entries are read, not removed, so
+    a speculative turn and the real one both see them.
+    """
+    state = _pending_summaries.get(_state_key(tale_id, turn_number, summary, history))
+    if state is None:
+        return SummaryState(summary)
+    task = state.pending
+    if task is None:
+        return state
+    if not task.done():
+        try:
+            await asyncio.wait_for(asyncio.shield(task), settings.summary_pickup_wait_s)
+        except asyncio.TimeoutError:
+            logger.warning("Previous summary not ready after %.1fs, keeping the current one.",
+                           settings.summary_pickup_wait_s)
+            return state
+        except Exception:
+            pass # Reported below
+    if task.cancelled():
+        return SummaryState(summary, state.covered_turn)
+    error = task.exception()
+    if error is not None:
+        logger.error("Background summary failed, keeping the current one: %s", error)
+        return SummaryState(summary, state.covered_turn)
+    if not task.result():
+        return SummaryState(summary, state.covered_turn)
+    return SummaryState(task.result(), state.pending_turn)
+
+def cancel_summary(task: Optional[asyncio.Task]):
+    """Drops a scheduled summary whose turn failed."""
+    if task is not None and not task.done():
+        task.cancel()
@@ -0,0 +1,76 @@
+from contextlib import contextmanager
+from typing import Iterator, Tuple
+
+from ..utils.metrics import DEFAULT_BUCKETS, REGISTRY
+from . import admission, llm_dispatch
+
+# --- Metrics ---
+# Scraped from GET /metrics (Prometheus text format). Per-turn stages are
+# labelled with the provider/model the turn asked for; upstream calls with the
+# provider/model that actually served them (fallbacks included).
+TURN_STAGE_SECONDS = REGISTRY.histogram(
+    "storey_turn_stage_seconds",
+    "Duration of each story turn stage (rag, prompt, llm, parse, summary, summary_wait, first_segment, total).",
+    ("stage", "provider", "model"),
+    buckets=(0.0005, 0.001, 0.0025) + DEFAULT_BUCKETS # prompt/parse take well under 5ms
+)
+LLM_CALL_SECONDS = REGISTRY.histogram(
+    "storey_llm_call_seconds",
+    "Duration of single upstream LLM calls (one attempt, without queueing).",
+    ("provider", "model", "kind", "outcome")
+)
+RAG_SECONDS = REGISTRY.histogram(
+    "storey_rag_seconds",
+    "Retrieval internals: embedding batches and vector index queries.",
+    ("stage", "backend")
+)
+LLM_PARSE_TOTAL = REGISTRY.counter(
+    "storey_llm_parse_total",
+    "Story response parse outcomes (direct json.loads, repaired by the extractor, failed).",
+    ("outcome",)
+)
+TURNS_TOTAL = REGISTRY.counter(
+    "storey_turns_total",
+    "Story turns by endpoint and outcome.",
+    ("endpoint", "outcome")
+)
+
+def split_provider_key(key: str) -> Tuple[str, str]:
+    provider, _, model = key.partition("/")
+    return provider, model
+
+@contextmanager
+def stage(name: str, provider_key: str) -> Iterator[None]:
+    """Times one turn stage, labelled with the provider/model of `provider_key`."""
+    provider, model = split_provider_key(provider_key)
+    with TURN_STAGE_SECONDS.time(stage=name, provider=provider, model=model):
+        yield
+
+def observe_stage(name: str, provider_key: str, seconds: float):
+    provider, model = split_provider_key(provider_key)
+    TURN_STAGE_SECONDS.observe(seconds, stage=name, provider=provider, model=model)
+
+def observe_llm_call(provider_key: str, kind: str, outcome: str, seconds: float):
+    provider, model = split_provider_key(provider_key)
+    LLM_CALL_SECONDS.observe(seconds, provider=provider, model=model, kind=kind, outcome=outcome)
+
+def _admission_samples(field: str):
+    def collect():
+        return {split_provider_key(key): stats[field] for key, stats in admission.get_admission_stats().items()}
+    return collect
+
+def _breaker_open_samples():
+    return {
+        split_provider_key(key): 1.0 if stats["state"] == "open" else 0.0
+        for key, stats in llm_dispatch.get_provider_stats().items()
+    }
+
+REGISTRY.gauge("storey_llm_in_flight", "In-flight LLM requests per provider/model.",
+               ("provider", "model"), _admission_samples("in_flight"))
+REGISTRY.gauge("storey_llm_queue_depth", "LLM requests waiting for a slot per provider/model.",
+               ("provider", "model"), _admission_samples("queue_depth"))
+REGISTRY.gauge("storey_llm_circuit_open", "1 while a provider's circuit breaker is open.",
+               ("provider", "model"), _breaker_open_samples)
+
+def render_metrics() -> str:
+    return REGISTRY.render()
@@ -0,0 +1,87 @@
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+class NumpyTaleIndex:
+    """
+    In-memory cosine-similarity index with one contiguous float32 matrix per tale.
+
+    Built from the documents and embeddings already persisted in Chroma, so no
+    separate preprocessing is needed. Tales with more than `max_chunks` chunks are
+    left out and keep using Chroma.
+    """
+
+    def __init__(self, max_chunks: int = 5000):
+        self.max_chunks = max_chunks
+        self._tales: Dict[str, Tuple[np.ndarray, List[str]]] = {}
+        self._lock = threading.Lock()
+
+    def load(self, collection) -> int:
+        """(Re)builds the per-tale matrices from a Chroma collection; returns tales indexed."""
+        data = collection.get(include=['embeddings', 'documents', 'metadatas'])
+        embeddings = data.get('embeddings')
+        documents = data.get('documents') or []
+        metadatas = data.get('metadatas') or []
+        if embeddings is None or len(embeddings) == 0:
+            with self._lock:
+                self._tales = {}
+            return 0
+
+        grouped: Dict[str, List[Tuple[int, int]]] = {}
+        for row, metadata in enumerate(metadatas):
+            title = (metadata or {}).get('tale_title')
+            if title is None:
+                continue
+            grouped.setdefault(title, []).append(((metadata or {}).get('chunk_index', row), row))
+
+        all_vectors = np.asarray(embeddings, dtype=np.float32)
+        tales = {}
+        for title, rows in grouped.items():
+            if len(rows) > self.max_chunks:
+                continue
+            rows.sort()
+            indices = [row for _, row in rows]
+            matrix = np.ascontiguousarray(_normalize(all_vectors[indices]))
+            tales[title] = (matrix, [documents[row] for row in indices])
+
+        # Swap in the new index at once so concurrent queries never see a partial build
+        with self._lock:
+            self._tales = tales
+        return len(tales)
+
+    def has(self, tale_id: str) -> bool:
+        return tale_id in self._tales
+
+    def query(self, tale_id: str, query_embedding: List[float], k: int = 3) -> Optional[List[str]]:
+        """Returns the top-k documents for a tale (best first), or None if it isn't indexed."""
+        entry = self._tales.get(tale_id)
+        if entry is None:
+            return None
+        matrix, documents = entry
+        if k <= 0 or not documents:
+            return []
+
+        query = _normalize(np.asarray(query_embedding, dtype=np.float32))
+        scores = matrix @ query
+        if k < len(scores):
+            top = np.argpartition(-scores, k - 1)[:k]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return [documents[i] for i in top]
+
+    def stats(self) -> dict:
+        tales = self._tales
+        return {
+            "tales": len(tales),
+            "chunks": sum(len(documents) for _, documents in tales.values()),
+            "max_chunks": self.max_chunks,
+        }
@@ -0,0 +1,227 @@
+"""
+Pluggable chunkers that split tale texts into embedding-sized pieces.
+
+Sizes are measured in tokens of the embedding model's tokenizer (see
+token_spans_for), so chunks fit the model's input window instead of being cut
+off by it. A chunker splits the text into units (sentences, paragraphs or
+single tokens) and slides a window over them with two pointers, so building
+the overlap costs O(n) over the whole text. Chunks are slices of the
+normalized text, and a short final piece is extended backwards instead of
+being dropped.
+"""
+import logging
+import re
+from bisect import bisect_left
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple, Type
+
+logger = logging.getLogger(__name__)
+
+Span = Tuple[int, int]
+Unit = Tuple[int, int, int] # start, end, tokens
+
+# Words, numbers and single punctuation marks; long words count as ~4 char pieces (as in token_counter)
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+_SENTENCE_END = re.compile(r"[.!?…]+[\"'»«“”)]*(?=\s|$)")
+_PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+
+
+def normalize_text(text: str) -> str:
+    """Standardizes line breaks and collapses runs of blank lines and spaces."""
+    text = re.sub(r'\r\n', '\n', text)
+    text = re.sub(r'\n{2,}', '\n\n', text)
+    return re.sub(r' {2,}', ' ', text)
+
+def heuristic_spans(text: str) -> List[Span]:
+    """Tokenizer-free token spans, close to BPE counts for German/English prose."""
+    spans = []
+    for match in _TOKEN_PATTERN.finditer(text):
+        start, end = match.span()
+        spans.extend((i, min(i + 4, end)) for i in range(start, end, 4))
+    return spans
+
+def _hf_tokenizer(model_name: str):
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        return None
+    # sentence-transformers resolves bare model names in its own namespace
+    name = model_name if "/" in model_name else f"sentence-transformers/{model_name}"
+    try:
+        tokenizer = AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning("Could not load tokenizer %s, using the heuristic: %s", name, e)
+        return None
+    return tokenizer if getattr(tokenizer, "is_fast", False) else None
+
+@lru_cache(maxsize=8)
+def token_spans_for(model_name: str) -> Callable[[str], List[Span]]:
+    """Token span function of a model's (fast) tokenizer, or the heuristic if it is unavailable."""
+    tokenizer = _hf_tokenizer(model_name)
+    if tokenizer is None:
+        return heuristic_spans
+
+    def spans(text: str) -> List[Span]:
+        offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        return [(start, end) for start, end in offsets if end > start]
+    return spans
+
+
+def _trimmed(text: str, start: int, end: int) -> Optional[Span]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return (start, end) if end > start else None
+
+def sentence_ranges(text: str, split_sentences: Optional[Callable[[str], Sequence[str]]] = None,
+                    start: int = 0, end: Optional[int] = None) -> List[Span]:
+    """
+    Character ranges of the sentences in text[start:end].
+
+    `split_sentences` (e.g. nltk's sent_tokenize) returns sentence strings that
+    are located in the text in order; without it, or if a sentence cannot be
+    found, sentences end at ., !, ? or … (plus closing quotes).
+    """
+    end = len(text) if end is None else end
+    if split_sentences is not None:
+        ranges = []
+        pos = start
+        for sentence in split_sentences(text[start:end]):
+            found = text.find(sentence, pos, end)
+            if found < 0:
+                break
+            pos = found + len(sentence)
+            ranges.append((found, pos))
+        else:
+            return ranges
+    ranges = []
+    pos = start
+    for match in _SENTENCE_END.finditer(text, start, end):
+        span = _trimmed(text, pos, match.end())
+        if span:
+            ranges.append(span)
+        pos = match.end()
+    span = _trimmed(text, pos, end)
+    if span:
+        ranges.append(span)
+    return ranges
+
+def paragraph_ranges(text: str) -> List[Span]:
+    ranges = []
+    pos = 0
+    for match in _PARAGRAPH_BREAK.finditer(text):
+        span = _trimmed(text, pos, match.start())
+        if span:
+            ranges.append(span)
+        pos = match.end()
+    span = _trimmed(text, pos, len(text))
+    if span:
+        ranges.append(span)
+    return ranges
+
+
+class Chunker:
+    """
+    Base chunker: groups units into chunks of at most `max_tokens`.
+
+    Consecutive chunks share up to `overlap_tokens` of whole units. Units
+    larger than `max_tokens` are split into sentences, then into tokens.
+    """
+    name = ""
+
+    def __init__(self, max_tokens: int, min_tokens: int = 0, overlap_tokens: int = 0,
+                 token_spans: Callable[[str], List[Span]] = heuristic_spans,
+                 split_sentences: Optional[Callable[[str], Sequence[str]]] = None):
+        if max_tokens <= 0 or not 0 <= overlap_tokens < max_tokens:
+            raise ValueError("Need max_tokens > 0 and 0 <= overlap_tokens < max_tokens")
+        self.max_tokens = max_tokens
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.overlap_tokens = overlap_tokens
+        self.token_spans = token_spans
+        self.split_sentences = split_sentences
+
+    def unit_ranges(self, text: str) -> List[Span]:
+        raise NotImplementedError
+
+    def chunk(self, text: str) -> List[str]:
+        text = normalize_text(text)
+        spans = self.token_spans(text)
+        return self._window(text, self._units(text, spans))
+
+    def _units(self, text: str, spans: List[Span]) -> List[Unit]:
+        starts = [start for start, _ in spans]
+        units: List[Unit] = []
+
+        def add(start: int, end: int, split: bool):
+            first, last = bisect_left(starts, start), bisect_left(starts, end)
+            if last - first <= self.max_tokens:
+                if last > first:
+                    units.append((start, end, last - first))
+                return
+            sentences = sentence_ranges(text, self.split_sentences, start, end) if split else []
+            if len(sentences) > 1:
+                for sentence_start, sentence_end in sentences:
+                    add(sentence_start, sentence_end, False)
+                return
+            for i in range(first, last, self.max_tokens):
+                piece_end = min(i + self.max_tokens, last)
+                units.append((spans[i][0], spans[piece_end - 1][1], piece_end - i))
+
+        for start, end in self.unit_ranges(text):
+            add(start, end, True)
+        return units
+
+    def _window(self, text: str, units: List[Unit]) -> List[str]:
+        chunks: List[str] = []
+        lo = size = 0
+        covered = 0 # Units up to here are part of an emitted chunk
+        for hi, (_, _, tokens) in enumerate(units):
+            if size + tokens > self.max_tokens and hi > lo:
+                chunks.append(text[units[lo][0]:units[hi - 1][1]])
+                covered = hi
+                while lo < hi and (size > self.overlap_tokens or size + tokens > self.max_tokens):
+                    size -= units[lo][2]
+                    lo += 1
+            size += tokens
+        if covered < len(units):
+            # Extend a short tail backwards rather than dropping its new text
+            while lo > 0 and size < self.min_tokens and size + units[lo - 1][2] <= self.max_tokens:
+                lo -= 1
+                size += units[lo][2]
+            chunks.append(text[units[lo][0]:units[-1][1]])
+        return chunks
+
+
+class SentenceChunker(Chunker):
+    name = "sentence"
+
+    def unit_ranges(self, text: str) -> List[Span]:
+        return sentence_ranges(text, self.split_sentences)
+
+
+class ParagraphChunker(Chunker):
+    name = "paragraph"
+
+    def unit_ranges(self, text: str) -> List[Span]:
+        return paragraph_ranges(text)
+
+
+class FixedTokenChunker(Chunker):
+    """Windows of exactly `max_tokens` tokens (fewer at the end), ignoring sentence boundaries."""
+    name = "fixed"
+
+    def _units(self, text: str, spans: List[Span]) -> List[Unit]:
+        return [(start, end, 1) for start, end in spans]
+
+
+CHUNKERS: Dict[str, Type[Chunker]] = {
+    chunker.name: chunker for chunker in (SentenceChunker, ParagraphChunker, FixedTokenChunker)
+}
+
+def create_chunker(strategy: str, **options) -> Chunker:
+    try:
+        chunker = CHUNKERS[strategy]
+    except KeyError:
+        raise ValueError(f"Unknown chunking strategy '{strategy}', expected one of {sorted(CHUNKERS)}")
+    return chunker(**options)
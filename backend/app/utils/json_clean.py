@@ -1,8 +1,11 @@
 import json
+import logging
 import re
 import ast
 from json.decoder import JSONDecodeError
 
+logger = logging.getLogger(__name__)
+
 def robust_json_load(json_string):
     """
     Try multiple approaches to load potentially malformed JSON data.
@@ -93,7 +96,7 @@ def robust_json_load(json_string):
         cleaned_json = clean_json_string(json_string)
         return json.loads(cleaned_json)
     except (JSONDecodeError, Exception) as e:
-        print(f"Error after initial cleaning: {e}")
+        logger.debug("Error after initial cleaning: %s", e)
         
         # Attempt 3: More aggressive cleaning - replace all escape characters
         try:
@@ -109,7 +112,7 @@ def robust_json_load(json_string):
             
             return json.loads(aggressive_clean)
         except (JSONDecodeError, Exception) as e2:
-            print(f"Error after aggressive cleaning: {e2}")
+            logger.debug("Error after aggressive cleaning: %s", e2)
             
             # Attempt 4: Manual parsing as last resort
             try:
@@ -233,12 +236,12 @@ def robust_json_load(json_string):
                                     else:
                                         result[key] = value
                             except Exception as e3:
-                                print(f"Error parsing value for key {key}: {e3}")
+                                logger.debug("Error parsing value for key %s: %s", key, e3)
                                 result[key] = value
                     
                     return result
             except Exception as e4:
-                print(f"Error during manual parsing: {e4}")
+                logger.debug("Error during manual parsing: %s", e4)
     
     # All methods failed
     return None
@@ -255,10 +258,10 @@ def parse_json_with_recovery(file_path, encoding='utf-8'):
         return robust_json_load(json_string)
     
     except FileNotFoundError:
-        print(f"File not found: {file_path}")
+        logger.error("File not found: %s", file_path)
         return None
     except Exception as e:
-        print(f"Error reading or parsing file: {e}")
+        logger.error("Error reading or parsing file: %s", e)
         return None
 
 def stream_repair_json(file_path, output_path=None, encoding='utf-8'):
@@ -328,7 +331,7 @@ def stream_repair_json(file_path, output_path=None, encoding='utf-8'):
                                         
                                     json.dump(obj, out, ensure_ascii=False, indent=2)
                                 except JSONDecodeError:
-                                    print(f"Warning: Couldn't fix object: {object_text[:50]}...")
+                                    logger.warning("Couldn't fix object: %s...", object_text[:50])
                                 
                                 object_text = ""
                 
@@ -337,7 +340,7 @@ def stream_repair_json(file_path, output_path=None, encoding='utf-8'):
             return True
     
     except Exception as e:
-        print(f"Error processing file: {e}")
+        logger.error("Error processing file: %s", e)
         return False
 
 if __name__ == "__main__":
@@ -0,0 +1,234 @@
+"""
+Single-pass extraction of the `{"storySegment": "...", "choices": [...]}` object
+from raw LLM output.
+
+The text is scanned once by a small state machine (a stack of open objects and
+arrays), so the cost is linear in the output size even for adversarial input.
+It tolerates markdown fences and prose around the object, stray `<tag>`/`<|tag|>`
+tokens between values, single-quoted or unquoted keys, trailing or missing
+commas, unescaped quotes inside strings and truncated endings.
+"""
+import json
+import re
+from typing import Any, List, Optional, Tuple
+
+from .json_stream import _SIMPLE_ESCAPES
+
+_WHITESPACE = " \t\r\n"
+_STRING_SPECIALS = {
+    '"': re.compile(r'["\\]'),
+    "'": re.compile(r"['\\]"),
+}
+_BARE_KEY = re.compile(r"[^:,{}\[\]\"'<\n]*")
+_BARE_VALUE = re.compile(r"[^,{}\[\]<\n]*")
+_HEX4 = re.compile(r"[0-9a-fA-F]{4}")
+_VALUE_STARTS = "\"'{[]}<"
+_BARE_KEY_COLON = re.compile(r"\w+\s*:")
+MIN_CHOICES = 2 # Fewer choices means truncated or degenerate output, which should be retried
+
+
+def _skip_whitespace(text: str, i: int) -> int:
+    n = len(text)
+    while i < n and text[i] in _WHITESPACE:
+        i += 1
+    return i
+
+def _closes_string(text: str, i: int, quote: str) -> bool:
+    """Whether the quote just before index `i` ends the string (vs. an unescaped quote in prose)."""
+    j = _skip_whitespace(text, i)
+    if j >= len(text) or text[j] in ":}]<`":
+        return True
+    if text[j] == quote:
+        return j > i # `"a" "b"`: a missing comma, but not `""` inside prose
+    if text[j] == ',':
+        j = _skip_whitespace(text, j + 1)
+        return j >= len(text) or text[j] in _VALUE_STARTS or _BARE_KEY_COLON.match(text, j) is not None
+    return False
+
+def _read_unicode_escape(text: str, i: int) -> Tuple[str, int]:
+    """Decodes `\\uXXXX` (and a following low surrogate) starting at the `u` at index `i`."""
+    if not _HEX4.match(text, i + 1):
+        return 'u', i + 1
+    code = int(text[i + 1:i + 5], 16)
+    i += 5
+    if 0xD800 <= code <= 0xDBFF and text.startswith('\\u', i) and _HEX4.match(text, i + 2):
+        low = int(text[i + 2:i + 6], 16)
+        if 0xDC00 <= low <= 0xDFFF:
+            return chr(0x10000 + ((code - 0xD800) << 10) + (low - 0xDC00)), i + 6
+    if 0xD800 <= code <= 0xDFFF:
+        return '\ufffd', i # Lone surrogate
+    return chr(code), i
+
+def _read_string(text: str, i: int) -> Tuple[str, int]:
+    """Reads a quoted string whose opening quote is at index `i`; returns (value, next index)."""
+    quote = text[i]
+    specials = _STRING_SPECIALS[quote]
+    parts: List[str] = []
+    i += 1
+    n = len(text)
+    while i < n:
+        match = specials.search(text, i)
+        if match is None:
+            break
+        j = match.start()
+        parts.append(text[i:j])
+        if text[j] == '\\':
+            if j + 1 >= n:
+                return "".join(parts), n
+            escaped = text[j + 1]
+            if escaped == 'u':
+                decoded, i = _read_unicode_escape(text, j + 1)
+                parts.append(decoded)
+            else:
+                parts.append(_SIMPLE_ESCAPES.get(escaped, escaped))
+                i = j + 2
+        elif _closes_string(text, j + 1, quote):
+            return "".join(parts), j + 1
+        else:
+            parts.append(quote)
+            i = j + 1
+    # Truncated: keep what was produced
+    parts.append(text[i:])
+    return "".join(parts), n
+
+def _bare_scalar(token: str) -> Any:
+    token = token.strip()
+    if token in ("true", "false", "null"):
+        return {"true": True, "false": False, "null": None}[token]
+    try:
+        return json.loads(token) if token[:1].isdigit() or token[:1] == '-' else token
+    except ValueError:
+        return token
+
+
+class _Frame:
+    __slots__ = ("container", "key", "expects_colon")
+
+    def __init__(self, container):
+        self.container = container
+        self.key: Optional[str] = None
+        self.expects_colon = False
+
+
+def _scan_object(text: str, start: int) -> Tuple[Any, int]:
+    """Leniently parses the object opening at `start`; returns (value, index after it)."""
+    stack: List[_Frame] = [_Frame({})]
+    i = start + 1
+    n = len(text)
+
+    def attach(value) -> Optional[Any]:
+        """Adds `value` to the innermost container; returns it if it was the root."""
+        if not stack:
+            return value
+        frame = stack[-1]
+        if isinstance(frame.container, list):
+            frame.container.append(value)
+        elif frame.key is not None:
+            frame.container[frame.key] = value
+            frame.key = None
+        return None
+
+    while i < n:
+        ch = text[i]
+        frame = stack[-1]
+        if ch in _WHITESPACE or ch == ',' or ch == '`':
+            i += 1
+            continue
+        if ch == '<':
+            # Stray tags like <|eot_id|> or </think> between values
+            end = text.find('>', i)
+            i = n if end == -1 else end + 1
+            continue
+        if ch == '}' or ch == ']':
+            stack.pop()
+            i += 1
+            root = attach(frame.container)
+            if not stack:
+                return root, i
+            continue
+
+        is_object = isinstance(frame.container, dict)
+        if is_object and frame.key is None:
+            if ch == '"' or ch == "'":
+                key, i = _read_string(text, i)
+            else:
+                match = _BARE_KEY.match(text, i)
+                key = match.group().strip()
+                i = max(match.end(), i + 1)
+                if not key:
+                    continue
+            frame.key = key
+            frame.expects_colon = True
+            continue
+        if is_object and frame.expects_colon:
+            frame.expects_colon = False
+            if ch == ':':
+                i += 1
+                continue
+
+        if ch == '{' or ch == '[':
+            stack.append(_Frame({} if ch == '{' else []))
+            i += 1
+        elif ch == '"' or ch == "'":
+            value, i = _read_string(text, i)
+            attach(value)
+        elif ch == ':':
+            i += 1
+        else:
+            match = _BARE_VALUE.match(text, i)
+            i = max(match.end(), i + 1)
+            attach(_bare_scalar(match.group()))
+
+    # Truncated: close everything that is still open
+    root = None
+    while stack:
+        root = attach(stack.pop().container)
+    return root, n
+
+def normalize_story(data: Any) -> Optional[dict]:
+    """Returns `data` (or a nested object) if it has the story shape (at least MIN_CHOICES choices as strings)."""
+    candidates = [data]
+    while candidates:
+        candidate = candidates.pop(0)
+        if not isinstance(candidate, dict):
+            continue
+        segment = candidate.get('storySegment')
+        choices = candidate.get('choices')
+        if isinstance(segment, str) and isinstance(choices, list):
+            # Scalars become text; nested values are dropped
+            choices = [c if isinstance(c, str) else str(c)
+                       for c in choices if isinstance(c, (str, int, float))]
+            choices = [c.strip() for c in choices if c.strip()]
+            if segment.strip() and len(choices) >= MIN_CHOICES:
+                return {**candidate, 'storySegment': segment, 'choices': choices}
+        candidates.extend(v for v in candidate.values() if isinstance(v, dict))
+    return None
+
+def extract_story_json(text: Optional[str]) -> Optional[dict]:
+    """Extracts the story object from raw LLM output, or None if there isn't one."""
+    return extract_story_json_with_outcome(text)[0]
+
+def extract_story_json_with_outcome(text: Optional[str]) -> Tuple[Optional[dict], str]:
+    """
+    Like extract_story_json, plus how it went: "direct", "repaired" or "failed".
+
+    Well-formed JSON takes the json.loads fast path; anything else is scanned
+    once, object by object, until one with the story shape is found.
+    """
+    if not text or not isinstance(text, str):
+        return None, "failed"
+    try:
+        story = normalize_story(json.loads(text))
+        if story:
+            return story, "direct"
+    except (ValueError, RecursionError): # RecursionError: deeply nested garbage
+        pass
+
+    i = text.find('{')
+    while i != -1:
+        value, end = _scan_object(text, i)
+        story = normalize_story(value)
+        if story:
+            return story, "repaired"
+        i = text.find('{', max(end, i + 1))
+    return None, "failed"
@@ -0,0 +1,111 @@
+"""Incremental extraction of the storySegment text from a streamed LLM JSON response."""
+
+_SIMPLE_ESCAPES = {
+    '"': '"',
+    '\\': '\\',
+    '/': '/',
+    'b': '\b',
+    'f': '\f',
+    'n': '\n',
+    'r': '\r',
+    't': '\t',
+}
+
+_KEY = '"storySegment"'
+
+
+class StorySegmentStreamParser:
+    """
+    Feeds raw token deltas of a `{"storySegment": "...", "choices": [...]}` response
+    and returns the newly decoded storySegment text after each feed.
+
+    Only the storySegment string is decoded incrementally; the complete raw text is
+    kept in `raw` so the final object can be parsed (and repaired) once the stream ends.
+    Each character is looked at once, so the cost is linear in the response size.
+    """
+
+    def __init__(self):
+        self.raw = ""
+        self._pos = 0          # Next index of `raw` to scan
+        self._state = "key"    # key -> colon -> open -> value -> done
+        self._escape = ""      # Pending escape sequence (without the backslash)
+        self._pending_high = None  # High surrogate waiting for its low half
+
+    @property
+    def done(self) -> bool:
+        return self._state == "done"
+
+    def feed(self, delta: str) -> str:
+        """Adds a chunk of raw output and returns any new storySegment text."""
+        if not delta:
+            return ""
+        self.raw += delta
+        if self._state == "done":
+            return ""
+
+        out = []
+        raw = self.raw
+        i = self._pos
+        n = len(raw)
+
+        while i < n and self._state != "done":
+            if self._state == "key":
+                found = raw.find(_KEY, max(0, i - len(_KEY) + 1))
+                if found == -1:
+                    # Keep the tail so a key split across deltas is still found
+                    i = n
+                    break
+                i = found + len(_KEY)
+                self._state = "colon"
+            elif self._state == "colon":
+                ch = raw[i]
+                i += 1
+                if ch == ':':
+                    self._state = "open"
+                elif not ch.isspace():
+                    self._state = "key"
+            elif self._state == "open":
+                ch = raw[i]
+                i += 1
+                if ch == '"':
+                    self._state = "value"
+                elif not ch.isspace():
+                    self._state = "key"
+            else:  # value
+                ch = raw[i]
+                i += 1
+                if self._escape:
+                    self._escape += ch
+                    decoded = self._decode_escape()
+                    if decoded is not None:
+                        out.append(decoded)
+                elif ch == '\\':
+                    self._escape = ch
+                elif ch == '"':
+                    self._state = "done"
+                else:
+                    out.append(ch)
+
+        self._pos = i
+        return "".join(out)
+
+    def _decode_escape(self):
+        """Returns decoded text once the pending escape is complete, else None."""
+        seq = self._escape[1:]
+        if seq[0] == 'u':
+            if len(seq) < 5:
+                return None
+            self._escape = ""
+            try:
+                code = int(seq[1:5], 16)
+            except ValueError:
+                return seq
+            if 0xD800 <= code <= 0xDBFF:
+                self._pending_high = code
+                return ""
+            if 0xDC00 <= code <= 0xDFFF and self._pending_high is not None:
+                code = 0x10000 + ((self._pending_high - 0xD800) << 10) + (code - 0xDC00)
+                self._pending_high = None
+            return chr(code)
+        self._escape = ""
+        return _SIMPLE_ESCAPES.get(seq, seq)
@@ -0,0 +1,93 @@
+import re
+from functools import lru_cache
+from typing import Callable, Optional
+
+from .ttl_cache import LRUCache
+
+# Words, numbers and single punctuation marks; long words are split into ~4 char pieces
+_TOKEN_PATTERN = re.compile(r"\w+|[^\w\s]")
+
+def _heuristic_count(text: str) -> int:
+    """Tokenizer-free estimate, close to BPE counts for German/English prose."""
+    count = 0
+    for match in _TOKEN_PATTERN.finditer(text):
+        length = match.end() - match.start()
+        count += 1 if length <= 4 else (length + 3) // 4
+    return count
+
+def _tiktoken_encoding(model_name: str):
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    try:
+        return tiktoken.encoding_for_model(model_name.split("/")[-1])
+    except KeyError:
+        # Not an OpenAI model; cl100k is a reasonable proxy for other BPE vocabularies
+        return tiktoken.get_encoding("cl100k_base")
+
+
+class TokenCounter:
+    """
+    Token counter for one model with a memo of recent texts.
+
+    Uses tiktoken when it is installed, otherwise a fast heuristic. History
+    entries and RAG chunks recur across turns, so most counts are cache hits.
+    """
+
+    def __init__(self, model_name: str, cache_entries: int = 4096):
+        self.model_name = model_name
+        self._encoding = _tiktoken_encoding(model_name)
+        self._count: Callable[[str], int] = (
+            (lambda text: len(self._encoding.encode(text, disallowed_special=())))
+            if self._encoding is not None else _heuristic_count
+        )
+        self._cache = LRUCache(cache_entries)
+
+    @property
+    def backend(self) -> str:
+        return f"tiktoken:{self._encoding.name}" if self._encoding is not None else "heuristic"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cached = self._cache.get(text)
+        if cached is None:
+            cached = self._count(text)
+            self._cache.set(text, cached)
+        return cached
+
+    def truncate(self, text: str, max_tokens: int, keep_end: bool = False) -> str:
+        """Shortens `text` to at most `max_tokens`, keeping its start (or its end)."""
+        if max_tokens <= 0:
+            return ""
+        if self.count(text) <= max_tokens:
+            return text
+        if self._encoding is not None:
+            tokens = self._encoding.encode(text, disallowed_special=())
+            tokens = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+            return self._encoding.decode(tokens)
+        # Heuristic: cut at the match boundary where the running count reaches the limit
+        matches = list(_TOKEN_PATTERN.finditer(text))
+        if keep_end:
+            matches.reverse()
+        used = 0
+        cut: Optional[int] = None
+        for match in matches:
+            length = match.end() - match.start()
+            used += 1 if length <= 4 else (length + 3) // 4
+            if used > max_tokens:
+                break
+            cut = match.start() if keep_end else match.end()
+        if cut is None:
+            return ""
+        return text[cut:] if keep_end else text[:cut]
+
+    def stats(self) -> dict:
+        return {"model": self.model_name, "backend": self.backend, "cache": self._cache.stats()}
+
+
+@lru_cache(maxsize=32)
+def get_token_counter(model_name: str) -> TokenCounter:
+    """One cached counter per model name."""
+    return TokenCounter(model_name)
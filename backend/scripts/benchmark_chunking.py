@@ -0,0 +1,164 @@
+"""
+Benchmark for the chunking strategies in app.utils.chunking.
+
+Chunks the tale corpus with each strategy and size, and reports chunking
+speed, chunk counts and token sizes. Unless `--no-retrieval` is given, it
+also measures retrieval quality. Queries are the middle part of random
+sentences. Each query is embedded with the embedding model and ranked
+against its tale's chunks, as rag_service does. A hit is a top-k chunk that
+contains the query's centre. "ctx tok" is the number of tokens the top-k
+chunks add to the prompt. Smaller chunks with the same recall give shorter
+prompts. Run from the backend directory:
+
+    python -m scripts.benchmark_chunking [--source data/tales.jsonl] [--strategies sentence paragraph fixed]
+        [--max-tokens 64 96 128] [--k 3] [--queries 20] [--no-retrieval]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+from typing import Dict, List, Tuple
+
+from app.core.config import settings
+from app.utils.chunking import CHUNKERS, create_chunker, heuristic_spans, normalize_text, sentence_ranges, token_spans_for
+
+Query = Tuple[int, str, int] # tale index, query text, centre offset in the normalized tale
+
+
+def load_tales(path: str) -> List[dict]:
+    if not path:
+        from data.german_tales import tale_list
+        return tale_list
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith((".jsonl", ".ndjson")):
+            return [json.loads(line) for line in f if line.strip()]
+        return json.load(f)
+
+
+def make_queries(texts: List[str], per_tale: int, seed: int) -> List[Query]:
+    """The middle ~60% of the words of random longer sentences."""
+    rng = random.Random(seed)
+    queries: List[Query] = []
+    for index, text in enumerate(texts):
+        sentences = [(start, end) for start, end in sentence_ranges(text) if len(text[start:end].split()) >= 10]
+        for start, end in rng.sample(sentences, min(per_tale, len(sentences))):
+            words = text[start:end].split()
+            cut = len(words) // 5
+            query = " ".join(words[cut:len(words) - cut])
+            offset = text.find(query, start)
+            if offset >= 0:
+                queries.append((index, query, offset + len(query) // 2))
+    return queries
+
+
+def chunk_offsets(text: str, chunks: List[str]) -> List[Tuple[int, int]]:
+    """Character ranges of the (ordered, possibly overlapping) chunks in the text."""
+    ranges = []
+    pos = 0
+    for chunk in chunks:
+        start = text.find(chunk, pos)
+        ranges.append((start, start + len(chunk)))
+        pos = start + 1
+    return ranges
+
+
+def time_chunking(chunker, texts: List[str], repeat: int) -> Tuple[List[List[str]], float]:
+    best = float("inf")
+    chunked: List[List[str]] = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        chunked = [chunker.chunk(text) for text in texts]
+        best = min(best, time.perf_counter() - start)
+    return chunked, best
+
+
+def evaluate_retrieval(model, texts: List[str], chunked: List[List[str]], queries: List[Query],
+                       query_vectors, k: int, count_tokens) -> Dict[str, float]:
+    hits = 0
+    reciprocal_ranks = 0.0
+    context_tokens = 0
+    for index, (text, chunks) in enumerate(zip(texts, chunked)):
+        tale_queries = [(i, q) for i, q in enumerate(queries) if q[0] == index]
+        if not tale_queries or not chunks:
+            continue
+        vectors = model.encode(chunks, normalize_embeddings=True, show_progress_bar=False)
+        ranges = chunk_offsets(text, chunks)
+        for i, (_, _, centre) in tale_queries:
+            order = (vectors @ query_vectors[i]).argsort()[::-1]
+            relevant = [rank for rank, c in enumerate(order) if ranges[c][0] <= centre < ranges[c][1]]
+            if relevant and relevant[0] < k:
+                hits += 1
+            if relevant:
+                reciprocal_ranks += 1 / (relevant[0] + 1)
+            context_tokens += sum(count_tokens(chunks[c]) for c in order[:k])
+    total = max(len(queries), 1)
+    return {"recall": hits / total, "mrr": reciprocal_ranks / total, "context_tokens": context_tokens / total}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--source", default=None, help="JSON array or JSONL file of tales (default: data/german_tales.py)")
+    parser.add_argument("--strategies", nargs="+", choices=sorted(CHUNKERS), default=sorted(CHUNKERS))
+    parser.add_argument("--max-tokens", type=int, nargs="+", default=[64, 96, 128])
+    parser.add_argument("--overlap", type=float, default=0.2, help="Overlap as a share of max tokens")
+    parser.add_argument("--min", type=float, default=0.4, help="Minimum last chunk as a share of max tokens")
+    parser.add_argument("--model", default=settings.embedding_model_name)
+    parser.add_argument("--heuristic-tokens", action="store_true", help="Count tokens without the model's tokenizer")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--k", type=int, default=3, help="Chunks retrieved per query (rag_service uses 3)")
+    parser.add_argument("--queries", type=int, default=20, help="Queries per tale")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--no-retrieval", action="store_true", help="Only measure chunking speed and sizes")
+    args = parser.parse_args()
+
+    tales = [tale for tale in load_tales(args.source) if tale.get("full_text")]
+    if not tales:
+        print("No tales with full_text found.")
+        sys.exit(1)
+    texts = [normalize_text(tale["full_text"]) for tale in tales]
+    token_spans = heuristic_spans if args.heuristic_tokens else token_spans_for(args.model)
+    count_tokens = lambda text: len(token_spans(text))
+    corpus_mb = sum(len(text.encode("utf-8")) for text in texts) / 1e6
+    print(f"Corpus: {len(texts)} tales, {corpus_mb:.2f} MB, {sum(map(count_tokens, texts))} tokens "
+          f"({'heuristic' if token_spans is heuristic_spans else args.model + ' tokenizer'})")
+
+    model = None
+    queries: List[Query] = []
+    if not args.no_retrieval:
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            print("sentence-transformers is not installed, skipping retrieval quality.")
+        else:
+            model = SentenceTransformer(args.model)
+            queries = make_queries(texts, args.queries, args.seed)
+            query_vectors = model.encode([q for _, q, _ in queries], normalize_embeddings=True, show_progress_bar=False)
+            print(f"Retrieval: {len(queries)} queries, top {args.k}")
+
+    header = f"{'strategy':<10}{'max':>5}{'chunks':>8}{'avg tok':>9}{'MB/s':>8}{'chunks/s':>10}"
+    if model is not None:
+        header += f"{f'recall@{args.k}':>11}{'MRR':>7}{'ctx tok':>9}"
+    print(header)
+    for strategy in args.strategies:
+        for max_tokens in args.max_tokens:
+            chunker = create_chunker(
+                strategy,
+                max_tokens=max_tokens,
+                min_tokens=int(max_tokens * args.min),
+                overlap_tokens=int(max_tokens * args.overlap),
+                token_spans=token_spans,
+            )
+            chunked, elapsed = time_chunking(chunker, texts, args.repeat)
+            chunks = [chunk for tale_chunks in chunked for chunk in tale_chunks]
+            average = sum(map(count_tokens, chunks)) / max(len(chunks), 1)
+            row = (f"{strategy:<10}{max_tokens:>5}{len(chunks):>8}{average:>9.1f}"
+                   f"{corpus_mb / max(elapsed, 1e-9):>8.2f}{len(chunks) / max(elapsed, 1e-9):>10.0f}")
+            if model is not None:
+                quality = evaluate_retrieval(model, texts, chunked, queries, query_vectors, args.k, count_tokens)
+                row += f"{quality['recall']:>11.3f}{quality['mrr']:>7.3f}{quality['context_tokens']:>9.0f}"
+            print(row)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Fuzz corpus and benchmark for app.utils.json_extract.
+
+Runs the extractor over a deterministic corpus of realistic, mangled and
+adversarial LLM outputs, checks it never raises and still recovers the story
+where it should, then times worst-case inputs of growing size to show the cost
+stays linear. Run from the backend directory:
+
+    python -m scripts.benchmark_json_extract [--seed 7] [--mutations 2000]
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+from app.utils.json_extract import extract_story_json
+from app.utils.json_clean import robust_json_load
+
+SEGMENT = (
+    "Der Mond schien silbern auf den moosigen Pfad, als Rotkäppchen ihren ersten Schritt ins Dunkel wagte. "
+    "Zwischen den Wurzeln einer alten Eiche glomm ein Licht, und eine leise Stimme rief: \"Komm näher, Kind.\" "
+)
+CHOICES = ["Rotkäppchen folgt dem Licht zur Eiche.", "Rotkäppchen läuft schnell zurück zum Dorf."]
+
+# (raw output, whether the story must be recovered)
+SEED_CASES = [
+    (json.dumps({"storySegment": SEGMENT, "choices": CHOICES}, ensure_ascii=False), True),
+    ("```json\n" + json.dumps({"storySegment": SEGMENT, "choices": CHOICES}) + "\n```", True),
+    ('<think>Die Szene braucht eine Wendung.</think>{"storySegment": "Es war einmal.", "choices": ["A", "B"]}<|eot_id|>', True),
+    ('{"storySegment": "Text", "choices": ["A", "B",],}', True),
+    ("{storySegment: 'Text', choices: ['A', 'B']}", True),
+    ('{"storySegment": "Er sagte "Hallo" und ging.", "choices": ["A", "B"]}', True),
+    ('{"storySegment": "Er rief: "Lauf!", und rannte.", "choices": ["A", "B"]}', True),
+    ('{"storySegment": "Text", <|end|> "choices": ["A" "B"]}', True),
+    ('{"storySegment": "Umlaute \\u00e4\\u00f6 und \\ud83c\\udf19", "choices": ["A", "B"]}', True),
+    ('Hier ist die Antwort: {"response": {"storySegment": "X", "choices": ["A", "B"]}}', True),
+    ('{"storySegment": "Abgebrochen mitten im Satz", "choices": ["A", "B', True),
+    ('{"storySegment": "Nur der Text, keine Optionen', False),
+    ("Ich kann diese Anfrage nicht beantworten.", False),
+    ("", False),
+]
+
+ADVERSARIAL = {
+    "open_braces": lambda n: "{" * n,
+    "open_brackets": lambda n: '{"storySegment": "x", "choices": ' + "[" * n,
+    "quotes": lambda n: '{"storySegment": "' + '"' * n,
+    "quote_comma": lambda n: '{"storySegment": "' + '", ' * (n // 3),
+    "backslashes": lambda n: '{"storySegment": "' + "\\" * n,
+    "unclosed_tags": lambda n: '{"storySegment": "x", ' + "<" * n,
+    "tag_pairs": lambda n: "<userStyle>" * (n // 11) + '{"storySegment": "x", "choices": ["a", "b"]}',
+    "whitespace_quotes": lambda n: '{"storySegment": "' + ('"' + " " * 30) * (n // 31),
+    "many_objects": lambda n: '{"a": 1} ' * (n // 9),
+    "long_story": lambda n: json.dumps({"storySegment": "Es war einmal " * (n // 14), "choices": CHOICES})[:-1],
+}
+
+
+def mutate(rng: random.Random, text: str) -> str:
+    """Applies one random corruption typical of LLM output."""
+    op = rng.randrange(8)
+    if not text:
+        return text
+    pos = rng.randrange(len(text) + 1)
+    if op == 0:
+        return text[:pos] # Truncate
+    if op == 1:
+        return text[:pos] + rng.choice(['"', "'", ",", "\\", "{", "}", "[", "]", ":"]) + text[pos:]
+    if op == 2:
+        return text[:pos] + rng.choice(["<|im_end|>", "</s>", "<userStyle>x</userStyle>", "```"]) + text[pos:]
+    if op == 3:
+        return text[:pos] + text[pos + 1:] # Drop a character
+    if op == 4:
+        return "```json\n" + text + "\n```"
+    if op == 5:
+        return "Natürlich! Hier ist die Szene:\n" + text + "\nIch hoffe, sie gefällt dir."
+    if op == 6:
+        return text.replace(", ", ",, ", 1)
+    return text[:pos] + "\n" + text[pos:]
+
+
+def run_corpus(seed: int, mutations: int) -> bool:
+    ok = True
+    for raw, must_recover in SEED_CASES:
+        story = extract_story_json(raw)
+        if must_recover and not story:
+            print(f"FAIL: not recovered: {raw[:80]!r}")
+            ok = False
+        if story and not (isinstance(story["storySegment"], str) and all(isinstance(c, str) for c in story["choices"])):
+            print(f"FAIL: wrong shape: {story!r}")
+            ok = False
+
+    rng = random.Random(seed)
+    recovered = 0
+    for _ in range(mutations):
+        raw, _ = rng.choice(SEED_CASES)
+        for _ in range(rng.randint(1, 3)):
+            raw = mutate(rng, raw)
+        try:
+            if extract_story_json(raw):
+                recovered += 1
+        except Exception as e:
+            print(f"FAIL: raised {type(e).__name__}: {e} on {raw[:80]!r}")
+            ok = False
+    print(f"Corpus: {len(SEED_CASES)} seed cases, {mutations} mutations, {recovered} recovered, {'OK' if ok else 'FAILED'}")
+    return ok
+
+
+def time_call(func, text: str, repeat: int = 3) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run_benchmark(sizes, compare: bool) -> bool:
+    ok = True
+    header = f"{'input':<18}" + "".join(f"{size // 1024:>9}KB" for size in sizes) + "   growth"
+    print(header)
+    for name, build in ADVERSARIAL.items():
+        timings = [time_call(extract_story_json, build(size)) for size in sizes]
+        growth = timings[-1] / max(timings[0], 1e-9) / (sizes[-1] / sizes[0])
+        # Linear cost keeps the per-byte growth near 1; allow generous noise
+        if growth > 4:
+            ok = False
+        print(f"{name:<18}" + "".join(f"{t * 1000:>9.2f}ms" for t in timings) + f"   x{growth:.2f}")
+        if compare:
+            cells = []
+            for size in sizes:
+                try:
+                    cells.append(f"{time_call(robust_json_load, build(size), repeat=1) * 1000:>9.2f}ms")
+                except Exception as e:
+                    cells.append(f"{type(e).__name__[:9]:>11}")
+            print(f"{'  (json_clean)':<18}" + "".join(cells))
+    print(f"Worst-case scaling: {'linear' if ok else 'SUPERLINEAR'}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--mutations", type=int, default=2000)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[4096, 16384, 65536])
+    parser.add_argument("--compare", action="store_true", help="Also time the old json_clean.robust_json_load")
+    args = parser.parse_args()
+
+    ok = run_corpus(args.seed, args.mutations)
+    ok = run_benchmark(args.sizes, args.compare) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+"""
+Load test for the /api/generate-tale pipeline.
+
+Runs concurrent multi-turn story sessions through the turn handlers in
+app.api.routes (prompt assembly, RAG, dispatch, admission, parsing, summaries)
+against the stand-in LLM from scripts.fake_llm_server. It reports turn latency
+percentiles, per-stage timings from the telemetry histograms, turns per second
+and memory. Results can be written as JSON and compared against an earlier
+run to catch regressions. Run from the backend directory:
+
+    python -m scripts.benchmark_load [--sessions 40] [--turns 6] [--concurrency 8] [--stream]
+        [--rag fixed|real] [--out bench.json] [--compare baseline.json --max-regression 0.15]
+
+`--llm mock` uses the in-process "mock" provider instead of the HTTP stand-in.
+`--cassette PATH` replays recorded provider responses (app.services.llm_cassette),
+or records them with `--cassette-mode record`. `--rag fixed` replaces retrieval
+with fixed chunks after a fixed delay, so the run does not need a populated
+Chroma DB. `--rag real` uses the configured backend and tale data.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import socket
+import subprocess
+import sys
+import time
+import tracemalloc
+from typing import Dict, List, Optional, Tuple
+
+from scripts import fake_llm_server
+
+START_ACTION = "Rotkäppchen bekommt den Kuchen von der Mutter und soll zur Großmutter gehen, ohne vom Weg abzukommen."
+FIXED_CHUNKS = [
+    "Es war einmal eine kleine süße Dirne, die hatte jedermann lieb, der sie nur ansah.",
+    "Die Großmutter wohnte draußen im Wald, eine halbe Stunde vom Dorf.",
+    "Wie nun Rotkäppchen in den Wald kam, begegnete ihm der Wolf.",
+    "Rotkäppchen aber wußte nicht, was das für ein böses Tier war, und fürchtete sich nicht vor ihm.",
+    "Der Wolf dachte bei sich: Das junge zarte Ding, das ist ein fetter Bissen.",
+]
+# Metrics compared by --compare: (path in the results, True if higher is better)
+COMPARED = [
+    (("latency_s", "p50"), False),
+    (("latency_s", "p95"), False),
+    (("latency_s", "p99"), False),
+    (("throughput", "turns_per_s"), True),
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    position = q * (len(ordered) - 1)
+    low = int(position)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+
+def latency_summary(values: List[float]) -> Dict[str, Optional[float]]:
+    return {
+        "count": len(values),
+        "mean": sum(values) / len(values) if values else None,
+        "p50": percentile(values, 0.5),
+        "p95": percentile(values, 0.95),
+        "p99": percentile(values, 0.99),
+        "max": max(values) if values else None,
+    }
+
+def bucket_percentile(buckets, counts: List[int], q: float) -> Optional[float]:
+    """Percentile estimated from histogram buckets (linear within the bucket)."""
+    total = sum(counts)
+    if not total:
+        return None
+    target = q * total
+    seen = 0
+    lower = 0.0
+    for bound, count in zip(buckets, counts):
+        if count and seen + count >= target:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (target - seen) / count
+        seen += count
+        if bound != float("inf"):
+            lower = bound
+    return lower
+
+def stage_summary(before: dict, after: dict, buckets) -> Dict[str, dict]:
+    """Per-stage count/mean/p50/p95 from two snapshots of the turn stage histogram."""
+    merged: Dict[str, Tuple[List[int], float]] = {}
+    for key, (counts, total) in after.items():
+        old_counts, old_total = before.get(key, ([0] * len(counts), 0.0))
+        stage = key[0]
+        acc_counts, acc_total = merged.get(stage, ([0] * len(counts), 0.0))
+        merged[stage] = ([a + c - o for a, c, o in zip(acc_counts, counts, old_counts)], acc_total + total - old_total)
+    result = {}
+    for stage, (counts, total) in sorted(merged.items()):
+        count = sum(counts)
+        if count:
+            result[stage] = {
+                "count": count,
+                "mean": total / count,
+                "p50": bucket_percentile(buckets, counts, 0.5),
+                "p95": bucket_percentile(buckets, counts, 0.95),
+            }
+    return result
+
+def rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def start_fake_llm(args) -> Tuple[object, int]:
+    import uvicorn
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind(("127.0.0.1", args.llm_port))
+    server = uvicorn.Server(uvicorn.Config(
+        fake_llm_server.create_app(fake_llm_server.config_from_args(args)), log_level="warning", lifespan="off"
+    ))
+    task = asyncio.create_task(server.serve(sockets=[sock]))
+    while not server.started:
+        if task.done():
+            task.result()
+        await asyncio.sleep(0.01)
+    return (server, task), sock.getsockname()[1]
+
+def configure_backend(args, port: int):
+    """Points the backend at the fake LLM; must run before routes handle requests."""
+    from app.core.config import settings
+
+    if args.llm == "mock":
+        settings.llm_type = "mock"
+        settings.llm_model_name = "mock-story"
+        settings.mock_llm_latency_ms = args.latency_ms
+        settings.mock_llm_tokens_per_s = args.tokens_per_s
+        settings.mock_llm_seed = args.seed
+    else:
+        settings.llm_type = "openai_compatible"
+        settings.llm_model_name = "fake-llm"
+        settings.openai_api_url = f"http://127.0.0.1:{port}/v1/chat/completions"
+    if args.cassette:
+        settings.llm_cassette_mode = args.cassette_mode
+        settings.llm_cassette_path = args.cassette
+        settings.llm_cassette_realtime = True
+    settings.llm_fallback_models = []
+    settings.llm_concurrency_limits = {settings.llm_type: args.llm_concurrency}
+    settings.llm_queue_max = max(settings.llm_queue_max, args.concurrency * 2)
+    settings.speculation_enabled = args.speculation
+    settings.log_level = args.log_level
+
+def use_fixed_rag(rag_service, latency_ms: float):
+    async def fixed_docs(tale_id: str, query_text: str, k: int = 3) -> Optional[List[str]]:
+        await asyncio.sleep(latency_ms / 1000)
+        return FIXED_CHUNKS[:k]
+    rag_service.aretrieve_relevant_docs = fixed_docs
+
+
+class SessionRunner:
+    def __init__(self, args, routes, schema, tale_id: str):
+        self.args = args
+        self.routes = routes
+        self.schema = schema
+        self.tale_id = tale_id
+        self.latencies: List[float] = []
+        self.first_segment: List[float] = []
+        self.errors: Dict[str, int] = {}
+        self.turns = 0
+        self.record = False
+
+    def _error(self, kind: str):
+        if self.record:
+            self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    async def turn(self, request) -> Optional[object]:
+        start = time.perf_counter()
+        try:
+            if self.args.stream:
+                response = await self._stream_turn(request, start)
+            else:
+                response = await self.routes.run_turn_timed("bench", request)
+        except Exception as e:
+            self._error(type(e).__name__)
+            return None
+        if response is not None and self.record:
+            self.latencies.append(time.perf_counter() - start)
+            self.turns += 1
+        return response
+
+    async def _stream_turn(self, request, start: float):
+        response = None
+        first = True
+        events = self.routes.speculative_turn_events(request)
+        async for event in self.routes.timed_turn_events("bench_stream", request, events):
+            name, _, data = event.partition("\ndata: ")
+            if first and name == "event: segment":
+                first = False
+                if self.record:
+                    self.first_segment.append(time.perf_counter() - start)
+            elif name == "event: done":
+                response = self.schema.TaleResponse(**json.loads(data))
+            elif name == "event: error":
+                self._error(json.loads(data).get("detail", "error")[:40])
+        return response
+
+    async def session(self, index: int, turns: int):
+        rng = random.Random(self.args.seed * 1000 + index)
+        history: List[str] = []
+        summary = f'The story of "{self.tale_id}" begins...'
+        choice = START_ACTION
+        for number in range(turns):
+            request = self.schema.TaleRequest(
+                taleId=self.tale_id,
+                storyHistory=history,
+                currentSummary=summary,
+                currentTurnNumber=number,
+                action=self.schema.StoryAction(choice=choice)
+            )
+            response = await self.turn(request)
+            if response is None:
+                return
+            history = history + [f"> {choice}", response.storySegment]
+            summary = response.updatedSummary
+            choice = rng.choice(response.choices)
+            if self.args.think_ms:
+                await asyncio.sleep(rng.uniform(0.5, 1.5) * self.args.think_ms / 1000)
+
+    async def run(self, sessions: int, turns: int):
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+
+        async def limited(index: int):
+            async with semaphore:
+                await self.session(index, turns)
+
+        await asyncio.gather(*(limited(i) for i in range(sessions)))
+
+
+async def run_benchmark(args) -> dict:
+    servers, port = await start_fake_llm(args)
+    configure_backend(args, port)
+
+    from app.core import log
+    from app.core.config import settings
+    from app.api import routes
+    from app.models import schema
+    from app.services import llm_service, rag_service, telemetry
+
+    log.setup_logging()
+    await llm_service.init_http_clients()
+    tale_id = args.tale
+    if args.rag == "fixed":
+        use_fixed_rag(rag_service, args.rag_latency_ms)
+    else:
+        rag_service.get_embedding_model()
+        if settings.rag_backend == "numpy":
+            rag_service.load_vector_index()
+        tales = rag_service.get_available_tales()
+        if tales and tale_id not in tales:
+            tale_id = tales[0]
+
+    runner = SessionRunner(args, routes, schema, tale_id)
+    try:
+        if args.warmup_sessions:
+            await runner.run(args.warmup_sessions, 2)
+
+        if args.tracemalloc:
+            tracemalloc.start()
+        rss_before = rss_bytes()
+        stages_before = telemetry.TURN_STAGE_SECONDS.collect()
+        runner.record = True
+        start = time.perf_counter()
+        await runner.run(args.sessions, args.turns)
+        duration = time.perf_counter() - start
+        stages_after = telemetry.TURN_STAGE_SECONDS.collect()
+        traced_peak = tracemalloc.get_traced_memory()[1] if args.tracemalloc else None
+        if args.tracemalloc:
+            tracemalloc.stop()
+    finally:
+        await llm_service.close_http_clients()
+        rag_service.shutdown_rag_executor()
+        server, task = servers
+        server.should_exit = True
+        await task
+        log.shutdown_logging()
+
+    rss_after = rss_bytes()
+    return {
+        "meta": {
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "args": vars(args),
+        },
+        "throughput": {
+            "turns": runner.turns,
+            "duration_s": duration,
+            "turns_per_s": runner.turns / duration if duration else None,
+            "errors": runner.errors,
+        },
+        "latency_s": latency_summary(runner.latencies),
+        "first_segment_s": latency_summary(runner.first_segment) if args.stream else None,
+        "stages_s": stage_summary(stages_before, stages_after, telemetry.TURN_STAGE_SECONDS.buckets),
+        "memory": {
+            "rss_before_bytes": rss_before,
+            "rss_after_bytes": rss_after,
+            "max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+            "traced_peak_bytes": traced_peak,
+        },
+        "llm_usage": llm_service.get_usage_stats(),
+    }
+
+
+def _ms(value: Optional[float]) -> str:
+    return f"{value * 1000:9.1f}" if value is not None else f"{'-':>9}"
+
+def print_report(results: dict):
+    throughput = results["throughput"]
+    print(f"Turns: {throughput['turns']} in {throughput['duration_s']:.2f}s "
+          f"= {throughput['turns_per_s'] or 0:.2f} turns/s, errors: {throughput['errors'] or 'none'}")
+    print(f"{'':<16}{'mean ms':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'count':>7}")
+    rows = [("turn", results["latency_s"])]
+    if results["first_segment_s"]:
+        rows.append(("first segment", results["first_segment_s"]))
+    for name, stats in rows:
+        print(f"{name:<16}{_ms(stats['mean'])}{_ms(stats['p50'])}{_ms(stats['p95'])}{_ms(stats['p99'])}{stats['count']:>7}")
+    for name, stats in results["stages_s"].items():
+        print(f"  {name:<14}{_ms(stats['mean'])}{_ms(stats['p50'])}{_ms(stats['p95'])}{'':>9}{stats['count']:>7}")
+    memory = results["memory"]
+    mib = lambda value: f"{value / 2**20:.1f} MiB" if value else "-"
+    print(f"Memory: RSS {mib(memory['rss_before_bytes'])} -> {mib(memory['rss_after_bytes'])}, "
+          f"max RSS {mib(memory['max_rss_bytes'])}, traced peak {mib(memory['traced_peak_bytes'])}")
+
+def compare(results: dict, baseline: dict, max_regression: float) -> bool:
+    """Prints the change against a baseline; False if a metric regressed beyond max_regression."""
+    ok = True
+    print(f"Compared to {baseline['meta'].get('commit') or 'baseline'}:")
+    for path, higher_is_better in COMPARED:
+        old, new = baseline, results
+        for part in path:
+            old, new = (old or {}).get(part), (new or {}).get(part)
+        if not old or new is None:
+            continue
+        change = (new - old) / old
+        regressed = -change > max_regression if higher_is_better else change > max_regression
+        ok = ok and not regressed
+        print(f"  {'.'.join(path):<24}{old:>10.4f} -> {new:>10.4f}  {change:+7.1%}{'  REGRESSION' if regressed else ''}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, default=40, help="Story sessions to run")
+    parser.add_argument("--turns", type=int, default=6, help="Turns per session")
+    parser.add_argument("--concurrency", type=int, default=8, help="Sessions running at once")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="Mean pause between a session's turns")
+    parser.add_argument("--warmup-sessions", type=int, default=2)
+    parser.add_argument("--stream", action="store_true", help="Use the SSE turn path instead of the JSON one")
+    parser.add_argument("--speculation", action="store_true", help="Enable speculative pre-generation")
+    parser.add_argument("--tale", default="Rotkäppchen")
+    parser.add_argument("--rag", choices=["fixed", "real"], default="fixed")
+    parser.add_argument("--rag-latency-ms", type=float, default=15.0, help="Delay of the fixed retrieval")
+    parser.add_argument("--llm", choices=["server", "mock"], default="server",
+                        help="HTTP stand-in server or the built-in mock provider")
+    parser.add_argument("--cassette", help="LLM cassette to replay (or record, see --cassette-mode)")
+    parser.add_argument("--cassette-mode", choices=["replay", "record"], default="replay")
+    parser.add_argument("--llm-port", type=int, default=0, help="Port of the fake LLM (0: any free port)")
+    parser.add_argument("--llm-concurrency", type=int, default=16, help="Backend admission limit for the fake LLM")
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--tracemalloc", action="store_true", help="Also trace Python allocations (slower)")
+    parser.add_argument("--out", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Results JSON of an earlier run to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.15, help="Allowed relative slowdown for --compare")
+    fake_llm_server.add_arguments(parser)
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmark(args))
+    print_report(results)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+        print(f"Results written to {args.out}")
+    ok = True
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            ok = compare(results, json.load(f), args.max_regression)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""
+Exports the embedding model to ONNX (fp32 and int8) and checks parity.
+
+Writes model.onnx, model_int8.onnx (dynamic int8 quantization of the weights),
+tokenizer.json and embedding_export.json (pooling and sequence length) to
+`--out`. That directory is settings.embedding_onnx_path, used with
+embedding_backend "onnx" or "onnx-int8". The export needs torch and
+sentence-transformers. Serving only needs onnxruntime and tokenizers.
+
+It then encodes tale chunks and short queries with every backend. Each
+backend's vectors are compared to sentence-transformers': minimum cosine
+similarity, max absolute difference, and agreement of the top-3 chunks per
+query. It also reports single-query latency and batch throughput. The exit
+code is 1 if a backend is below its tolerance. Run from the backend directory:
+
+    python -m scripts.export_embedding_model [--out ./models/embedding_onnx] [--check-only]
+        [--min-cosine 0.999] [--min-cosine-int8 0.98]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+from typing import List
+
+import numpy as np
+
+from app.core.config import settings
+from app.services.embedding_backend import EXPORT_CONFIG_FILE, ONNX_MODEL_FILES, create_embedder
+from app.utils.chunking import create_chunker
+
+QUERIES = [
+    "Rotkäppchen geht in den Wald.",
+    "Der Wolf frisst die Großmutter.",
+    "Der Jäger schneidet dem Wolf den Bauch auf.",
+    "Ich pflücke Blumen am Wegesrand.",
+    "Ich frage den Wolf nach dem Weg.",
+    "Warum hast du so große Ohren?",
+    "Ich laufe schnell nach Hause zurück.",
+    "Die Großmutter liegt krank im Bett.",
+]
+
+
+def export(model_name: str, out_dir: str, opset: int):
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+    from sentence_transformers.models import Normalize, Pooling
+
+    model = SentenceTransformer(model_name, device="cpu")
+    pooling = next((module for module in model if isinstance(module, Pooling)), None)
+    pooling_mode = pooling.get_pooling_mode_str() if pooling is not None else "mean"
+    if pooling_mode not in ("mean", "cls"):
+        raise SystemExit(f"Unsupported pooling mode '{pooling_mode}' (only mean and cls are implemented)")
+    tokenizer = model.tokenizer
+    transformer = model[0].auto_model.eval()
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    os.makedirs(out_dir, exist_ok=True)
+    sample = tokenizer(["Es war einmal ein Mädchen."], return_tensors="pt")
+    fp32_path = os.path.join(out_dir, ONNX_MODEL_FILES["onnx"])
+    with torch.no_grad():
+        torch.onnx.export(
+            HiddenStates(transformer),
+            (sample["input_ids"], sample["attention_mask"]),
+            fp32_path,
+            input_names=["input_ids", "attention_mask"],
+            output_names=["last_hidden_state"],
+            dynamic_axes={
+                "input_ids": {0: "batch", 1: "sequence"},
+                "attention_mask": {0: "batch", 1: "sequence"},
+                "last_hidden_state": {0: "batch", 1: "sequence"},
+            },
+            opset_version=opset,
+        )
+    print(f"Exported {fp32_path} ({os.path.getsize(fp32_path) / 1e6:.0f} MB)")
+    int8_path = os.path.join(out_dir, ONNX_MODEL_FILES["onnx-int8"])
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    print(f"Quantized {int8_path} ({os.path.getsize(int8_path) / 1e6:.0f} MB)")
+
+    tokenizer.save_pretrained(out_dir) # tokenizer.json for the `tokenizers` library
+    config = {
+        "model_name": model_name,
+        "max_seq_length": model.max_seq_length,
+        "pooling": pooling_mode,
+        "normalize": any(isinstance(module, Normalize) for module in model),
+        "pad_token": tokenizer.pad_token,
+        "pad_token_id": tokenizer.pad_token_id,
+        "dimension": model.get_sentence_embedding_dimension(),
+    }
+    with open(os.path.join(out_dir, EXPORT_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump(config, f, indent=2)
+    print(f"Wrote {EXPORT_CONFIG_FILE}: {config}")
+
+
+def sample_texts(limit: int) -> List[str]:
+    from data.german_tales import tale_list
+    chunker = create_chunker("sentence", max_tokens=128, min_tokens=48, overlap_tokens=24)
+    chunks = [chunk for tale in tale_list for chunk in chunker.chunk(tale.get("full_text", ""))]
+    return chunks[:limit]
+
+
+def cosine_rows(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def top_k(queries: np.ndarray, chunks: np.ndarray, k: int = 3) -> List[set]:
+    scores = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ (
+        chunks / np.linalg.norm(chunks, axis=1, keepdims=True)).T
+    return [set(row.argsort()[::-1][:k]) for row in scores]
+
+
+def time_backend(embedder, chunks: List[str], repeat: int) -> dict:
+    embedder.encode(QUERIES[:1]) # Warm-up
+    latencies = []
+    for _ in range(repeat):
+        for query in QUERIES:
+            start = time.perf_counter()
+            embedder.encode([query])
+            latencies.append(time.perf_counter() - start)
+    start = time.perf_counter()
+    embedder.encode(chunks, batch_size=32)
+    elapsed = time.perf_counter() - start
+    return {"query_p50_ms": statistics.median(latencies) * 1000, "chunks_per_s": len(chunks) / max(elapsed, 1e-9)}
+
+
+def check(model_name: str, out_dir: str, min_cosine: float, min_cosine_int8: float, samples: int,
+          repeat: int, threads: int) -> bool:
+    chunks = sample_texts(samples)
+    texts = chunks + QUERIES
+    reference = create_embedder("torch", model_name, out_dir)
+    expected = reference.encode(texts)
+    expected_top = top_k(expected[len(chunks):], expected[:len(chunks)])
+    results = {"torch": time_backend(reference, chunks, repeat)}
+    ok = True
+    print(f"Parity on {len(chunks)} chunks and {len(QUERIES)} queries against sentence-transformers:")
+    for backend, tolerance in (("onnx", min_cosine), ("onnx-int8", min_cosine_int8)):
+        embedder = create_embedder(backend, model_name, out_dir, threads)
+        vectors = embedder.encode(texts)
+        cosine = float(cosine_rows(expected, vectors).min())
+        max_diff = float(np.abs(expected - vectors).max())
+        top = top_k(vectors[len(chunks):], vectors[:len(chunks)])
+        agreement = sum(len(a & b) for a, b in zip(expected_top, top)) / max(sum(map(len, expected_top)), 1)
+        passed = cosine >= tolerance
+        ok = ok and passed
+        print(f"  {backend:<10} min cosine {cosine:.5f} (>= {tolerance}), max |diff| {max_diff:.5f}, "
+              f"top-3 agreement {agreement:.0%}  {'OK' if passed else 'FAILED'}")
+        results[backend] = time_backend(embedder, chunks, repeat)
+    print(f"{'backend':<12}{'query p50':>12}{'chunks/s':>12}")
+    for backend, timing in results.items():
+        print(f"{backend:<12}{timing['query_p50_ms']:>10.2f}ms{timing['chunks_per_s']:>12.0f}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=settings.embedding_model_name)
+    parser.add_argument("--out", default=settings.embedding_onnx_path)
+    parser.add_argument("--opset", type=int, default=14)
+    parser.add_argument("--check-only", action="store_true", help="Only compare an existing export")
+    parser.add_argument("--min-cosine", type=float, default=0.999, help="Tolerance for the fp32 ONNX model")
+    parser.add_argument("--min-cosine-int8", type=float, default=0.98, help="Tolerance for the int8 model")
+    parser.add_argument("--samples", type=int, default=200, help="Tale chunks compared and timed")
+    parser.add_argument("--repeat", type=int, default=5, help="Rounds of single-query timings")
+    parser.add_argument("--threads", type=int, default=settings.embedding_threads)
+    args = parser.parse_args()
+
+    if not args.check_only:
+        export(args.model, args.out, args.opset)
+    ok = check(args.model, args.out, args.min_cosine, args.min_cosine_int8, args.samples, args.repeat, args.threads)
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
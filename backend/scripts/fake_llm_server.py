@@ -0,0 +1,128 @@
+"""
+Stand-in OpenAI-compatible LLM server for benchmarks and local runs.
+
+Answers /v1/chat/completions (plain and streamed) with a deterministic story
+turn in the schema the backend requests, taken from the mock provider's canned
+turns (app.services.mock_llm). Latency is a base delay plus a per-token
+generation rate, so load tests measure the backend and not a real model.
+Summary requests (no response_format) get a plain-text summary. Run from the
+backend directory:
+
+    python -m scripts.fake_llm_server [--port 8765] [--latency-ms 400] [--tokens-per-s 80]
+
+then point the backend at it with llm_type="openai_compatible" and
+openai_api_url="http://127.0.0.1:8765/v1/chat/completions".
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from dataclasses import dataclass
+from typing import AsyncIterator, List
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+from app.services.mock_llm import DEFAULT_RESPONSES, render_summary, render_turn
+
+
+@dataclass
+class FakeLLMConfig:
+    latency_ms: float = 400.0 # Time to first token
+    tokens_per_s: float = 80.0 # Generation speed after the first token
+    jitter: float = 0.2 # +/- share of random variation on both
+    chunk_tokens: int = 4 # Tokens per streamed delta
+    seed: int = 7
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+def _user_prompt(body: dict) -> str:
+    messages = [m for m in body.get("messages", []) if m.get("role") == "user"]
+    return str(messages[-1].get("content", "")) if messages else ""
+
+
+def create_app(config: FakeLLMConfig) -> FastAPI:
+    app = FastAPI(title="Fake LLM")
+    rng = random.Random(config.seed)
+    stats = {"requests": 0, "streams": 0}
+
+    def jittered(value: float) -> float:
+        return value * rng.uniform(1 - config.jitter, 1 + config.jitter)
+
+    def completion_text(body: dict) -> str:
+        if body.get("response_format"):
+            return json.dumps(render_turn(rng.choice(DEFAULT_RESPONSES), _user_prompt(body)), ensure_ascii=False)
+        return render_summary(_user_prompt(body))
+
+    def usage(body: dict, content: str) -> dict:
+        prompt = sum(_estimate_tokens(str(m.get("content", ""))) for m in body.get("messages", []))
+        completion = _estimate_tokens(content)
+        return {"prompt_tokens": prompt, "completion_tokens": completion, "total_tokens": prompt + completion}
+
+    async def stream_chunks(body: dict, content: str) -> AsyncIterator[str]:
+        await asyncio.sleep(jittered(config.latency_ms) / 1000)
+        step = config.chunk_tokens * 4 # ~4 characters per token
+        pieces: List[str] = [content[i:i + step] for i in range(0, len(content), step)]
+        delay = config.chunk_tokens / max(jittered(config.tokens_per_s), 1e-6)
+        for i, piece in enumerate(pieces):
+            if i:
+                await asyncio.sleep(delay)
+            chunk = {"choices": [{"index": 0, "delta": {"content": piece}}]}
+            yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage(body, content)}
+        yield f"data: {json.dumps(final)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        content = completion_text(body)
+        if body.get("stream"):
+            stats["streams"] += 1
+            return StreamingResponse(stream_chunks(body, content), media_type="text/event-stream")
+        generation_s = _estimate_tokens(content) / max(jittered(config.tokens_per_s), 1e-6)
+        await asyncio.sleep(jittered(config.latency_ms) / 1000 + generation_s)
+        return JSONResponse({
+            "id": f"fake-{stats['requests']}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage(body, content),
+        })
+
+    @app.get("/stats")
+    async def get_stats():
+        return stats
+
+    return app
+
+
+def add_arguments(parser: argparse.ArgumentParser):
+    """Fake LLM options, shared with the benchmark scripts."""
+    parser.add_argument("--latency-ms", type=float, default=400.0, help="Fake LLM time to first token")
+    parser.add_argument("--tokens-per-s", type=float, default=80.0, help="Fake LLM generation speed")
+    parser.add_argument("--jitter", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=7)
+
+def config_from_args(args: argparse.Namespace) -> FakeLLMConfig:
+    return FakeLLMConfig(latency_ms=args.latency_ms, tokens_per_s=args.tokens_per_s, jitter=args.jitter, seed=args.seed)
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_arguments(parser)
+    args = parser.parse_args()
+    uvicorn.run(create_app(config_from_args(args)), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,27 @@
+"""
+Chunks, embeds and indexes the tales into ChromaDB. Run from the backend directory:
+
+    python -m scripts.preprocess_tales [--source data/tales.jsonl] [--workers 0] [--rebuild]
+"""
+import argparse
+import hashlib
+import itertools
 import json
+import multiprocessing
 import chromadb
-from sentence_transformers import SentenceTransformer
+import numpy as np
 import os
 import re
+import sqlite3
+import time
+from collections import deque
+from functools import lru_cache
 import nltk
 from nltk.tokenize import sent_tokenize
 from dotenv import load_dotenv
 import logging
+from app.services.embedding_backend import BACKENDS, create_embedder
+from app.utils.chunking import CHUNKERS, create_chunker, token_spans_for
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -25,12 +40,30 @@ load_dotenv('../.env')  # Load environment variables from backend root
 SOURCE_JSON_PATH = 'data/german_tales.json'
 CHROMA_DB_PATH = os.getenv('CHROMA_DB_PATH', './chroma_db')  # Path to store DB files
 EMBEDDING_MODEL_NAME = 'paraphrase-multilingual-MiniLM-L12-v2' # "intfloat/multilingual-e5-large-instruct"# 'paraphrase-multilingual-MiniLM-L12-v2'  # Lighter and faster, or use multilingual models
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch') # or 'onnx' / 'onnx-int8', as in the backend's settings
+EMBEDDING_ONNX_PATH = os.getenv('EMBEDDING_ONNX_PATH', './models/embedding_onnx')
 # Alternatives: 'paraphrase-multilingual-MiniLM-L12-v2' for multilingual support
 
-# Chunking parameters
-MAX_CHUNK_SIZE = 600  # Maximum number of characters per chunk
-MIN_CHUNK_SIZE = 250  # Minimum chunk size
-CHUNK_OVERLAP = 100   # Character overlap between chunks
+# Chunking parameters, in tokens of the embedding model's tokenizer
+CHUNK_STRATEGY = 'sentence' # One of app.utils.chunking.CHUNKERS: sentence, paragraph, fixed
+MAX_CHUNK_TOKENS = 128 # The MiniLM model's max_seq_length; longer chunks would be truncated when embedded
+MIN_CHUNK_TOKENS = 48 # A shorter last chunk is extended into the previous one
+CHUNK_OVERLAP_TOKENS = 24 # Overlap between consecutive chunks
+
+# Touched after every index build so the backend drops its cached retrieval results
+INDEX_VERSION_FILE = 'index_version'
+# Name of the collection the backend reads; replaced atomically after a full rebuild
+ACTIVE_COLLECTION_FILE = 'active_collection'
+COLLECTION_NAME = os.getenv('CHROMA_COLLECTION_NAME', 'german_tales')
+# Chunk embeddings by content hash, so unchanged chunks are never re-embedded
+EMBEDDING_CACHE_FILE = 'embedding_cache.sqlite3'
+UPSERT_BATCH_SIZE = 512 # Chunks embedded and written per batch
+# Progress of an interrupted run over a source file, removed once a run completes
+CHECKPOINT_FILE = 'ingest_checkpoint.json'
+# Metadata of the tales done so far in that run, appended per batch (JSONL)
+METADATA_LOG_FILE = 'ingest_metadata.jsonl'
+JSON_READ_SIZE = 1 << 16
+EMBED_BATCH_SIZE = 32 # Sentences per forward pass of the embedding model
 
 tale_list = [
     {
@@ -76,207 +109,556 @@ Strukturell folgt die Geschichte einer klassischen Märchenform mit Einleitung,
     }
 ]
 
+def iter_json_array(f):
+    """Yields the items of a top-level JSON array without loading the whole file."""
+    decoder = json.JSONDecoder()
+    separators = re.compile(r'[\s,]*')
+    buffer = f.read(JSON_READ_SIZE)
+    pos = 0
+    started = eof = False
+    while True:
+        pos = separators.match(buffer, pos).end()
+        if pos >= len(buffer) - 1 and not eof:
+            more = f.read(JSON_READ_SIZE)
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+        if not started:
+            if buffer[pos:pos + 1] != '[':
+                raise ValueError("Expected a JSON array of tales")
+            started = True
+            pos += 1
+            continue
+        if pos >= len(buffer) or buffer[pos] == ']':
+            return
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            more = f.read(JSON_READ_SIZE) # Item continues past the buffer
+            eof = not more
+            buffer = buffer[pos:] + more
+            pos = 0
+            continue
+        yield item
+        pos = end
+
+def iter_tales(path):
+    """Tales from a JSON array or a JSONL file (one tale per line), read lazily."""
+    with open(path, 'r', encoding='utf-8') as f:
+        if path.endswith(('.jsonl', '.ndjson')):
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError as e:
+                    logger.warning(f"Skipping line {line_number} of {path}: {e}")
+                    yield {}
+        else:
+            yield from iter_json_array(f)
+
+def bounded_imap(pool, func, iterable, window):
+    """Like pool.imap, but keeps at most `window` items in flight instead of draining `iterable`."""
+    pending = deque()
+    for item in iterable:
+        pending.append(pool.apply_async(func, (item,)))
+        if len(pending) >= window:
+            yield pending.popleft().get()
+    while pending:
+        yield pending.popleft().get()
+
+def chunk_hash(text, embedding_key, chunker=None):
+    """
+    Content key of a chunk: its text and the embedding model and backend, plus the chunker setting for chunk IDs.
+    
+    Embedding cache keys leave the chunker out, since a text's vector does not
+    depend on how it was cut, so cached vectors survive a change of chunk sizes.
+    """
+    material = json.dumps([text, embedding_key] if chunker is None else [text, embedding_key, list(chunker)],
+                          ensure_ascii=False)
+    return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+def write_atomic(path, content):
+    """Writes a file via a temporary file and rename, so readers see the old or the new content."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+class EmbeddingCache:
+    """On-disk embeddings keyed by chunk hash (SQLite, float32 blobs)."""
+    
+    def __init__(self, path):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)")
+    
+    def get_many(self, keys):
+        found = {}
+        keys = list(keys)
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ",".join("?" * len(batch))
+            rows = self.conn.execute(f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch)
+            for key, blob in rows:
+                found[key] = np.frombuffer(blob, dtype=np.float32)
+        return found
+    
+    def put_many(self, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+            ((key, np.asarray(vector, dtype=np.float32).tobytes()) for key, vector in items)
+        )
+        self.conn.commit()
+    
+    def close(self):
+        self.conn.close()
+
+
 class TaleProcessor:
     """A class to handle the processing of fairy tales for semantic search."""
     
-    def __init__(self, embedding_model_name, chroma_db_path):
+    def __init__(self, embedding_model_name, chroma_db_path, workers=1, embed_batch_size=EMBED_BATCH_SIZE,
+                 chunker=(CHUNK_STRATEGY, MAX_CHUNK_TOKENS, MIN_CHUNK_TOKENS, CHUNK_OVERLAP_TOKENS),
+                 embedding_backend=EMBEDDING_BACKEND, onnx_path=EMBEDDING_ONNX_PATH):
         """Initialize the processor with model and database paths."""
         self.model_name = embedding_model_name
+        self.embedding_backend = embedding_backend
+        self.onnx_path = onnx_path
+        # Quantized vectors differ slightly, so each backend gets its own embedding cache entries
+        self.embedding_key = embedding_model_name if embedding_backend == 'torch' else f"{embedding_model_name}#{embedding_backend}"
         self.db_path = chroma_db_path
+        self.chunker = chunker # (strategy, max tokens, min tokens, overlap tokens)
+        self.workers = max(1, workers)
+        self.embed_batch_size = embed_batch_size
         self.model = None
+        self.encode_pool = None
         self.client = None
         self.collection = None
+        self.stats = {"embedded_chunks": 0, "embedded_tokens": 0, "embed_seconds": 0.0}
     
     def load_model(self):
-        """Load the sentence transformer model."""
-        logger.info(f"Loading embedding model '{self.model_name}'...")
-        self.model = SentenceTransformer(self.model_name)
-    
-    def setup_database(self, collection_name="german_tales", recreate=False):
-        """Set up ChromaDB and get/create collection."""
-        logger.info(f"Setting up ChromaDB persistent client at '{self.db_path}'...")
-        self.client = chromadb.PersistentClient(path=self.db_path)
+        """
+        Load the embedding model with the shared backend (app.services.embedding_backend).
         
-        # Get or create the collection
+        With workers > 1, torch encodes in that many sentence-transformers
+        processes and ONNX Runtime uses that many threads.
+        """
+        logger.info(f"Loading embedding model '{self.model_name}' ({self.embedding_backend} backend)...")
+        threads = self.workers if self.workers > 1 else 0
+        self.model = create_embedder(self.embedding_backend, self.model_name, self.onnx_path, threads)
+        if self.workers > 1 and self.embedding_backend == 'torch':
+            logger.info(f"Starting {self.workers} embedding processes...")
+            self.encode_pool = self.model.model.start_multi_process_pool(target_devices=['cpu'] * self.workers)
+    
+    def close_model(self):
+        if self.encode_pool is not None:
+            self.model.model.stop_multi_process_pool(self.encode_pool)
+            self.encode_pool = None
+    
+    def encode(self, texts):
+        """Embeds texts, in the multi-process pool if one is running, and tracks throughput."""
+        if self.model is None:
+            self.load_model()
+        start = time.perf_counter()
+        if self.encode_pool is not None:
+            vectors = self.model.model.encode_multi_process(texts, self.encode_pool, batch_size=self.embed_batch_size)
+        else:
+            vectors = self.model.encode(texts, batch_size=self.embed_batch_size)
+        self.stats["embed_seconds"] += time.perf_counter() - start
+        self.stats["embedded_chunks"] += len(texts)
+        self.stats["embedded_tokens"] += self.model.count_tokens(texts)
+        return vectors
+    
+    def active_collection_name(self, collection_name=COLLECTION_NAME):
+        """The collection the backend currently reads (set by the last full rebuild)."""
         try:
-            if recreate:
-                self.client.delete_collection(name=collection_name)
-                logger.info(f"Deleted existing collection '{collection_name}'.")
-                self.collection = self.client.create_collection(name=collection_name)
-                logger.info(f"Created new collection '{collection_name}'.")
-            else:
-                self.collection = self.client.get_collection(name=collection_name)
-                logger.info(f"Using existing collection '{collection_name}'.")
-        except Exception as e:
-            logger.info(f"Creating new collection '{collection_name}'. Error: {str(e)}")
-            self.collection = self.client.create_collection(name=collection_name)
-    
-    def chunk_text_by_sentences(self, text):
+            with open(os.path.join(self.db_path, ACTIVE_COLLECTION_FILE), encoding='utf-8') as f:
+                return f.read().strip() or collection_name
+        except OSError:
+            return collection_name
+    
+    def setup_database(self, collection_name=COLLECTION_NAME, rebuild=False, resume_collection=None):
         """
-        Chunk text by sentences with controlled size and overlap.
+        Set up ChromaDB and get the collection to write to.
         
-        This approach:
-        1. Splits text into sentences
-        2. Combines sentences into chunks respecting max size
-        3. Ensures overlap between chunks for context continuity
+        Incremental runs update the live collection in place. A rebuild fills a
+        new, empty collection that is swapped in by publish_collection() once
+        it is complete. `resume_collection` continues an interrupted run.
         """
-        # Clean the text: standardize line breaks, remove extra whitespace
-        text = re.sub(r'\r\n', '\n', text)
-        text = re.sub(r'\n{2,}', '\n\n', text)
-        text = re.sub(r' {2,}', ' ', text)
-        
-        # Get sentences using NLTK
-        sentences = sent_tokenize(text)
-        
-        if not sentences:
-            return []
-            
-        chunks = []
-        current_chunk = []
-        current_chunk_size = 0
-        
-        for sentence in sentences:
-            # Add sentence length plus a space
-            sentence_size = len(sentence) + 1
-            
-            # If adding this sentence would exceed max size and we have content, 
-            # save the current chunk and start a new one
-            if current_chunk_size + sentence_size > MAX_CHUNK_SIZE and current_chunk:
-                chunk_text = ' '.join(current_chunk)
-                chunks.append(chunk_text)
-                
-                # For overlap, keep some sentences from the end of the previous chunk
-                # Find how many sentences to keep for overlap
-                overlap_size = 0
-                overlap_sentences = []
-                
-                for s in reversed(current_chunk):
-                    if overlap_size + len(s) + 1 <= CHUNK_OVERLAP:
-                        overlap_sentences.insert(0, s)
-                        overlap_size += len(s) + 1
-                    else:
-                        break
-                
-                # Start new chunk with overlap
-                current_chunk = overlap_sentences
-                current_chunk_size = overlap_size
-            
-            # Add the current sentence to the chunk
-            current_chunk.append(sentence)
-            current_chunk_size += sentence_size
-        
-        # Add the last chunk if it has content and meets minimum size
-        if current_chunk and current_chunk_size >= MIN_CHUNK_SIZE:
-            chunk_text = ' '.join(current_chunk)
-            chunks.append(chunk_text)
+        logger.info(f"Setting up ChromaDB persistent client at '{self.db_path}'...")
+        self.client = chromadb.PersistentClient(path=self.db_path)
         
-        return chunks
+        if resume_collection:
+            self.collection = self.client.get_or_create_collection(name=resume_collection)
+            logger.info(f"Resuming into collection '{resume_collection}'.")
+        elif rebuild:
+            name = f"{collection_name}_{time.strftime('%Y%m%d%H%M%S')}"
+            self.collection = self.client.create_collection(name=name)
+            logger.info(f"Building new collection '{name}'.")
+        else:
+            name = self.active_collection_name(collection_name)
+            self.collection = self.client.get_or_create_collection(name=name)
+            logger.info(f"Updating collection '{name}' incrementally.")
     
-    def process_tales(self, tales):
-        """Process all tales into chunks and prepare for database insertion."""
-        all_chunks = []
-        all_metadatas = []
-        all_ids = []
-        tale_metadata = {}
-        
-        logger.info("Processing tales...")
-        for i, tale in enumerate(tales):
-            title = tale.get('title')
-            full_text = tale.get('full_text')
-            
-            if not title or not full_text:
-                logger.warning(f"Skipping tale index {i} due to missing title or full_text.")
-                continue
-            
-            logger.info(f"  Processing '{title}'...")
-            chunks = self.chunk_text_by_sentences(full_text)
-            
-            if not chunks:
-                logger.warning(f"No text chunks generated for '{title}'. Skipping.")
-                continue
-            
-            # Store metadata about the tale
-            tale_metadata[title] = {
-                "title": title,
-                "chunk_count": len(chunks),
-                "original_summary": tale.get('original_summary', "")
-            }
-            
-            # Prepare data for ChromaDB insertion
-            for j, chunk in enumerate(chunks):
-                chunk_id = f"{title.replace(' ', '_')}_{j:04d}"
-                
-                # Calculate position markers (beginning, middle, end)
-                position = "middle"
-                if j == 0:
-                    position = "beginning"
-                elif j == len(chunks) - 1:
-                    position = "end"
-                
-                all_chunks.append(chunk)
-                all_metadatas.append({
-                    "tale_title": title,
-                    "chunk_index": j,
-                    "position": position,
-                    "total_chunks": len(chunks)
-                })
-                all_ids.append(chunk_id)
+    def publish_collection(self, collection_name=COLLECTION_NAME):
+        """Points the backend at the freshly built collection and drops older generations."""
+        previous = self.active_collection_name(collection_name)
+        write_atomic(os.path.join(self.db_path, ACTIVE_COLLECTION_FILE), self.collection.name)
+        logger.info(f"Collection '{self.collection.name}' is now active.")
+        # The previous generation is kept until the next rebuild so in-flight queries can finish
+        for existing in self.client.list_collections():
+            name = getattr(existing, 'name', existing)
+            if name not in (self.collection.name, previous) and (
+                name == collection_name or name.startswith(f"{collection_name}_")
+            ):
+                self.client.delete_collection(name=name)
+                logger.info(f"Deleted old collection '{name}'.")
+    
+    def process_tales(self, tales, start=0):
+        """
+        Chunk tales lazily, in order, across `workers` processes.
         
-        return all_chunks, all_metadatas, all_ids, tale_metadata
+        Yields the result of prepare_tale() per tale, including None for a
+        skipped tale, so callers can count positions in the source. `start` is
+        the index of the first tale in the source.
+        """
+        jobs = ((i, tale, self.model_name, self.embedding_key, self.chunker) for i, tale in enumerate(tales, start))
+        if self.workers <= 1:
+            yield from map(prepare_tale, jobs)
+            return
+        with multiprocessing.Pool(self.workers) as pool:
+            yield from bounded_imap(pool, prepare_tale, jobs, self.workers * 4)
+    
+    def generate_embeddings(self, chunks, cache=None):
+        """Embeddings for the given chunks, encoding only those missing from the cache."""
+        keys = [chunk_hash(chunk, self.embedding_key) for chunk in chunks]
+        cached = cache.get_many(set(keys)) if cache is not None else {}
+        missing = sorted({key: chunk for key, chunk in zip(keys, chunks) if key not in cached}.items())
+        logger.info(f"Embeddings: {len(cached)} cached, {len(missing)} to generate.")
+        if missing:
+            vectors = self.encode([chunk for _, chunk in missing])
+            generated = dict(zip((key for key, _ in missing), vectors))
+            if cache is not None:
+                cache.put_many(generated.items())
+            cached.update(generated)
+        return [cached[key] for key in keys]
     
-    def generate_embeddings(self, chunks):
-        """Generate embeddings for all text chunks."""
-        logger.info(f"Generating embeddings for {len(chunks)} chunks...")
-        return self.model.encode(chunks, show_progress_bar=True)
+    def plan_changes(self, title, ids, metadatas):
+        """Splits a tale's chunks against the collection: (indexes to write, stale IDs to delete)."""
+        existing = self.collection.get(where={"tale_title": title}, include=['metadatas'])
+        existing_metadata = dict(zip(existing['ids'], existing.get('metadatas') or []))
+        to_write = [
+            i for i, (chunk_id, metadata) in enumerate(zip(ids, metadatas))
+            if existing_metadata.get(chunk_id) != metadata # New, or moved within its tale
+        ]
+        wanted = set(ids)
+        stale = [chunk_id for chunk_id in existing_metadata if chunk_id not in wanted]
+        return to_write, stale
+    
+    def find_removed_tales(self, titles):
+        """IDs of chunks belonging to tales that are no longer in the source."""
+        stale = []
+        offset = 0
+        while True:
+            page = self.collection.get(include=['metadatas'], limit=UPSERT_BATCH_SIZE, offset=offset)
+            if not page['ids']:
+                return stale
+            stale.extend(
+                chunk_id for chunk_id, metadata in zip(page['ids'], page['metadatas'])
+                if (metadata or {}).get('tale_title') not in titles
+            )
+            offset += len(page['ids'])
     
     def add_to_database(self, ids, embeddings, metadatas, chunks):
-        """Add all data to the ChromaDB collection."""
-        logger.info("Adding data to ChromaDB...")
-        self.collection.upsert(
-            ids=ids,
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas,
-            documents=chunks
-        )
+        """Upsert the given chunks into the ChromaDB collection in batches."""
+        logger.info(f"Writing {len(ids)} chunks to ChromaDB...")
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            end = start + UPSERT_BATCH_SIZE
+            self.collection.upsert(
+                ids=ids[start:end],
+                embeddings=[np.asarray(vector, dtype=np.float32).tolist() for vector in embeddings[start:end]],
+                metadatas=metadatas[start:end],
+                documents=chunks[start:end]
+            )
+    
+    def delete_from_database(self, ids):
+        """Remove stale chunks (after their replacements were written)."""
+        if not ids:
+            return
+        logger.info(f"Deleting {len(ids)} stale chunks from ChromaDB...")
+        for start in range(0, len(ids), UPSERT_BATCH_SIZE):
+            self.collection.delete(ids=ids[start:start + UPSERT_BATCH_SIZE])
+    
+    def mark_index_updated(self):
+        """Bump the index version marker that invalidates the backend's retrieval cache."""
+        version_path = os.path.join(self.db_path, INDEX_VERSION_FILE)
+        write_atomic(version_path, str(time.time()))
+        logger.info(f"Updated index version marker at {version_path}.")
+    
+    def load_metadata(self, metadata_path):
+        """Tale metadata saved by an earlier run, or {} if there is none."""
+        try:
+            with open(metadata_path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
     
     def save_metadata(self, tale_metadata, metadata_path):
         """Save tale metadata to a separate file."""
         logger.info(f"Saving tale metadata to {metadata_path}...")
-        os.makedirs(os.path.dirname(metadata_path), exist_ok=True)
-        with open(metadata_path, 'w', encoding='utf-8') as f:
-            json.dump(tale_metadata, f, ensure_ascii=False, indent=2)
-    
-    def run(self, tales, metadata_path='./app/services/tale_metadata.json', recreate_collection=False):
-        """Run the complete processing pipeline."""
-        self.load_model()
-        self.setup_database(recreate=recreate_collection)
+        write_atomic(metadata_path, json.dumps(tale_metadata, ensure_ascii=False, indent=2))
+    
+    def log_throughput(self, chunks, elapsed):
+        embed_seconds = self.stats['embed_seconds']
+        logger.info(f"Throughput with {self.workers} worker(s): {chunks / max(elapsed, 1e-9):.1f} chunks/s overall "
+                    f"({chunks} chunks in {elapsed:.1f}s).")
+        if self.stats['embedded_chunks']:
+            logger.info(f"Embedding: {self.stats['embedded_chunks'] / max(embed_seconds, 1e-9):.1f} chunks/s, "
+                        f"{self.stats['embedded_tokens'] / max(embed_seconds, 1e-9):.0f} tokens/s "
+                        f"({self.stats['embedded_chunks']} chunks in {embed_seconds:.1f}s).")
+    
+    def load_checkpoint(self, source, rebuild):
+        """The checkpoint of an interrupted run over the same source, if any."""
+        try:
+            with open(os.path.join(self.db_path, CHECKPOINT_FILE), encoding='utf-8') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if checkpoint.get('source') != source or checkpoint.get('rebuild') != rebuild:
+            logger.info("Ignoring checkpoint of a run with a different source or mode.")
+            return None
+        return checkpoint
+    
+    def save_checkpoint(self, checkpoint):
+        write_atomic(os.path.join(self.db_path, CHECKPOINT_FILE), json.dumps(checkpoint, ensure_ascii=False))
+    
+    def clear_checkpoint(self):
+        for name in (CHECKPOINT_FILE, METADATA_LOG_FILE):
+            try:
+                os.remove(os.path.join(self.db_path, name))
+            except OSError:
+                pass
+    
+    def append_tale_metadata(self, items, fresh=False):
+        """Appends (title, metadata) pairs to the run's metadata log; `fresh` starts a new log."""
+        os.makedirs(self.db_path, exist_ok=True)
+        with open(os.path.join(self.db_path, METADATA_LOG_FILE), 'w' if fresh else 'a', encoding='utf-8') as f:
+            for title, metadata in items:
+                f.write(json.dumps([title, metadata], ensure_ascii=False) + "\n")
+    
+    def load_tale_metadata(self):
+        """Tale metadata of the run so far; a tale logged twice (redone after an interruption) keeps its last entry."""
+        tale_metadata = {}
+        try:
+            with open(os.path.join(self.db_path, METADATA_LOG_FILE), encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        title, metadata = json.loads(line)
+                        tale_metadata[title] = metadata
+        except OSError:
+            pass
+        return tale_metadata
+    
+    def run(self, tales, metadata_path='./app/services/tale_metadata.json', rebuild=False, use_cache=True,
+            source=None, resume=True, batch_size=UPSERT_BATCH_SIZE, prune=False):
+        """
+        Run the processing pipeline.
+        
+        Tales are read lazily and their chunks are embedded and written in
+        batches of `batch_size`, so memory stays flat however large the corpus
+        is. After every batch the tales' metadata is appended to a log and a
+        checkpoint records how many tales of `source` are done; an interrupted
+        run skips that many tales of the source and resumes after them.
         
-        chunks, metadatas, ids, tale_metadata = self.process_tales(tales)
+        By default only new or changed chunks are embedded and written, and
+        stale chunks are deleted after their replacements, so the live
+        collection always holds a complete version of every tale. With
+        `rebuild`, everything goes into a new collection that replaces the live
+        one once it is complete.
         
-        if not chunks:
+        An incremental run adds to the index: tales that are not in `tales`
+        keep their chunks and metadata, so a source with a few new tales can be
+        ingested on its own. With `prune`, those other tales are deleted and
+        the metadata file lists only this source's tales (as after a rebuild).
+        """
+        checkpoint = self.load_checkpoint(source, rebuild) if resume and source else None
+        if checkpoint:
+            logger.info(f"Resuming after {checkpoint['tales_done']} tales of {source}.")
+            self.setup_database(resume_collection=checkpoint['collection'])
+        else:
+            self.setup_database(rebuild=rebuild)
+            checkpoint = {"source": source, "rebuild": rebuild, "collection": self.collection.name,
+                          "tales_done": 0, "changed": False}
+            self.append_tale_metadata([], fresh=True)
+        run_start = time.perf_counter()
+        
+        cache = EmbeddingCache(os.path.join(self.db_path, EMBEDDING_CACHE_FILE)) if use_cache else None
+        pending_chunks, pending_metadatas, pending_ids, pending_deletes, pending_tales = [], [], [], [], []
+        counts = {"tales": 0, "chunks": 0, "written": 0, "deleted": 0}
+        
+        def flush(tales_done):
+            if pending_ids:
+                embeddings = self.generate_embeddings(pending_chunks, cache)
+                self.add_to_database(pending_ids, embeddings, pending_metadatas, pending_chunks)
+            # Every tale queued so far is now fully written, so its stale chunks can go
+            self.delete_from_database(pending_deletes)
+            if pending_ids or pending_deletes:
+                checkpoint['changed'] = True
+            counts['written'] += len(pending_ids)
+            counts['deleted'] += len(pending_deletes)
+            # Logged before the checkpoint moves, so no tale counted as done lacks its metadata
+            self.append_tale_metadata(pending_tales)
+            for pending in (pending_chunks, pending_metadatas, pending_ids, pending_deletes, pending_tales):
+                pending.clear()
+            if source:
+                checkpoint['tales_done'] = tales_done
+                self.save_checkpoint(checkpoint)
+        
+        try:
+            # Tales done before an interruption are only read past, not chunked again
+            position = checkpoint['tales_done']
+            tales = itertools.islice(tales, position, None)
+            for position, processed in enumerate(self.process_tales(tales, position), start=position + 1):
+                if processed is None:
+                    continue
+                title, metadata, chunks, metadatas, ids = processed
+                pending_tales.append((title, metadata))
+                counts['tales'] += 1
+                counts['chunks'] += len(ids)
+                
+                to_write, stale = self.plan_changes(title, ids, metadatas)
+                pending_chunks.extend(chunks[i] for i in to_write)
+                pending_metadatas.extend(metadatas[i] for i in to_write)
+                pending_ids.extend(ids[i] for i in to_write)
+                pending_deletes.extend(stale)
+                if len(pending_ids) >= batch_size:
+                    flush(position)
+            flush(position)
+        finally:
+            if cache is not None:
+                cache.close()
+            self.close_model()
+        
+        tale_metadata = self.load_tale_metadata()
+        if not tale_metadata:
             logger.error("No valid chunks found to process. Exiting.")
             return False
         
-        embeddings = self.generate_embeddings(chunks)
-        self.add_to_database(ids, embeddings, metadatas, chunks)
+        removed = []
+        if prune and not rebuild:
+            removed = self.find_removed_tales(set(tale_metadata))
+            if removed:
+                logger.warning(f"Pruning {len(removed)} chunks of tales that are not in the source.")
+            self.delete_from_database(removed)
+            counts['deleted'] += len(removed)
+        elif not rebuild:
+            # Tales of earlier sources stay indexed, so they stay listed
+            tale_metadata = {**self.load_metadata(metadata_path), **tale_metadata}
+        if rebuild:
+            self.publish_collection()
         self.save_metadata(tale_metadata, metadata_path)
+        if checkpoint['changed'] or removed or rebuild:
+            self.mark_index_updated()
+        self.clear_checkpoint()
         
         logger.info("------------------------------------------")
         logger.info(f"Preprocessing complete.")
-        logger.info(f"Processed {len(tales)} tales.")
-        logger.info(f"Added {self.collection.count()} chunks to ChromaDB.")
+        logger.info(f"Processed {counts['tales']} tales ({counts['chunks']} chunks) in this run, "
+                    f"{len(tale_metadata)} in total.")
+        logger.info(f"Wrote {counts['written']} new or changed chunks, deleted {counts['deleted']} stale ones.")
+        self.log_throughput(counts['chunks'], time.perf_counter() - run_start)
+        logger.info(f"Collection '{self.collection.name}' holds {self.collection.count()} chunks.")
         logger.info(f"Database stored at: {self.db_path}")
         logger.info(f"Metadata stored at: {metadata_path}")
         logger.info("------------------------------------------")
         
         return True
 
+@lru_cache(maxsize=4)
+def get_chunker(model_name, strategy, max_tokens, min_tokens, overlap_tokens):
+    """One chunker per process and setting, sized with the embedding model's tokenizer."""
+    return create_chunker(
+        strategy,
+        max_tokens=max_tokens,
+        min_tokens=min_tokens,
+        overlap_tokens=overlap_tokens,
+        token_spans=token_spans_for(model_name),
+        split_sentences=sent_tokenize
+    )
+
+def prepare_tale(job):
+    """
+    Chunks one tale; job is (index in the source, tale, embedding model name, embedding key, chunker setting).
+    
+    Returns (title, tale metadata, chunks, chunk metadatas, chunk IDs), or
+    None for a tale that is skipped. Module-level so worker processes can run it.
+    """
+    i, tale, model_name, embedding_key, chunker = job
+    title = tale.get('title')
+    full_text = tale.get('full_text')
+    
+    if not title or not full_text:
+        logger.warning(f"Skipping tale index {i} due to missing title or full_text.")
+        return None
+    
+    logger.info(f"  Processing '{title}'...")
+    chunks = get_chunker(model_name, *chunker).chunk(full_text)
+    
+    if not chunks:
+        logger.warning(f"No text chunks generated for '{title}'. Skipping.")
+        return None
+    
+    # Store metadata about the tale
+    tale_metadata = {
+        "title": title,
+        "chunk_count": len(chunks),
+        "original_summary": tale.get('original_summary', "")
+    }
+    
+    # Prepare data for ChromaDB insertion; IDs follow the content, embedding backend and chunker setting,
+    # so unchanged chunks keep theirs and a backend switch rewrites every vector
+    metadatas = []
+    ids = []
+    seen_ids = {}
+    for j, chunk in enumerate(chunks):
+        chunk_id = f"{title.replace(' ', '_')}_{chunk_hash(chunk, embedding_key, chunker)[:16]}"
+        occurrence = seen_ids.get(chunk_id, 0)
+        seen_ids[chunk_id] = occurrence + 1
+        if occurrence:
+            chunk_id = f"{chunk_id}_{occurrence}" # Same text twice in one tale
+        
+        # Calculate position markers (beginning, middle, end)
+        position = "middle"
+        if j == 0:
+            position = "beginning"
+        elif j == len(chunks) - 1:
+            position = "end"
+        
+        metadatas.append({
+            "tale_title": title,
+            "chunk_index": j,
+            "position": position,
+            "total_chunks": len(chunks)
+        })
+        ids.append(chunk_id)
+    
+    return title, tale_metadata, chunks, metadatas, ids
+
 def add_tale_keywords(tales):
     """
     Extract keywords from tales to enhance search capabilities.
     This helps with both character names and important objects/concepts.
     """
     # Simple but effective keyword extraction - can be enhanced later
+    # Lazy, so tales streamed from a file are never all held in memory
     for tale in tales:
         text = tale.get("full_text", "")
         # Extract character names and important objects using regex patterns
@@ -284,23 +666,66 @@ def add_tale_keywords(tales):
         character_pattern = r'"([A-Z][a-z]+)"'  # Words in quotes starting with capital letters
         characters = set(re.findall(character_pattern, text))
         tale["keywords"] = list(characters)
-    return tales
+        yield tale
 
 def main():
     """Main entry point for the script."""
+    parser = argparse.ArgumentParser(description="Chunk, embed and index the tales into ChromaDB.")
+    parser.add_argument('--rebuild', action='store_true',
+                        help="Build a fresh collection and swap it in, instead of updating incrementally")
+    parser.add_argument('--no-cache', action='store_true', help="Ignore the on-disk embedding cache")
+    parser.add_argument('--source', default=None,
+                        help=f"JSON array or JSONL file of tales (default: {SOURCE_JSON_PATH} if present, "
+                             "else the built-in tale list). Indexed tales missing from it are kept unless "
+                             "--prune or --rebuild is given")
+    parser.add_argument('--prune', action='store_true',
+                        help="Delete indexed tales that are not in the source (incremental runs)")
+    parser.add_argument('--batch-size', type=int, default=UPSERT_BATCH_SIZE,
+                        help="Chunks embedded and written per batch")
+    parser.add_argument('--restart', action='store_true',
+                        help="Ignore the checkpoint of an interrupted run and start from the first tale")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Processes for chunking and embedding (0 = one per CPU core)")
+    parser.add_argument('--embed-batch-size', type=int, default=EMBED_BATCH_SIZE,
+                        help="Sentences per forward pass of the embedding model")
+    parser.add_argument('--embedding-backend', choices=BACKENDS, default=EMBEDDING_BACKEND,
+                        help="Embedding backend; onnx/onnx-int8 need an export from scripts.export_embedding_model")
+    parser.add_argument('--onnx-path', default=EMBEDDING_ONNX_PATH)
+    parser.add_argument('--chunker', choices=sorted(CHUNKERS), default=CHUNK_STRATEGY,
+                        help="Chunking strategy (compare them with scripts.benchmark_chunking)")
+    parser.add_argument('--max-tokens', type=int, default=MAX_CHUNK_TOKENS)
+    parser.add_argument('--min-tokens', type=int, default=MIN_CHUNK_TOKENS)
+    parser.add_argument('--overlap-tokens', type=int, default=CHUNK_OVERLAP_TOKENS)
+    args = parser.parse_args()
+    
     try:
-        # Could load from file instead of using the defined list
-        tales = add_tale_keywords(tale_list)
+        source = args.source or (SOURCE_JSON_PATH if os.path.exists(SOURCE_JSON_PATH) else None)
+        if source:
+            logger.info(f"Reading tales from {source}.")
+            tales = add_tale_keywords(iter_tales(source))
+            source = os.path.abspath(source)
+        else:
+            tales = add_tale_keywords(tale_list)
         
         processor = TaleProcessor(
             embedding_model_name=EMBEDDING_MODEL_NAME,
-            chroma_db_path=CHROMA_DB_PATH
+            chroma_db_path=CHROMA_DB_PATH,
+            workers=args.workers or os.cpu_count() or 1,
+            embed_batch_size=args.embed_batch_size,
+            chunker=(args.chunker, args.max_tokens, args.min_tokens, args.overlap_tokens),
+            embedding_backend=args.embedding_backend,
+            onnx_path=args.onnx_path
         )
         
         success = processor.run(
             tales=tales,
             metadata_path='./app/services/tale_metadata.json',
-            recreate_collection=True  # Set to False to append to existing collection
+            rebuild=args.rebuild,
+            use_cache=not args.no_cache,
+            source=source,
+            resume=not args.restart,
+            batch_size=args.batch_size,
+            prune=args.prune
         )
         
         if success: